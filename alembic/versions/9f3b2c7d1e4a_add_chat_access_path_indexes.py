@@ -0,0 +1,43 @@
+"""Add indexes for chat list, message history and chat session lookups
+
+Revision ID: 9f3b2c7d1e4a
+Revises: 53ec1520cd86
+Create Date: 2026-10-16 09:12:44.518203
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9f3b2c7d1e4a'
+down_revision = '53ec1520cd86'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        'ix_messages_chat_id_created_at_id',
+        'messages',
+        ['chat_id', 'created_at', 'id'],
+        unique=False
+    )
+    op.create_index(
+        'ix_chats_user_id_updated_at',
+        'chats',
+        ['user_id', 'updated_at'],
+        unique=False
+    )
+    op.create_index(
+        'ix_chat_sessions_chat_id',
+        'chat_sessions',
+        ['chat_id'],
+        unique=True
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_chat_sessions_chat_id', table_name='chat_sessions')
+    op.drop_index('ix_chats_user_id_updated_at', table_name='chats')
+    op.drop_index('ix_messages_chat_id_created_at_id', table_name='messages')
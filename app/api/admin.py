@@ -1,21 +1,72 @@
 from typing import List
 import httpx
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, status
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from app.core.database import get_db
-from app.api.deps import get_current_admin_user
+from app.core.database import get_db, get_async_db, get_pool_stats
+from app.api.deps import get_current_admin_user, get_mcp_service
 from app.models.user import User
 from app.services.llm_service import LLMService
 from app.services.mcp_service import MCPService
+from app.services.mcp_connections import mcp_connections
+from app.services.circuit_breaker import mcp_breakers
+from app.services.config_cache import config_cache
+from app.services.token_counter import backfill_token_counts
+from app.services.response_cache import response_cache
 from app.schemas.llm_model import LLMModelCreate, LLMModelUpdate, LLMModelResponse
 from app.schemas.mcp_server import MCPServerCreate, MCPServerUpdate, MCPServerResponse
+from app.schemas.user import UserUpdate, UserResponse
+from app.services.auth_service import AuthService
 from app.models.llm_model import LLMModel
 from app.models.mcp_server import MCPServer
 from app.core.config import settings
+from app.core.http import http_clients
+from app.api.websocket import manager as websocket_manager
 
 router = APIRouter(prefix="/admin", tags=["admin"])
 
 
+# User Management
+@router.put("/users/{user_id}", response_model=UserResponse)
+def update_user(
+    user_id: int,
+    user_update: UserUpdate,
+    current_user: User = Depends(get_current_admin_user),
+    db: Session = Depends(get_db)
+):
+    """Update a user, e.g. to deactivate or promote them"""
+    db_user = db.query(User).filter(User.id == user_id).first()
+    if not db_user:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="User not found"
+        )
+    
+    return AuthService.update_user(db, db_user, user_update)
+
+
+# Metrics
+@router.get("/metrics/db-pool")
+def get_db_pool_metrics(current_user: User = Depends(get_current_admin_user)):
+    """Database pool usage of this worker, alongside its open sockets"""
+    return {
+        "pools": get_pool_stats(),
+        "websocket_connections": sum(
+            len(connections) for connections in websocket_manager.user_connections.values()
+        ),
+    }
+
+
+@router.post("/maintenance/backfill-token-counts", status_code=status.HTTP_202_ACCEPTED)
+def start_token_count_backfill(
+    background_tasks: BackgroundTasks,
+    current_user: User = Depends(get_current_admin_user)
+):
+    """Store token counts on messages written before counts were recorded"""
+    background_tasks.add_task(backfill_token_counts)
+    return {"message": "Token count backfill started"}
+
+
 # LLM Model Management
 @router.post("/llm-models", response_model=LLMModelResponse)
 def create_llm_model(
@@ -57,6 +108,16 @@ def get_llm_model(
     return model
 
 
+@router.get("/llm-models/{model_id}/cache-stats")
+async def get_llm_model_cache_stats(
+    model_id: int,
+    current_user: User = Depends(get_current_admin_user)
+):
+    """Response cache hits and misses for an LLM model"""
+    stats = await response_cache.get_stats(model_id)
+    return {"hits": stats.get("hits", 0), "misses": stats.get("misses", 0)}
+
+
 @router.put("/llm-models/{model_id}", response_model=LLMModelResponse)
 def update_llm_model(
     model_id: int,
@@ -78,6 +139,7 @@ def update_llm_model(
     
     db.commit()
     db.refresh(db_model)
+    config_cache.invalidate("llm_model", model_id)
     return db_model
 
 
@@ -97,6 +159,7 @@ def delete_llm_model(
     
     db.delete(db_model)
     db.commit()
+    config_cache.invalidate("llm_model", model_id)
     return {"message": "LLM model deleted successfully"}
 
 
@@ -106,68 +169,68 @@ async def get_available_openai_models(
 ):
     """Get list of available OpenAI models"""
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                "https://api.openai.com/v1/models",
-                headers={
-                    "Authorization": f"Bearer {settings.OPENAI_API_KEY}",
-                    "Content-Type": "application/json"
-                }
-            )
-            response.raise_for_status()
-            data = response.json()
-            
-            # Filter and categorize models
-            models = data.get("data", [])
-            categorized_models = {
-                "chat_models": [],
-                "image_models": [],
-                "audio_models": [],
-                "embedding_models": [],
-                "other_models": []
-            }
-            
-            for model in models:
-                model_id = model.get("id", "")
-                
-                # Categorize models
-                if any(prefix in model_id for prefix in ["gpt-4", "gpt-3.5", "o1", "o3", "o4"]):
-                    categorized_models["chat_models"].append({
-                        "id": model_id,
-                        "created": model.get("created"),
-                        "owned_by": model.get("owned_by")
-                    })
-                elif "dall-e" in model_id or "gpt-image" in model_id:
-                    categorized_models["image_models"].append({
-                        "id": model_id,
-                        "created": model.get("created"),
-                        "owned_by": model.get("owned_by")
-                    })
-                elif any(prefix in model_id for prefix in ["tts-", "whisper-"]):
-                    categorized_models["audio_models"].append({
-                        "id": model_id,
-                        "created": model.get("created"),
-                        "owned_by": model.get("owned_by")
-                    })
-                elif "embedding" in model_id:
-                    categorized_models["embedding_models"].append({
-                        "id": model_id,
-                        "created": model.get("created"),
-                        "owned_by": model.get("owned_by")
-                    })
-                else:
-                    categorized_models["other_models"].append({
-                        "id": model_id,
-                        "created": model.get("created"),
-                        "owned_by": model.get("owned_by")
-                    })
-            
-            return {
-                "success": True,
-                "models": categorized_models,
-                "total_count": len(models)
+        client = http_clients.get_client("https://api.openai.com")
+        response = await client.get(
+            "https://api.openai.com/v1/models",
+            headers={
+                "Authorization": f"Bearer {settings.OPENAI_API_KEY}",
+                "Content-Type": "application/json"
             }
+        )
+        response.raise_for_status()
+        data = response.json()
+        
+        # Filter and categorize models
+        models = data.get("data", [])
+        categorized_models = {
+            "chat_models": [],
+            "image_models": [],
+            "audio_models": [],
+            "embedding_models": [],
+            "other_models": []
+        }
+        
+        for model in models:
+            model_id = model.get("id", "")
             
+            # Categorize models
+            if any(prefix in model_id for prefix in ["gpt-4", "gpt-3.5", "o1", "o3", "o4"]):
+                categorized_models["chat_models"].append({
+                    "id": model_id,
+                    "created": model.get("created"),
+                    "owned_by": model.get("owned_by")
+                })
+            elif "dall-e" in model_id or "gpt-image" in model_id:
+                categorized_models["image_models"].append({
+                    "id": model_id,
+                    "created": model.get("created"),
+                    "owned_by": model.get("owned_by")
+                })
+            elif any(prefix in model_id for prefix in ["tts-", "whisper-"]):
+                categorized_models["audio_models"].append({
+                    "id": model_id,
+                    "created": model.get("created"),
+                    "owned_by": model.get("owned_by")
+                })
+            elif "embedding" in model_id:
+                categorized_models["embedding_models"].append({
+                    "id": model_id,
+                    "created": model.get("created"),
+                    "owned_by": model.get("owned_by")
+                })
+            else:
+                categorized_models["other_models"].append({
+                    "id": model_id,
+                    "created": model.get("created"),
+                    "owned_by": model.get("owned_by")
+                })
+        
+        return {
+            "success": True,
+            "models": categorized_models,
+            "total_count": len(models)
+        }
+        
     except httpx.HTTPStatusError as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -225,6 +288,7 @@ def get_mcp_server(
 def update_mcp_server(
     server_id: int,
     server_update: MCPServerUpdate,
+    background_tasks: BackgroundTasks,
     current_user: User = Depends(get_current_admin_user),
     db: Session = Depends(get_db)
 ):
@@ -242,12 +306,18 @@ def update_mcp_server(
     
     db.commit()
     db.refresh(db_server)
+    config_cache.invalidate("mcp_server", server_id)
+
+    # Drop persistent connections and breaker state so the next call picks up the new settings
+    background_tasks.add_task(mcp_connections.close_server, server_id)
+    background_tasks.add_task(mcp_breakers.reset, server_id)
     return db_server
 
 
 @router.delete("/mcp-servers/{server_id}")
 def delete_mcp_server(
     server_id: int,
+    background_tasks: BackgroundTasks,
     current_user: User = Depends(get_current_admin_user),
     db: Session = Depends(get_db)
 ):
@@ -261,6 +331,9 @@ def delete_mcp_server(
     
     db.delete(db_server)
     db.commit()
+    config_cache.invalidate("mcp_server", server_id)
+    background_tasks.add_task(mcp_connections.close_server, server_id)
+    background_tasks.add_task(mcp_breakers.reset, server_id)
     return {"message": "MCP server deleted successfully"}
 
 
@@ -268,9 +341,18 @@ def delete_mcp_server(
 async def test_mcp_server(
     server_id: int,
     current_user: User = Depends(get_current_admin_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db),
+    mcp_service: MCPService = Depends(get_mcp_service)
 ):
     """Test connection to MCP server"""
-    mcp_service = MCPService()
     result = await mcp_service.test_server_connection(server_id, db)
-    return result 
\ No newline at end of file
+    return result
+
+
+@router.get("/mcp-servers/{server_id}/health")
+async def get_mcp_server_health(
+    server_id: int,
+    current_user: User = Depends(get_current_admin_user)
+):
+    """Circuit breaker state and recent error rate of an MCP server in this worker"""
+    return mcp_breakers.snapshot(server_id)
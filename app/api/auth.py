@@ -1,9 +1,11 @@
 from datetime import timedelta
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from app.core.database import get_db
-from app.services.auth_service import AuthService
+from app.core.config import settings
+from app.core.database import get_db, get_async_db
+from app.services.auth_service import AuthService, PasswordHasherBusy, login_rate_limiter
 from app.schemas.auth import Token, LoginRequest
 from app.schemas.user import UserCreate, UserResponse
 from app.api.deps import get_current_active_user
@@ -12,10 +14,10 @@ router = APIRouter(prefix="/auth", tags=["authentication"])
 
 
 @router.post("/register", response_model=UserResponse)
-def register(user: UserCreate, db: Session = Depends(get_db)):
+async def register(user: UserCreate, db: AsyncSession = Depends(get_async_db)):
     """Register a new user"""
     # Check if user already exists
-    db_user = AuthService.get_user_by_username(db, username=user.username)
+    db_user = await AuthService.get_user_by_username_async(db, username=user.username)
     if db_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -23,33 +25,62 @@ def register(user: UserCreate, db: Session = Depends(get_db)):
         )
     
     # Create new user
-    db_user = AuthService.create_user(db, user)
+    try:
+        db_user = await AuthService.create_user_async(db, user)
+    except PasswordHasherBusy:
+        raise _too_many_requests("Server is busy, please try again shortly")
     return db_user
 
 
 @router.post("/login", response_model=Token)
-def login(
+async def login(
     login_data: LoginRequest,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Login user and get access token"""
-    user = AuthService.authenticate_user(db, login_data.username, login_data.password)
+    if not await login_rate_limiter.allow(login_data.username):
+        raise _too_many_requests(
+            "Too many login attempts, please try again later",
+            retry_after=settings.LOGIN_ATTEMPT_WINDOW
+        )
+
+    try:
+        user = await AuthService.authenticate_user_async(db, login_data.username, login_data.password)
+    except PasswordHasherBusy:
+        raise _too_many_requests("Server is busy, please try again shortly")
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
+    if not user.is_active:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Inactive user"
+        )
     
     access_token_expires = timedelta(minutes=30)
     access_token = AuthService.create_access_token(
-        data={"sub": user.username}, expires_delta=access_token_expires
+        data=AuthService.token_claims(user), expires_delta=access_token_expires
     )
     
     return {"access_token": access_token, "token_type": "bearer"}
 
 
+def _too_many_requests(detail: str, retry_after: int = 1) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail=detail,
+        headers={"Retry-After": str(retry_after)},
+    )
+
+
 @router.get("/me", response_model=UserResponse)
-def get_current_user_info(current_user = Depends(get_current_active_user)):
+def get_current_user_info(
+    current_user = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+):
     """Get current user information"""
-    return current_user 
\ No newline at end of file
+    # A principal built from token claims has no profile fields
+    return AuthService.get_cached_user(db, current_user.username) 
\ No newline at end of file
@@ -1,10 +1,15 @@
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException, status
+import json
+import math
+from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from app.core.database import get_db
-from app.api.deps import get_current_active_user
+from app.core.database import get_db, get_async_db
+from app.api.deps import get_current_active_user, get_chat_service
 from app.models.user import User
 from app.services.chat_service import ChatService
+from app.services.llm_rate_limiter import LLMRateLimitExceeded
 from app.schemas.chat import ChatCreate, ChatResponse, MessageCreate, MessageResponse
 
 router = APIRouter(prefix="/chat", tags=["chat"])
@@ -14,10 +19,10 @@ router = APIRouter(prefix="/chat", tags=["chat"])
 def create_chat(
     chat: ChatCreate,
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    chat_service: ChatService = Depends(get_chat_service)
 ):
     """Create a new chat"""
-    chat_service = ChatService()
     db_chat = chat_service.create_chat(chat, current_user.id, db)
     return db_chat
 
@@ -25,10 +30,10 @@ def create_chat(
 @router.get("/", response_model=List[ChatResponse])
 def get_chats(
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    chat_service: ChatService = Depends(get_chat_service)
 ):
     """Get all chats for current user"""
-    chat_service = ChatService()
     chats = chat_service.get_user_chats(current_user.id, db)
     return chats
 
@@ -37,10 +42,10 @@ def get_chats(
 def get_chat(
     chat_id: int,
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    chat_service: ChatService = Depends(get_chat_service)
 ):
     """Get a specific chat"""
-    chat_service = ChatService()
     chat = chat_service.get_chat(chat_id, current_user.id, db)
     if not chat:
         raise HTTPException(
@@ -54,11 +59,30 @@ def get_chat(
 async def send_message(
     chat_id: int,
     message: MessageCreate,
+    request: Request,
+    stream: bool = False,
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db),
+    chat_service: ChatService = Depends(get_chat_service)
 ):
-    """Send a message to a chat"""
-    chat_service = ChatService()
+    """Send a message to a chat.
+
+    Pass ``stream=true`` or ``Accept: text/event-stream`` to receive the
+    response as server-sent ``chat_delta`` events followed by a final
+    ``chat_response`` event.
+    """
+    if stream or "text/event-stream" in request.headers.get("accept", ""):
+        if not await chat_service.get_chat_async(chat_id, current_user.id, db):
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Chat not found"
+            )
+        return StreamingResponse(
+            _stream_message_events(chat_service, chat_id, current_user.id, message.content, db),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
+
     try:
         response = await chat_service.send_message(
             chat_id, current_user.id, message.content, db
@@ -69,6 +93,12 @@ async def send_message(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=str(e)
         )
+    except LLMRateLimitExceeded as e:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=str(e),
+            headers={"Retry-After": str(math.ceil(e.retry_after))}
+        )
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -76,16 +106,45 @@ async def send_message(
         )
 
 
+async def _stream_message_events(
+    chat_service: ChatService,
+    chat_id: int,
+    user_id: int,
+    content: str,
+    db: AsyncSession
+):
+    """Format a streamed chat turn as server-sent events"""
+    try:
+        async for event in chat_service.stream_message(chat_id, user_id, content, db):
+            if event["type"] == "delta":
+                yield _sse("chat_delta", {"chat_id": chat_id, "content": event["content"]})
+            elif event["type"] == "done":
+                yield _sse("chat_response", {"chat_id": chat_id, "message": event["message"]})
+    except Exception as e:
+        yield _sse("error", {"message": f"Error sending message: {str(e)}"})
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
 @router.get("/{chat_id}/messages", response_model=List[dict])
 def get_chat_messages(
     chat_id: int,
-    limit: int = 50,
+    limit: int = Query(50, ge=1, le=200),
+    before: Optional[int] = None,
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    chat_service: ChatService = Depends(get_chat_service)
 ):
-    """Get messages for a chat"""
-    chat_service = ChatService()
-    messages = chat_service.get_chat_messages(chat_id, current_user.id, limit, db)
+    """Get the newest messages for a chat in chronological order.
+
+    To page further back, pass the id of the oldest message received as
+    ``before``.
+    """
+    messages = chat_service.get_chat_messages(
+        chat_id, current_user.id, limit, db, before_id=before
+    )
     return messages
 
 
@@ -93,10 +152,10 @@ def get_chat_messages(
 def delete_chat(
     chat_id: int,
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    chat_service: ChatService = Depends(get_chat_service)
 ):
     """Delete a chat"""
-    chat_service = ChatService()
     success = chat_service.delete_chat(chat_id, current_user.id, db)
     if not success:
         raise HTTPException(
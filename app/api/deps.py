@@ -1,8 +1,11 @@
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from sqlalchemy.orm import Session
+from starlette.requests import HTTPConnection
 from app.core.database import get_db
 from app.services.auth_service import AuthService
+from app.services.chat_service import ChatService
+from app.services.mcp_service import MCPService
 from app.models.user import User
 
 security = HTTPBearer()
@@ -23,7 +26,7 @@ def get_current_user(
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    user = AuthService.get_user_by_username(db, username=token_data.username)
+    user = AuthService.get_principal(db, token_data)
     if user is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -51,4 +54,13 @@ def get_current_admin_user(current_user: User = Depends(get_current_user)) -> Us
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Not enough permissions"
         )
-    return current_user 
\ No newline at end of file
+    return current_user 
+
+def get_chat_service(connection: HTTPConnection) -> ChatService:
+    """Get the application-wide chat service created at startup"""
+    return connection.app.state.chat_service
+
+
+def get_mcp_service(connection: HTTPConnection) -> MCPService:
+    """Get the application-wide MCP service created at startup"""
+    return connection.app.state.chat_service.mcp_service
@@ -1,34 +1,284 @@
+import asyncio
 import json
-from typing import Dict, Any
+import logging
+import uuid
+from contextlib import suppress
+from functools import partial
+from typing import Dict, Any, Awaitable, Callable, Optional, Set
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends, HTTPException
-from sqlalchemy.orm import Session
-from app.core.database import get_db
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal
+from app.core.redis import redis_clients
 from app.services.chat_service import ChatService
 from app.services.auth_service import AuthService
+from app.api.deps import get_chat_service
 from app.models.user import User
 
+logger = logging.getLogger(__name__)
+
 router = APIRouter()
 
+BROADCAST_CHANNEL = "ws:broadcast"
+
+
+class ClientConnection:
+    """One accepted socket with its own bounded send queue.
+
+    A writer task drains the queue, so fan-out only enqueues and a slow
+    client cannot hold up delivery to the others. A client whose queue
+    fills up is closed instead of buffering without limit.
+    """
+
+    def __init__(self, websocket: WebSocket, user_id: int):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.chat_ids: Set[int] = set()
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=settings.WS_SEND_QUEUE_SIZE)
+        self._writer_task: Optional[asyncio.Task] = None
+        self.closed = False
+
+    def start(self):
+        self._writer_task = asyncio.create_task(self._write())
+
+    async def send(self, message: str):
+        if self.closed:
+            return
+        try:
+            self._queue.put_nowait(message)
+        except asyncio.QueueFull:
+            logger.warning("WebSocket send queue full for user %s, closing connection", self.user_id)
+            await self.close(code=1013)
+
+    async def close(self, code: int = 1000):
+        if self.closed:
+            return
+        self.closed = True
+        if self._writer_task is not None and self._writer_task is not asyncio.current_task():
+            self._writer_task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._writer_task
+        with suppress(Exception):
+            await self.websocket.close(code=code)
+
+    async def _write(self):
+        try:
+            while True:
+                message = await self._queue.get()
+                await self.websocket.send_text(message)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # The receive loop notices the dead socket and disconnects it
+            self.closed = True
+
 
 class ConnectionManager:
+    """Tracks WebSocket connections and routes events to them across nodes.
+
+    Sockets live on the worker that accepted them; a user may hold several
+    (tabs, devices) and each socket subscribes to the chats it shows.
+    Events for a user or a chat go straight to local sockets and are also
+    published on Redis (``ws:user:{id}``, ``ws:chat:{id}``), so the nodes
+    holding the other sockets deliver them too. A node only subscribes to
+    the channels of users and chats it currently has sockets for.
+    """
+
     def __init__(self):
-        self.active_connections: Dict[int, WebSocket] = {}
+        self.node_id = uuid.uuid4().hex
+        self.user_connections: Dict[int, Set[ClientConnection]] = {}
+        self.chat_connections: Dict[int, Set[ClientConnection]] = {}
+        self._redis_client = None
+        self._pubsub = None
+        self._channels: Set[str] = set()
+        self._listener_task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        """Connect to the Redis backplane"""
+        if not settings.WS_BACKPLANE_ENABLED:
+            return
+        self._redis_client = redis_clients.async_client
+        self._channels.update({BROADCAST_CHANNEL, f"ws:node:{self.node_id}"})
+        self._listener_task = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        if self._listener_task is not None:
+            self._listener_task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._listener_task
+            self._listener_task = None
+        self._redis_client = None
 
-    async def connect(self, websocket: WebSocket, user_id: int):
+    async def connect(self, websocket: WebSocket, user_id: int) -> ClientConnection:
         await websocket.accept()
-        self.active_connections[user_id] = websocket
+        connection = ClientConnection(websocket, user_id)
+        connection.start()
+
+        connections = self.user_connections.setdefault(user_id, set())
+        if not connections:
+            await self._subscribe(f"ws:user:{user_id}")
+        connections.add(connection)
+        return connection
+
+    async def disconnect(self, connection: ClientConnection):
+        for chat_id in list(connection.chat_ids):
+            await self.unsubscribe(connection, chat_id)
+
+        connections = self.user_connections.get(connection.user_id)
+        if connections is not None:
+            connections.discard(connection)
+            if not connections:
+                del self.user_connections[connection.user_id]
+                await self._unsubscribe(f"ws:user:{connection.user_id}")
 
-    def disconnect(self, user_id: int):
-        if user_id in self.active_connections:
-            del self.active_connections[user_id]
+        await connection.close()
+
+    async def subscribe(self, connection: ClientConnection, chat_id: int):
+        """Route events for ``chat_id`` to this socket"""
+        connections = self.chat_connections.setdefault(chat_id, set())
+        if not connections:
+            await self._subscribe(f"ws:chat:{chat_id}")
+        connections.add(connection)
+        connection.chat_ids.add(chat_id)
+
+    async def unsubscribe(self, connection: ClientConnection, chat_id: int):
+        connection.chat_ids.discard(chat_id)
+        connections = self.chat_connections.get(chat_id)
+        if connections is None:
+            return
+        connections.discard(connection)
+        if not connections:
+            del self.chat_connections[chat_id]
+            await self._unsubscribe(f"ws:chat:{chat_id}")
 
     async def send_personal_message(self, message: str, user_id: int):
-        if user_id in self.active_connections:
-            await self.active_connections[user_id].send_text(message)
+        """Send to every socket of a user, on any node"""
+        await self._deliver(self.user_connections.get(user_id, ()), message)
+        await self._publish(f"ws:user:{user_id}", message)
+
+    async def broadcast_to_chat(self, message: str, chat_id: int, exclude_user_id: Optional[int] = None):
+        """Send to every socket subscribed to a chat, on any node"""
+        await self._deliver(self.chat_connections.get(chat_id, ()), message, exclude_user_id)
+        await self._publish(f"ws:chat:{chat_id}", message, exclude_user_id)
 
     async def broadcast(self, message: str):
-        for connection in self.active_connections.values():
-            await connection.send_text(message)
+        await self._deliver(self._all_connections(), message)
+        await self._publish(BROADCAST_CHANNEL, message)
+
+    def _all_connections(self):
+        return [connection for connections in self.user_connections.values() for connection in connections]
+
+    async def _deliver(self, connections, message: str, exclude_user_id: Optional[int] = None):
+        await asyncio.gather(*(
+            connection.send(message)
+            for connection in list(connections)
+            if connection.user_id != exclude_user_id
+        ))
+
+    async def _publish(self, channel: str, message: str, exclude_user_id: Optional[int] = None):
+        if self._redis_client is None:
+            return
+        try:
+            await self._redis_client.publish(channel, json.dumps({
+                "origin": self.node_id,
+                "message": message,
+                "exclude_user_id": exclude_user_id
+            }))
+        except Exception as e:
+            logger.warning("WebSocket backplane publish error: %s", e)
+
+    async def _subscribe(self, channel: str):
+        if self._redis_client is None or channel in self._channels:
+            return
+        self._channels.add(channel)
+        if self._pubsub is not None:
+            await self._pubsub.subscribe(channel)
+
+    async def _unsubscribe(self, channel: str):
+        if channel not in self._channels:
+            return
+        self._channels.discard(channel)
+        if self._pubsub is not None:
+            await self._pubsub.unsubscribe(channel)
+
+    async def _listen(self):
+        """Deliver events published by other nodes, resubscribing after errors"""
+        while True:
+            try:
+                self._pubsub = self._redis_client.pubsub()
+                await self._pubsub.subscribe(*self._channels)
+                async for raw in self._pubsub.listen():
+                    if raw["type"] != "message":
+                        continue
+                    data = json.loads(raw["data"])
+                    if data["origin"] == self.node_id:
+                        continue
+
+                    channel = raw["channel"].decode()
+                    if channel.startswith("ws:user:"):
+                        connections = self.user_connections.get(int(channel[len("ws:user:"):]), ())
+                    elif channel.startswith("ws:chat:"):
+                        connections = self.chat_connections.get(int(channel[len("ws:chat:"):]), ())
+                    elif channel == BROADCAST_CHANNEL:
+                        connections = self._all_connections()
+                    else:
+                        continue
+                    await self._deliver(connections, data["message"], data.get("exclude_user_id"))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("WebSocket backplane error: %s", e)
+                await asyncio.sleep(1)
+            finally:
+                if self._pubsub is not None:
+                    with suppress(Exception):
+                        await self._pubsub.close()
+                    self._pubsub = None
+
+
+class MessageDispatcher:
+    """Runs a socket's chat messages as background tasks.
+
+    Messages for the same chat are handled in arrival order. Different
+    chats run concurrently, up to ``WS_MAX_CONCURRENT_MESSAGES`` per
+    socket, so the receive loop stays free for pings and typing events.
+    Outstanding work is cancelled when the socket goes away.
+    """
+
+    def __init__(self):
+        self._semaphore = asyncio.Semaphore(settings.WS_MAX_CONCURRENT_MESSAGES)
+        self._chat_tails: Dict[int, asyncio.Task] = {}
+        self._tasks: Set[asyncio.Task] = set()
+
+    def dispatch(self, chat_id: int, handler: Callable[[], Awaitable[None]]) -> bool:
+        """Queue ``handler`` behind earlier work for the same chat"""
+        if len(self._tasks) >= settings.WS_MAX_PENDING_MESSAGES:
+            return False
+
+        task = asyncio.create_task(self._run(self._chat_tails.get(chat_id), handler))
+        self._chat_tails[chat_id] = task
+        self._tasks.add(task)
+        task.add_done_callback(lambda done: self._finish(chat_id, done))
+        return True
+
+    async def cancel_all(self):
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _run(self, previous: Optional[asyncio.Task], handler: Callable[[], Awaitable[None]]):
+        if previous is not None:
+            # wait() does not raise if the previous message failed or was cancelled
+            await asyncio.wait({previous})
+        async with self._semaphore:
+            await handler()
+
+    def _finish(self, chat_id: int, task: asyncio.Task):
+        self._tasks.discard(task)
+        if self._chat_tails.get(chat_id) is task:
+            del self._chat_tails[chat_id]
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning("WebSocket message task error: %s", task.exception())
 
 
 manager = ConnectionManager()
@@ -38,10 +288,11 @@ manager = ConnectionManager()
 async def websocket_endpoint(
     websocket: WebSocket, 
     user_id: int,
-    db: Session = Depends(get_db)
+    chat_service: ChatService = Depends(get_chat_service)
 ):
     """WebSocket endpoint for real-time chat"""
-    await manager.connect(websocket, user_id)
+    connection = await manager.connect(websocket, user_id)
+    dispatcher = MessageDispatcher()
     
     try:
         while True:
@@ -52,80 +303,163 @@ async def websocket_endpoint(
             message_type = message_data.get("type")
             
             if message_type == "chat_message":
-                await handle_chat_message(message_data, user_id, db)
+                chat_id = message_data.get("chat_id")
+                if not chat_id:
+                    continue
+                if not dispatcher.dispatch(
+                    chat_id,
+                    partial(handle_chat_message, message_data, connection, chat_service)
+                ):
+                    await connection.send(json.dumps({
+                        "type": "error",
+                        "chat_id": chat_id,
+                        "message": "Too many messages in progress"
+                    }))
             elif message_type == "typing":
-                await handle_typing_indicator(message_data, user_id)
+                await handle_typing_indicator(message_data, connection)
+            elif message_type == "subscribe":
+                await handle_subscribe(message_data, connection, chat_service)
+            elif message_type == "unsubscribe":
+                chat_id = message_data.get("chat_id")
+                if chat_id:
+                    await manager.unsubscribe(connection, chat_id)
             elif message_type == "ping":
-                await websocket.send_text(json.dumps({"type": "pong"}))
+                await connection.send(json.dumps({"type": "pong"}))
                 
     except WebSocketDisconnect:
-        manager.disconnect(user_id)
+        pass
     except Exception as e:
-        await websocket.send_text(json.dumps({
+        await connection.send(json.dumps({
             "type": "error",
             "message": str(e)
         }))
-        manager.disconnect(user_id)
+    finally:
+        await dispatcher.cancel_all()
+        await manager.disconnect(connection)
+
+
+async def handle_subscribe(
+    message_data: Dict[str, Any],
+    connection: ClientConnection,
+    chat_service: ChatService
+):
+    """Subscribe a socket to events of one of its user's chats"""
+    chat_id = message_data.get("chat_id")
+    if not chat_id:
+        return
+
+    async with AsyncSessionLocal() as db:
+        chat = await chat_service.get_chat_async(chat_id, connection.user_id, db)
+    if not chat:
+        await connection.send(json.dumps({
+            "type": "error",
+            "message": "Chat not found"
+        }))
+        return
 
+    await manager.subscribe(connection, chat_id)
+    await connection.send(json.dumps({
+        "type": "subscribed",
+        "chat_id": chat_id
+    }))
 
-async def handle_chat_message(message_data: Dict[str, Any], user_id: int, db: Session):
+
+async def handle_chat_message(
+    message_data: Dict[str, Any],
+    connection: ClientConnection,
+    chat_service: ChatService
+):
     """Handle incoming chat message"""
+    user_id = connection.user_id
     try:
         chat_id = message_data.get("chat_id")
         content = message_data.get("content")
         
         if not chat_id or not content:
             return
-        
-        # Send typing indicator
-        await manager.send_personal_message(
-            json.dumps({
-                "type": "typing",
-                "chat_id": chat_id,
-                "is_typing": True
-            }),
-            user_id
-        )
-        
-        # Process message
-        chat_service = ChatService()
-        response = await chat_service.send_message(chat_id, user_id, content, db)
-        
-        # Send response
-        await manager.send_personal_message(
-            json.dumps({
-                "type": "chat_response",
-                "chat_id": chat_id,
-                "message": response
-            }),
-            user_id
-        )
+
+        # The socket can stay open for hours, so each message checks out its
+        # own short-lived session instead of pinning one for the socket
+        async with AsyncSessionLocal() as db:
+            if chat_id not in connection.chat_ids:
+                chat = await chat_service.get_chat_async(chat_id, user_id, db)
+                if not chat:
+                    await connection.send(json.dumps({
+                        "type": "error",
+                        "chat_id": chat_id,
+                        "message": "Chat not found"
+                    }))
+                    return
+
+                # The sending socket always sees the reply; other subscribed
+                # sockets (tabs, devices) follow along
+                await manager.subscribe(connection, chat_id)
+
+            # Send typing indicator
+            await manager.broadcast_to_chat(
+                json.dumps({
+                    "type": "typing",
+                    "chat_id": chat_id,
+                    "is_typing": True
+                }),
+                chat_id
+            )
+
+            # Process message, forwarding deltas as they are generated
+            async for event in chat_service.stream_message(chat_id, user_id, content, db):
+                if event["type"] == "delta":
+                    await manager.broadcast_to_chat(
+                        json.dumps({
+                            "type": "chat_delta",
+                            "chat_id": chat_id,
+                            "content": event["content"]
+                        }),
+                        chat_id
+                    )
+                elif event["type"] == "done":
+                    # Send response
+                    await manager.broadcast_to_chat(
+                        json.dumps({
+                            "type": "chat_response",
+                            "chat_id": chat_id,
+                            "message": event["message"]
+                        }),
+                        chat_id
+                    )
         
         # Stop typing indicator
-        await manager.send_personal_message(
+        await manager.broadcast_to_chat(
             json.dumps({
                 "type": "typing",
                 "chat_id": chat_id,
                 "is_typing": False
             }),
-            user_id
+            chat_id
         )
         
     except Exception as e:
-        await manager.send_personal_message(
-            json.dumps({
-                "type": "error",
-                "message": str(e)
-            }),
-            user_id
-        )
+        await connection.send(json.dumps({
+            "type": "error",
+            "chat_id": message_data.get("chat_id"),
+            "message": str(e)
+        }))
 
 
-async def handle_typing_indicator(message_data: Dict[str, Any], user_id: int):
+async def handle_typing_indicator(message_data: Dict[str, Any], connection: ClientConnection):
     """Handle typing indicator"""
     chat_id = message_data.get("chat_id")
     is_typing = message_data.get("is_typing", False)
-    
-    # Broadcast typing indicator to other users in the same chat
-    # This would need to be implemented based on your chat room logic
-    pass 
\ No newline at end of file
+    if not chat_id or chat_id not in connection.chat_ids:
+        return
+
+    # Broadcast typing indicator to other users in the same chat, on any node
+    await manager.broadcast_to_chat(
+        json.dumps({
+            "type": "typing",
+            "chat_id": chat_id,
+            "user_id": connection.user_id,
+            "is_typing": is_typing
+        }),
+        chat_id,
+        exclude_user_id=connection.user_id
+    )
@@ -0,0 +1,46 @@
+import httpx
+from typing import Dict, Tuple
+from app.core.config import settings
+
+
+class HTTPClientRegistry:
+    """Application-scoped pool of httpx clients, one per upstream origin.
+
+    Reusing a client keeps TCP/TLS connections (and HTTP/2 streams) alive
+    between calls instead of paying a fresh handshake on every request.
+    """
+
+    def __init__(self):
+        self._clients: Dict[Tuple[str, str, int], httpx.AsyncClient] = {}
+
+    def get_client(self, url: str) -> httpx.AsyncClient:
+        """Get the shared client for the origin of ``url``"""
+        parsed = httpx.URL(url)
+        key = (parsed.scheme, parsed.host, parsed.port or 0)
+        client = self._clients.get(key)
+        if client is None or client.is_closed:
+            client = self._build_client(parsed.host)
+            self._clients[key] = client
+        return client
+
+    def _build_client(self, host: str) -> httpx.AsyncClient:
+        timeout = settings.HTTP_HOST_TIMEOUTS.get(host, settings.HTTP_TIMEOUT)
+        return httpx.AsyncClient(
+            http2=settings.HTTP_HTTP2,
+            limits=httpx.Limits(
+                max_connections=settings.HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=settings.HTTP_KEEPALIVE_EXPIRY
+            ),
+            timeout=httpx.Timeout(timeout, connect=settings.HTTP_CONNECT_TIMEOUT)
+        )
+
+    async def aclose(self) -> None:
+        """Close all pooled clients"""
+        clients = list(self._clients.values())
+        self._clients.clear()
+        for client in clients:
+            await client.aclose()
+
+
+http_clients = HTTPClientRegistry()
@@ -0,0 +1,45 @@
+import redis
+import redis.asyncio as aioredis
+from app.core.config import settings
+
+
+class RedisClientRegistry:
+    """Application-scoped Redis clients, one sync and one async pool per worker.
+
+    Every service borrows connections from these pools instead of opening
+    its own, so a worker holds a bounded number of Redis connections and
+    shutdown closes them in one place.
+    """
+
+    def __init__(self):
+        self._async_client = None
+        self._sync_client = None
+
+    @property
+    def async_client(self) -> aioredis.Redis:
+        if self._async_client is None:
+            self._async_client = aioredis.from_url(
+                settings.REDIS_URL, max_connections=settings.REDIS_MAX_CONNECTIONS
+            )
+        return self._async_client
+
+    @property
+    def sync_client(self) -> redis.Redis:
+        """For sync endpoints running in the threadpool"""
+        if self._sync_client is None:
+            self._sync_client = redis.from_url(
+                settings.REDIS_URL, max_connections=settings.REDIS_MAX_CONNECTIONS
+            )
+        return self._sync_client
+
+    async def aclose(self) -> None:
+        """Close both pools"""
+        if self._async_client is not None:
+            await self._async_client.close()
+            self._async_client = None
+        if self._sync_client is not None:
+            self._sync_client.close()
+            self._sync_client = None
+
+
+redis_clients = RedisClientRegistry()
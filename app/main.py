@@ -1,9 +1,21 @@
+import asyncio
+from contextlib import asynccontextmanager, suppress
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from app.core.config import settings
-from app.core.database import engine, Base
+from app.core.database import engine, async_engine, Base
+from app.core.http import http_clients
+from app.core.redis import redis_clients
+from app.services.mcp_connections import mcp_connections
+from app.services.circuit_breaker import mcp_breakers
+from app.services.chat_service import ChatService
+from app.services.post_response import post_response_pipeline
+from app.services.langfuse_service import langfuse_exporter
+from app.services.config_cache import config_cache
+from app.services.auth_service import password_hasher
 from app.api import auth_router, chat_router, admin_router, websocket_router
+from app.api.websocket import manager as websocket_manager
 
 # Import all models to ensure they are registered with SQLAlchemy
 from app.models import User, Chat, Message, LLMModel, MCPServer, ChatSession
@@ -11,13 +23,58 @@ from app.models import User, Chat, Message, LLMModel, MCPServer, ChatSession
 # Create database tables
 Base.metadata.create_all(bind=engine)
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Application startup and shutdown"""
+    # Services are shared by all requests; see app.api.deps
+    chat_service = ChatService()
+    app.state.chat_service = chat_service
+
+    # Write chat memory behind to Postgres in the background
+    write_behind_task = asyncio.create_task(chat_service.memory_service.run_write_behind())
+    # Replay post-response jobs that were deferred to Redis
+    replay_task = asyncio.create_task(post_response_pipeline.run_replay())
+    # Drop cached LLM/MCP config when any worker changes it
+    config_listener_task = asyncio.create_task(config_cache.run_listener())
+    # Route WebSocket events between workers
+    await websocket_manager.start()
+
+    yield
+
+    await websocket_manager.stop()
+    for task in (replay_task, config_listener_task):
+        task.cancel()
+        with suppress(asyncio.CancelledError):
+            await task
+    await post_response_pipeline.shutdown()
+
+    write_behind_task.cancel()
+    with suppress(asyncio.CancelledError):
+        await write_behind_task
+    await chat_service.close()
+
+    # Export any queued traces
+    await asyncio.to_thread(langfuse_exporter.shutdown)
+
+    password_hasher.shutdown()
+
+    # Close pooled outbound HTTP, MCP and Redis connections
+    await http_clients.aclose()
+    await mcp_connections.aclose()
+    await mcp_breakers.aclose()
+    await redis_clients.aclose()
+    await async_engine.dispose()
+
+
 # Create FastAPI app
 app = FastAPI(
     title=settings.APP_NAME,
     version=settings.VERSION,
     description="A modern desktop-like chat application with MCP server integration",
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    lifespan=lifespan
 )
 
 # Add CORS middleware
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, JSON
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, JSON, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from app.core.database import Base
@@ -6,6 +6,10 @@ from app.core.database import Base
 
 class Chat(Base):
     __tablename__ = "chats"
+    __table_args__ = (
+        # Chat list: WHERE user_id = ? ORDER BY updated_at DESC
+        Index("ix_chats_user_id_updated_at", "user_id", "updated_at"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String, nullable=False)
@@ -25,6 +29,10 @@ class Chat(Base):
 
 class Message(Base):
     __tablename__ = "messages"
+    __table_args__ = (
+        # History tail and keyset pages: WHERE chat_id = ? ORDER BY created_at, id
+        Index("ix_messages_chat_id_created_at_id", "chat_id", "created_at", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     chat_id = Column(Integer, ForeignKey("chats.id"), nullable=False)
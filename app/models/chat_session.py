@@ -9,7 +9,7 @@ class ChatSession(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     session_id = Column(String, unique=True, index=True, nullable=False)
-    chat_id = Column(Integer, ForeignKey("chats.id"), nullable=False)
+    chat_id = Column(Integer, ForeignKey("chats.id"), nullable=False, unique=True, index=True)
     memory_data = Column(JSON, nullable=True)  # Store conversation memory
     context = Column(Text, nullable=True)  # Current conversation context
     created_at = Column(DateTime(timezone=True), server_default=func.now())
@@ -9,6 +9,9 @@ class Token(BaseModel):
 
 class TokenData(BaseModel):
     username: Optional[str] = None
+    user_id: Optional[int] = None
+    is_admin: Optional[bool] = None
+    issued_at: Optional[float] = None
 
 
 class LoginRequest(BaseModel):
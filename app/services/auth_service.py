@@ -1,16 +1,95 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Any, Callable, Optional
 from jose import JWTError, jwt
 from passlib.context import CryptContext
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from app.core.config import settings
+from app.core.redis import redis_clients
 from app.models.user import User
 from app.schemas.auth import TokenData
-from app.schemas.user import UserCreate
+from app.schemas.user import UserCreate, UserUpdate
+from app.services.config_cache import config_cache, detached_copy
+
+logger = logging.getLogger(__name__)
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 
+class PasswordHasherBusy(Exception):
+    """Raised when the password hashing queue is full"""
+
+
+class PasswordHasher:
+    """Runs bcrypt on a small dedicated thread pool.
+
+    Hashing never runs on the event loop or in the threadpool that serves
+    other requests. Work beyond the pool plus PASSWORD_HASH_MAX_QUEUE is
+    rejected with PasswordHasherBusy instead of queueing without limit.
+    """
+
+    def __init__(self):
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._in_flight = 0
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=settings.PASSWORD_HASH_WORKERS,
+                thread_name_prefix="password-hash"
+            )
+        return self._executor
+
+    async def run(self, fn: Callable[..., Any], *args) -> Any:
+        if self._in_flight >= settings.PASSWORD_HASH_WORKERS + settings.PASSWORD_HASH_MAX_QUEUE:
+            raise PasswordHasherBusy()
+
+        self._in_flight += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                self._get_executor(), fn, *args
+            )
+        finally:
+            self._in_flight -= 1
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self.run(pwd_context.verify, plain_password, hashed_password)
+
+    async def hash(self, password: str) -> str:
+        return await self.run(pwd_context.hash, password)
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+class LoginRateLimiter:
+    """Fixed-window limit on password verification attempts per username, shared through Redis"""
+
+    async def allow(self, username: str) -> bool:
+        key = f"login_attempts:{username.lower()}"
+        try:
+            # One transaction, so a key is never left counting without a TTL
+            async with redis_clients.async_client.pipeline(transaction=True) as pipe:
+                pipe.incr(key)
+                pipe.expire(key, settings.LOGIN_ATTEMPT_WINDOW, nx=True)
+                attempts, _ = await pipe.execute()
+        except Exception as e:
+            # Fail open: Redis trouble must not lock everyone out
+            logger.warning("Login rate limiter error: %s", e)
+            return True
+        return attempts <= settings.LOGIN_MAX_ATTEMPTS
+
+
+password_hasher = PasswordHasher()
+login_rate_limiter = LoginRateLimiter()
+
+
 class AuthService:
     @staticmethod
     def verify_password(plain_password: str, hashed_password: str) -> bool:
@@ -27,7 +106,7 @@ class AuthService:
             expire = datetime.utcnow() + expires_delta
         else:
             expire = datetime.utcnow() + timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
-        to_encode.update({"exp": expire})
+        to_encode.update({"exp": expire, "iat": datetime.utcnow()})
         encoded_jwt = jwt.encode(to_encode, settings.JWT_SECRET_KEY, algorithm=settings.JWT_ALGORITHM)
         return encoded_jwt
 
@@ -38,7 +117,12 @@ class AuthService:
             username: str = payload.get("sub")
             if username is None:
                 return None
-            return TokenData(username=username)
+            return TokenData(
+                username=username,
+                user_id=payload.get("uid"),
+                is_admin=payload.get("adm"),
+                issued_at=payload.get("iat")
+            )
         except JWTError:
             return None
 
@@ -51,6 +135,16 @@ class AuthService:
             return None
         return user
 
+    @staticmethod
+    async def authenticate_user_async(db: AsyncSession, username: str, password: str) -> Optional[User]:
+        """Authenticate with bcrypt running on the password hashing pool"""
+        user = await AuthService.get_user_by_username_async(db, username)
+        if not user:
+            return None
+        if not await password_hasher.verify(password, user.hashed_password):
+            return None
+        return user
+
     @staticmethod
     def create_user(db: Session, user: UserCreate) -> User:
         hashed_password = AuthService.get_password_hash(user.password)
@@ -70,6 +164,87 @@ class AuthService:
         db.refresh(db_user)
         return db_user
 
+    @staticmethod
+    async def create_user_async(db: AsyncSession, user: UserCreate) -> User:
+        """Create a user with bcrypt running on the password hashing pool"""
+        hashed_password = await password_hasher.hash(user.password)
+        
+        # Check if this is the first user - make them admin
+        user_count = (await db.execute(select(func.count()).select_from(User))).scalar_one()
+        is_admin = user_count == 0  # First user becomes admin
+        
+        db_user = User(
+            username=user.username,
+            email=user.email,
+            hashed_password=hashed_password,
+            is_admin=is_admin
+        )
+        db.add(db_user)
+        await db.commit()
+        await db.refresh(db_user)
+        return db_user
+
     @staticmethod
     def get_user_by_username(db: Session, username: str) -> Optional[User]:
-        return db.query(User).filter(User.username == username).first() 
\ No newline at end of file
+        return db.query(User).filter(User.username == username).first()
+
+    @staticmethod
+    async def get_user_by_username_async(db: AsyncSession, username: str) -> Optional[User]:
+        result = await db.execute(select(User).where(User.username == username))
+        return result.scalars().first()
+
+    @staticmethod
+    def token_claims(user: User) -> dict:
+        """Claims for a new access token"""
+        claims = {"sub": user.username}
+        # Claims principals are always active, so inactive users never get them
+        if settings.JWT_EMBED_USER_CLAIMS and user.is_active:
+            claims.update({"uid": user.id, "adm": user.is_admin})
+        return claims
+
+    @staticmethod
+    def get_principal(db: Session, token_data: TokenData) -> Optional[User]:
+        """Resolve the user behind a token, avoiding the database when possible.
+
+        Tokens with embedded claims are trusted unless the user was changed
+        after the token was issued. Otherwise the user row comes from a
+        short-lived cache keyed by username.
+        """
+        if token_data.user_id is not None and token_data.issued_at is not None:
+            changed_at = config_cache.invalidated_at("user", token_data.username)
+            if changed_at is None or token_data.issued_at > changed_at:
+                return User(
+                    id=token_data.user_id,
+                    username=token_data.username,
+                    is_admin=bool(token_data.is_admin),
+                    is_active=True
+                )
+
+        return AuthService.get_cached_user(db, token_data.username)
+
+    @staticmethod
+    def get_cached_user(db: Session, username: str) -> Optional[User]:
+        def load() -> Optional[User]:
+            user = AuthService.get_user_by_username(db, username)
+            return detached_copy(user) if user else None
+
+        return config_cache.get_sync("user", username, load, ttl=settings.USER_CACHE_TTL)
+
+    @staticmethod
+    def update_user(db: Session, user: User, user_update: UserUpdate) -> User:
+        old_username = user.username
+        update_data = user_update.dict(exclude_unset=True)
+        password = update_data.pop("password", None)
+        if password:
+            user.hashed_password = AuthService.get_password_hash(password)
+        for field, value in update_data.items():
+            setattr(user, field, value)
+
+        db.commit()
+        db.refresh(user)
+
+        # Drop cached copies and distrust claims in tokens issued before now
+        config_cache.invalidate("user", old_username)
+        if user.username != old_username:
+            config_cache.invalidate("user", user.username)
+        return user 
\ No newline at end of file
@@ -1,6 +1,13 @@
+import asyncio
+import json
 import uuid
-from typing import Dict, Any, List, Optional
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple, AsyncIterator
+from sqlalchemy import select, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
+from app.core.database import AsyncSessionLocal
 from app.models.chat import Chat, Message
 from app.models.user import User
 from app.schemas.chat import ChatCreate, MessageCreate
@@ -8,6 +15,16 @@ from app.services.llm_service import LLMService
 from app.services.mcp_service import MCPService
 from app.services.memory_service import MemoryService
 from app.services.langfuse_service import LangfuseService
+from app.services.post_response import post_response_pipeline
+from app.services.prompt_builder import PromptBuilder
+from app.services.token_counter import TOKEN_COUNTS_KEY, token_counts
+
+# How a chat's MCP server is combined with the completion, set per server in
+# MCPServer.configuration["pipeline_mode"]:
+#   pre_llm  - called before the completion; its "context" is added to the prompt
+#   post_llm - called with the completion; may replace it ("enhanced_response")
+#   parallel - called alongside the completion; its result is stored with the reply
+MCP_PIPELINE_MODES = ("pre_llm", "post_llm", "parallel")
 
 
 class ChatService:
@@ -16,6 +33,11 @@ class ChatService:
         self.mcp_service = MCPService()
         self.memory_service = MemoryService()
         self.langfuse_service = LangfuseService()
+        self.prompt_builder = PromptBuilder(self.llm_service, self.memory_service)
+
+        post_response_pipeline.register("persist_message", self._persist_message_job)
+        post_response_pipeline.register("append_memory", self._append_memory_job)
+        post_response_pipeline.register("trace_chat_message", self._trace_chat_message_job)
 
     def create_chat(
         self, 
@@ -46,147 +68,123 @@ class ChatService:
             Chat.user_id == user_id
         ).first()
 
+    async def get_chat_async(self, chat_id: int, user_id: int, db: AsyncSession) -> Optional[Chat]:
+        """Get a specific chat without blocking the event loop"""
+        result = await db.execute(
+            select(Chat).where(
+                Chat.id == chat_id,
+                Chat.user_id == user_id
+            )
+        )
+        return result.scalars().first()
+
     async def send_message(
         self, 
         chat_id: int, 
         user_id: int, 
         message_content: str, 
-        db: Session
+        db: AsyncSession
     ) -> Dict[str, Any]:
         """Send a message and get response"""
         # Get chat
-        chat = self.get_chat(chat_id, user_id, db)
+        chat = await self.get_chat_async(chat_id, user_id, db)
         if not chat:
             raise ValueError("Chat not found")
 
         # Create trace ID for observability
         trace_id = str(uuid.uuid4())
 
+        mcp_task = None
         try:
-            # Save user message
-            user_message = Message(
-                chat_id=chat_id,
-                role="user",
-                content=message_content
+            history, messages = await self._start_turn(chat, message_content, db)
+            mcp_mode, mcp_task = await self._start_mcp(
+                chat, message_content, history, messages, trace_id, db
             )
-            db.add(user_message)
-            db.commit()
-
-            # Get conversation history
-            history = self.memory_service.get_conversation_history(chat_id, db=db)
-            
-            # Prepare messages for LLM
-            messages = []
-            for msg in history[-10:]:  # Last 10 messages for context
-                messages.append({
-                    "role": msg["role"],
-                    "content": msg["content"]
-                })
-            
-            # Add current user message
-            messages.append({
-                "role": "user",
-                "content": message_content
-            })
 
             # Get LLM response
             if not chat.llm_model_id:
-                # If no LLM model is assigned, return a default response
-                llm_response = {
-                    "content": "I'm sorry, but no AI model is configured for this chat. Please ask an admin to assign an LLM model to this chat.",
-                    "model": "none",
-                    "provider": "none",
-                    "usage": {}
-                }
+                llm_response = self._no_model_response()
             else:
                 llm_response = await self.llm_service.get_completion(
                     chat.llm_model_id,
                     messages,
-                    db
+                    db,
+                    cache_scope=self._cache_scope(chat)
                 )
 
-            # If MCP server is configured, try to enhance response
-            if chat.mcp_server_id:
-                try:
-                    # Call MCP server for additional context or tools
-                    mcp_result = await self.mcp_service.call_mcp_server(
-                        chat.mcp_server_id,
-                        "process_message",
-                        {
-                            "message": message_content,
-                            "context": history,
-                            "llm_response": llm_response["content"]
-                        },
-                        db
-                    )
-                    
-                    # Enhance response with MCP data if available
-                    if mcp_result and "enhanced_response" in mcp_result:
-                        llm_response["content"] = mcp_result["enhanced_response"]
-                    
-                    # Trace MCP call
-                    self.langfuse_service.trace_mcp_call(
-                        trace_id,
-                        f"MCP Server {chat.mcp_server_id}",
-                        "process_message",
-                        {"message": message_content},
-                        mcp_result,
-                        {"chat_id": chat_id}
-                    )
-                except Exception as e:
-                    # Log MCP error but continue with LLM response
-                    self.langfuse_service.trace_error(
-                        trace_id,
-                        str(e),
-                        "MCP_SERVER_ERROR",
-                        {"chat_id": chat_id, "mcp_server_id": chat.mcp_server_id}
-                    )
-
-            # Save assistant response
-            assistant_message = Message(
-                chat_id=chat_id,
-                role="assistant",
-                content=llm_response["content"],
-                message_metadata={
-                    "model": llm_response.get("model"),
-                    "provider": llm_response.get("provider"),
-                    "usage": llm_response.get("usage", {}),
-                    "trace_id": trace_id
-                }
+            return await self._complete_turn(
+                chat, user_id, message_content, history, llm_response, trace_id, db,
+                mcp_mode, mcp_task
             )
-            db.add(assistant_message)
-            db.commit()
 
-            # Update memory
-            self.memory_service.add_message_to_memory(
-                chat_id, "user", message_content, db=db
-            )
-            self.memory_service.add_message_to_memory(
-                chat_id, "assistant", llm_response["content"], 
-                metadata=llm_response.get("usage", {}), db=db
+        except Exception as e:
+            # Trace error
+            self.langfuse_service.trace_error(
+                trace_id,
+                str(e),
+                "CHAT_ERROR",
+                {"chat_id": chat_id, "user_id": user_id}
             )
+            raise
+        finally:
+            # Don't leave a parallel MCP call running after a failed turn
+            if mcp_task is not None:
+                mcp_task.cancel()
 
-            # Trace the chat message
-            self.langfuse_service.trace_chat_message(
-                trace_id,
-                chat_id,
-                message_content,
-                llm_response["content"],
-                {
-                    "model": llm_response.get("model"),
-                    "provider": llm_response.get("provider")
-                },
-                {"user_id": user_id}
+    async def stream_message(
+        self,
+        chat_id: int,
+        user_id: int,
+        message_content: str,
+        db: AsyncSession
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Send a message and stream the response.
+
+        Yields ``{"type": "delta", "content": ...}`` events while the model
+        generates, then a single ``{"type": "done", "message": ...}`` event
+        carrying the same payload ``send_message`` returns. The assistant
+        message is persisted once, after the stream completes.
+        """
+        # Get chat
+        chat = await self.get_chat_async(chat_id, user_id, db)
+        if not chat:
+            raise ValueError("Chat not found")
+
+        # Create trace ID for observability
+        trace_id = str(uuid.uuid4())
+
+        mcp_task = None
+        try:
+            history, messages = await self._start_turn(chat, message_content, db)
+            mcp_mode, mcp_task = await self._start_mcp(
+                chat, message_content, history, messages, trace_id, db
             )
 
-            return {
-                "message_id": assistant_message.id,
-                "content": llm_response["content"],
-                "model": llm_response.get("model"),
-                "provider": llm_response.get("provider"),
-                "usage": llm_response.get("usage", {}),
-                "trace_id": trace_id
-            }
+            # Stream LLM response
+            if not chat.llm_model_id:
+                llm_response = self._no_model_response()
+                yield {"type": "delta", "content": llm_response["content"]}
+            else:
+                llm_response = None
+                async for event in self.llm_service.stream_completion(
+                    chat.llm_model_id,
+                    messages,
+                    db,
+                    cache_scope=self._cache_scope(chat)
+                ):
+                    if event["type"] == "delta":
+                        yield event
+                    elif event["type"] == "completion":
+                        llm_response = event["response"]
+
+                if llm_response is None:
+                    raise Exception("LLM stream ended without a completion")
+
+            response = await self._complete_turn(
+                chat, user_id, message_content, history, llm_response, trace_id, db,
+                mcp_mode, mcp_task
+            )
+            yield {"type": "done", "message": response}
 
         except Exception as e:
             # Trace error
@@ -197,20 +195,293 @@ class ChatService:
                 {"chat_id": chat_id, "user_id": user_id}
             )
             raise
+        finally:
+            # Don't leave a parallel MCP call running after a failed turn
+            if mcp_task is not None:
+                mcp_task.cancel()
+
+    async def _start_turn(
+        self,
+        chat: Chat,
+        message_content: str,
+        db: AsyncSession
+    ) -> Tuple[List[Dict[str, Any]], List[Dict[str, str]]]:
+        """Save the user message and build the LLM prompt"""
+        # Let the previous turn's post-response writes land first
+        await post_response_pipeline.wait_for_chat(chat.id)
+
+        # Save user message
+        user_message = Message(
+            chat_id=chat.id,
+            role="user",
+            content=message_content,
+            message_metadata={TOKEN_COUNTS_KEY: token_counts(message_content)}
+        )
+        db.add(user_message)
+        await db.commit()
+
+        # Pack as much recent history as fits the model's context window
+        return await self.prompt_builder.build(
+            chat, message_content, db, exclude_message_id=user_message.id
+        )
+
+    async def _start_mcp(
+        self,
+        chat: Chat,
+        message_content: str,
+        history: List[Dict[str, Any]],
+        messages: List[Dict[str, str]],
+        trace_id: str,
+        db: AsyncSession
+    ) -> Tuple[Optional[str], Optional[asyncio.Task]]:
+        """Run the parts of the chat's MCP pipeline that precede the completion.
+
+        Returns the server's pipeline mode, and for ``parallel`` servers the
+        task to collect in ``_complete_turn``. ``pre_llm`` context is added
+        to ``messages`` in place.
+        """
+        if not chat.mcp_server_id:
+            return None, None
+
+        server = await self.mcp_service.get_server_async(chat.mcp_server_id, db)
+        configuration = (server.configuration if server else None) or {}
+        mode = configuration.get("pipeline_mode", "post_llm")
+        if mode not in MCP_PIPELINE_MODES:
+            mode = "post_llm"
+        if mode == "post_llm":
+            return mode, None
+
+        # Context servers only need the conversation, not the completion
+        method = configuration.get("context_method", "process_message")
+        params = {"message": message_content, "context": history}
+
+        if mode == "parallel":
+            return mode, asyncio.create_task(
+                self._call_mcp_in_session(chat, method, params, trace_id)
+            )
+
+        mcp_result = await self._call_mcp(chat, method, params, trace_id, db)
+        context = (mcp_result or {}).get("context")
+        if context:
+            messages.insert(0, {
+                "role": "system",
+                "content": context if isinstance(context, str) else json.dumps(context)
+            })
+        return mode, None
+
+    async def _call_mcp(
+        self,
+        chat: Chat,
+        method: str,
+        params: Dict[str, Any],
+        trace_id: str,
+        db: AsyncSession
+    ) -> Optional[Dict[str, Any]]:
+        """Call the chat's MCP server; errors are traced, not raised"""
+        try:
+            # Call MCP server for additional context or tools
+            mcp_result = await self.mcp_service.call_mcp_server(
+                chat.mcp_server_id,
+                method,
+                params,
+                db
+            )
+
+            # Trace MCP call
+            self.langfuse_service.trace_mcp_call(
+                trace_id,
+                f"MCP Server {chat.mcp_server_id}",
+                method,
+                {"message": params["message"]},
+                mcp_result,
+                {"chat_id": chat.id}
+            )
+            return mcp_result
+        except Exception as e:
+            # Log MCP error but continue with LLM response
+            self.langfuse_service.trace_error(
+                trace_id,
+                str(e),
+                "MCP_SERVER_ERROR",
+                {"chat_id": chat.id, "mcp_server_id": chat.mcp_server_id}
+            )
+            return None
+
+    async def _call_mcp_in_session(
+        self,
+        chat: Chat,
+        method: str,
+        params: Dict[str, Any],
+        trace_id: str
+    ) -> Optional[Dict[str, Any]]:
+        """``_call_mcp`` with its own session, for use alongside the completion"""
+        async with AsyncSessionLocal() as db:
+            return await self._call_mcp(chat, method, params, trace_id, db)
+
+    @staticmethod
+    def _cache_scope(chat: Chat) -> str:
+        """Response cache scope; chats only share responses on the same MCP server"""
+        return f"mcp_server:{chat.mcp_server_id or 0}"
+
+    @staticmethod
+    def _no_model_response() -> Dict[str, Any]:
+        """Default response when no LLM model is assigned to the chat"""
+        return {
+            "content": "I'm sorry, but no AI model is configured for this chat. Please ask an admin to assign an LLM model to this chat.",
+            "model": "none",
+            "provider": "none",
+            "usage": {}
+        }
+
+    async def _complete_turn(
+        self,
+        chat: Chat,
+        user_id: int,
+        message_content: str,
+        history: List[Dict[str, Any]],
+        llm_response: Dict[str, Any],
+        trace_id: str,
+        db: AsyncSession,
+        mcp_mode: Optional[str] = None,
+        mcp_task: Optional[asyncio.Task] = None
+    ) -> Dict[str, Any]:
+        """Enhance, persist and trace the assistant response"""
+        chat_id = chat.id
+        message_metadata = {
+            "model": llm_response.get("model"),
+            "provider": llm_response.get("provider"),
+            "usage": llm_response.get("usage", {}),
+            "trace_id": trace_id
+        }
+
+        if mcp_task is not None:
+            # Parallel MCP call, usually done by the time the completion is
+            mcp_result = await mcp_task
+            if mcp_result:
+                message_metadata["mcp"] = mcp_result
+        elif mcp_mode == "post_llm":
+            # Try to enhance the response
+            mcp_result = await self._call_mcp(
+                chat,
+                "process_message",
+                {
+                    "message": message_content,
+                    "context": history,
+                    "llm_response": llm_response["content"]
+                },
+                trace_id,
+                db
+            )
+
+            # Enhance response with MCP data if available
+            if mcp_result and "enhanced_response" in mcp_result:
+                llm_response["content"] = mcp_result["enhanced_response"]
+
+        if llm_response.get("cache"):
+            message_metadata["response_cache"] = llm_response["cache"]
+
+        # Count once on write so prompt budgeting never re-tokenizes history
+        message_metadata[TOKEN_COUNTS_KEY] = token_counts(
+            llm_response["content"], llm_response.get("usage"), llm_response.get("provider")
+        )
+
+        # Reserve the assistant message id now so it can be returned right
+        # away; the row itself is written by the post-response pipeline.
+        # The timestamp comes from the database clock, like the user message's.
+        assistant_message_id, assistant_created_at = (await db.execute(
+            text("SELECT nextval(pg_get_serial_sequence('messages', 'id')), now()")
+        )).one()
+        await db.commit()
+
+        post_response_pipeline.submit(chat_id, "persist_message", {
+            "id": assistant_message_id,
+            "chat_id": chat_id,
+            "role": "assistant",
+            "content": llm_response["content"],
+            "message_metadata": message_metadata,
+            "created_at": assistant_created_at.isoformat()
+        })
+
+        # Update memory
+        post_response_pipeline.submit(chat_id, "append_memory", {
+            "chat_id": chat_id,
+            "turn_id": assistant_message_id,
+            "entries": [
+                {"role": "user", "content": message_content, "metadata": {}},
+                {
+                    "role": "assistant",
+                    "content": llm_response["content"],
+                    "metadata": llm_response.get("usage", {})
+                }
+            ]
+        })
+
+        # Trace the chat message
+        post_response_pipeline.submit(chat_id, "trace_chat_message", {
+            "trace_id": trace_id,
+            "chat_id": chat_id,
+            "user_message": message_content,
+            "assistant_response": llm_response["content"],
+            "model_info": {
+                "model": llm_response.get("model"),
+                "provider": llm_response.get("provider")
+            },
+            "metadata": {"user_id": user_id}
+        })
+
+        return {
+            "message_id": assistant_message_id,
+            "content": llm_response["content"],
+            "model": llm_response.get("model"),
+            "provider": llm_response.get("provider"),
+            "usage": llm_response.get("usage", {}),
+            "trace_id": trace_id
+        }
+
+    async def _persist_message_job(self, payload: Dict[str, Any]) -> None:
+        """Insert a message row; safe to retry"""
+        async with AsyncSessionLocal() as db:
+            await db.execute(
+                pg_insert(Message)
+                .values(
+                    id=payload["id"],
+                    chat_id=payload["chat_id"],
+                    role=payload["role"],
+                    content=payload["content"],
+                    message_metadata=payload["message_metadata"],
+                    created_at=datetime.fromisoformat(payload["created_at"])
+                )
+                .on_conflict_do_nothing(index_elements=[Message.id])
+            )
+            await db.commit()
+
+    async def _append_memory_job(self, payload: Dict[str, Any]) -> None:
+        async with AsyncSessionLocal() as db:
+            await self.memory_service.add_messages_to_memory_async(
+                payload["chat_id"], payload["entries"], db=db, turn_id=payload.get("turn_id")
+            )
+
+    async def _trace_chat_message_job(self, payload: Dict[str, Any]) -> None:
+        self.langfuse_service.trace_chat_message(**payload)
+
+    async def close(self) -> None:
+        """Release connections held by the underlying services"""
+        await self.prompt_builder.close()
 
     def get_chat_messages(
         self, 
         chat_id: int, 
         user_id: int, 
         limit: int = 50, 
-        db: Session = None
+        db: Session = None,
+        before_id: Optional[int] = None
     ) -> List[Dict[str, Any]]:
-        """Get messages for a chat"""
+        """Get the newest messages for a chat, optionally older than ``before_id``"""
         chat = self.get_chat(chat_id, user_id, db)
         if not chat:
             return []
         
-        return self.memory_service.get_conversation_history(chat_id, limit, db)
+        return self.memory_service.get_conversation_history(chat_id, limit, db, before_id=before_id)
 
     def delete_chat(self, chat_id: int, user_id: int, db: Session) -> bool:
         """Delete a chat"""
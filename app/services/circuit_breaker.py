@@ -0,0 +1,171 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import suppress
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Set, Tuple
+from app.core.config import settings
+from app.models.mcp_server import MCPServer
+
+
+class MCPServerUnavailable(Exception):
+    """Raised instead of calling an MCP server whose circuit is open"""
+
+
+class CircuitBreaker:
+    """Error-rate circuit breaker for one MCP server.
+
+    Calls are recorded in a rolling window of ``MCP_BREAKER_WINDOW``
+    seconds, and calls slower than ``MCP_BREAKER_SLOW_CALL`` count as
+    failures. Once the window holds ``MCP_BREAKER_MIN_CALLS`` calls and the
+    failure rate reaches ``MCP_BREAKER_ERROR_RATE``, the circuit opens and
+    calls fail fast. After ``MCP_BREAKER_OPEN_DURATION`` seconds it goes
+    half-open and admits one real trial call; a background probe also checks
+    the server every ``MCP_BREAKER_OPEN_DURATION`` seconds. A successful
+    trial or probe closes the circuit, a failed trial opens it again.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, server_url: str, probe: Callable[[], Awaitable[bool]]):
+        self.server_url = server_url
+        self.state = self.CLOSED
+        self.opened_at: Optional[datetime] = None
+        self.last_error: Optional[str] = None
+        self._probe = probe
+        self._probe_task: Optional[asyncio.Task] = None
+        self._calls: Deque[Tuple[float, bool, float]] = deque()
+        self._opened_monotonic = 0.0
+        self._trial_started = 0.0
+
+    def allow(self) -> bool:
+        """Whether a call may go ahead; admits one trial call once open long enough"""
+        if self.state == self.CLOSED:
+            return True
+
+        now = time.monotonic()
+        if self.state == self.OPEN and now - self._opened_monotonic < settings.MCP_BREAKER_OPEN_DURATION:
+            return False
+        # A trial that never reported back (e.g. cancelled) does not block the next one
+        if self.state == self.HALF_OPEN and now - self._trial_started < settings.MCP_BREAKER_OPEN_DURATION:
+            return False
+        self.state = self.HALF_OPEN
+        self._trial_started = now
+        return True
+
+    def record(self, success: bool, latency: float, error: Optional[str] = None) -> None:
+        now = time.monotonic()
+        failed = not success or latency > settings.MCP_BREAKER_SLOW_CALL
+        if error:
+            self.last_error = error
+
+        if self.state == self.HALF_OPEN:
+            # The outcome of the trial call decides
+            if failed:
+                self._open()
+            else:
+                self._close()
+            return
+        if self.state == self.OPEN:
+            return
+
+        self._calls.append((now, failed, latency))
+        self._trim(now)
+        if len(self._calls) >= settings.MCP_BREAKER_MIN_CALLS:
+            if self._error_rate() >= settings.MCP_BREAKER_ERROR_RATE:
+                self._open()
+
+    def _trim(self, now: float) -> None:
+        while self._calls and now - self._calls[0][0] > settings.MCP_BREAKER_WINDOW:
+            self._calls.popleft()
+
+    def _error_rate(self) -> float:
+        if not self._calls:
+            return 0.0
+        return sum(1 for _, failed, _ in self._calls if failed) / len(self._calls)
+
+    def _open(self) -> None:
+        self.state = self.OPEN
+        self.opened_at = datetime.now(timezone.utc)
+        self._opened_monotonic = time.monotonic()
+        if self._probe_task is None or self._probe_task.done():
+            self._probe_task = asyncio.create_task(self._probe_until_closed())
+
+    def _close(self) -> None:
+        self.state = self.CLOSED
+        self.opened_at = None
+        self._calls.clear()
+
+    async def _probe_until_closed(self) -> None:
+        while self.state != self.CLOSED:
+            await asyncio.sleep(settings.MCP_BREAKER_OPEN_DURATION)
+            if self.state != self.OPEN:
+                # Closed meanwhile, or a trial call is deciding
+                continue
+            try:
+                healthy = await asyncio.wait_for(self._probe(), settings.MCP_BREAKER_PROBE_TIMEOUT)
+            except Exception as e:
+                healthy = False
+                self.last_error = str(e) or type(e).__name__
+
+            if healthy and self.state == self.OPEN:
+                self._close()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Current state and rolling-window stats"""
+        self._trim(time.monotonic())
+        latencies = sorted(latency for _, _, latency in self._calls)
+        return {
+            "state": self.state,
+            "opened_at": self.opened_at.isoformat() if self.opened_at else None,
+            "calls": len(self._calls),
+            "error_rate": round(self._error_rate(), 3),
+            "p95_latency": round(latencies[int(0.95 * (len(latencies) - 1))], 3) if latencies else None,
+            "last_error": self.last_error,
+            "window_seconds": settings.MCP_BREAKER_WINDOW,
+        }
+
+    async def aclose(self) -> None:
+        if self._probe_task is not None:
+            self._probe_task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._probe_task
+            self._probe_task = None
+
+
+class CircuitBreakerRegistry:
+    """One breaker per MCP server in this worker, replaced when its URL changes"""
+
+    def __init__(self):
+        self._breakers: Dict[int, CircuitBreaker] = {}
+        self._closing: Set[asyncio.Task] = set()
+
+    def get(self, server: MCPServer, probe: Callable[[], Awaitable[bool]]) -> CircuitBreaker:
+        breaker = self._breakers.get(server.id)
+        if breaker is None or breaker.server_url != server.server_url:
+            if breaker is not None:
+                task = asyncio.create_task(breaker.aclose())
+                self._closing.add(task)
+                task.add_done_callback(self._closing.discard)
+            breaker = self._breakers[server.id] = CircuitBreaker(server.server_url, probe)
+        return breaker
+
+    def snapshot(self, server_id: int) -> Dict[str, Any]:
+        breaker = self._breakers.get(server_id)
+        if breaker is None:
+            return {"state": CircuitBreaker.CLOSED, "calls": 0}
+        return breaker.snapshot()
+
+    async def reset(self, server_id: int) -> None:
+        breaker = self._breakers.pop(server_id, None)
+        if breaker is not None:
+            await breaker.aclose()
+
+    async def aclose(self) -> None:
+        for server_id in list(self._breakers):
+            await self.reset(server_id)
+
+
+mcp_breakers = CircuitBreakerRegistry()
@@ -0,0 +1,170 @@
+import asyncio
+import copy
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+from sqlalchemy import inspect
+from app.core.config import settings
+from app.core.redis import redis_clients
+
+logger = logging.getLogger(__name__)
+
+INVALIDATION_CHANNEL = "config_cache:invalidate"
+INVALIDATED_AT_KEY = "config_cache:invalidated_at"
+
+CacheKey = Tuple[str, Hashable]
+
+
+def detached_copy(obj: Any) -> Any:
+    """Copy the column values of an ORM row into a new, session-less instance"""
+    mapper = inspect(obj).mapper
+    return mapper.class_(**{
+        attr.key: copy.deepcopy(getattr(obj, attr.key))
+        for attr in mapper.column_attrs
+    })
+
+
+class ConfigCache:
+    """Read-through TTL/LRU cache for admin-managed rows (models, servers, users).
+
+    Every key has a local version stamp that is bumped on invalidation. A
+    load only populates the cache if the stamp is unchanged when it
+    finishes, so a concurrent invalidation cannot be overwritten by a stale
+    read. Invalidations are published on Redis so every worker drops its
+    copy. If the subscription drops, the whole cache is cleared. Each
+    invalidation's time is also kept in a Redis hash, so callers can tell
+    whether something issued earlier, such as a token's claims, is stale.
+    """
+
+    def __init__(self):
+        self._entries: "OrderedDict[CacheKey, Tuple[float, Any]]" = OrderedDict()
+        self._versions: Dict[CacheKey, int] = {}
+        self._generation = 0
+        self._invalidated_at: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def _lookup(self, cache_key: CacheKey) -> Tuple[bool, Any, Tuple[int, int]]:
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(cache_key)
+                return True, entry[1], (0, 0)
+            return False, None, (self._generation, self._versions.get(cache_key, 0))
+
+    def _store(self, cache_key: CacheKey, value: Any, stamp: Tuple[int, int], ttl: Optional[float]) -> None:
+        with self._lock:
+            if stamp != (self._generation, self._versions.get(cache_key, 0)):
+                return
+            expires_at = time.monotonic() + (ttl if ttl is not None else settings.CONFIG_CACHE_TTL)
+            self._entries[cache_key] = (expires_at, value)
+            self._entries.move_to_end(cache_key)
+            while len(self._entries) > settings.CONFIG_CACHE_MAX_ENTRIES:
+                self._entries.popitem(last=False)
+
+    async def get(
+        self,
+        kind: str,
+        key: Hashable,
+        loader: Callable[[], Awaitable[Optional[Any]]],
+        ttl: Optional[float] = None
+    ) -> Optional[Any]:
+        """Get a cached row, calling ``loader`` on a miss or after expiry"""
+        cache_key = (kind, key)
+        hit, value, stamp = self._lookup(cache_key)
+        if hit:
+            return value
+
+        value = await loader()
+        if value is not None:
+            self._store(cache_key, value, stamp, ttl)
+        return value
+
+    def get_sync(
+        self,
+        kind: str,
+        key: Hashable,
+        loader: Callable[[], Optional[Any]],
+        ttl: Optional[float] = None
+    ) -> Optional[Any]:
+        """Like ``get`` for sync callers running in the threadpool"""
+        cache_key = (kind, key)
+        hit, value, stamp = self._lookup(cache_key)
+        if hit:
+            return value
+
+        value = loader()
+        if value is not None:
+            self._store(cache_key, value, stamp, ttl)
+        return value
+
+    def invalidated_at(self, kind: str, key: Hashable) -> Optional[float]:
+        """Wall-clock time of the last known invalidation of a key"""
+        return self._invalidated_at.get(f"{kind}:{key}")
+
+    def _drop(self, kind: str, key: Hashable, invalidated_at: Optional[float] = None) -> None:
+        cache_key = (kind, key)
+        with self._lock:
+            self._versions[cache_key] = self._versions.get(cache_key, 0) + 1
+            self._entries.pop(cache_key, None)
+            if invalidated_at is not None:
+                self._invalidated_at[f"{kind}:{key}"] = invalidated_at
+
+    def clear(self) -> None:
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def invalidate(self, kind: str, key: Hashable) -> None:
+        """Drop a row here and tell the other workers to drop it too"""
+        now = time.time()
+        self._drop(kind, key, now)
+        try:
+            pipe = redis_clients.sync_client.pipeline(transaction=False)
+            pipe.hset(INVALIDATED_AT_KEY, f"{kind}:{key}", now)
+            pipe.publish(
+                INVALIDATION_CHANNEL, json.dumps({"kind": kind, "key": key, "at": now})
+            )
+            pipe.execute()
+        except Exception as e:
+            logger.warning("Config cache invalidation publish error: %s", e)
+
+    async def _load_invalidated_at(self, client) -> None:
+        horizon = time.time() - settings.CONFIG_CACHE_STAMP_RETENTION
+        stamps = await client.hgetall(INVALIDATED_AT_KEY)
+        expired = []
+        for field, value in stamps.items():
+            field, value = field.decode(), float(value)
+            if value < horizon:
+                expired.append(field)
+            else:
+                self._invalidated_at[field] = max(value, self._invalidated_at.get(field, 0))
+        if expired:
+            await client.hdel(INVALIDATED_AT_KEY, *expired)
+
+    async def run_listener(self) -> None:
+        """Apply invalidations published by other workers until cancelled"""
+        while True:
+            client = redis_clients.async_client
+            try:
+                async with client.pubsub() as pubsub:
+                    await pubsub.subscribe(INVALIDATION_CHANNEL)
+                    # Anything published before we (re)subscribed may have been missed
+                    self.clear()
+                    await self._load_invalidated_at(client)
+                    async for message in pubsub.listen():
+                        if message["type"] != "message":
+                            continue
+                        data = json.loads(message["data"])
+                        self._drop(data["kind"], data["key"], data.get("at"))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Config cache listener error: %s", e)
+                self.clear()
+                await asyncio.sleep(1)
+
+
+config_cache = ConfigCache()
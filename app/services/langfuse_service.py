@@ -1,18 +1,128 @@
+import hashlib
+import logging
+import queue
+import threading
 from langfuse import Langfuse
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, Tuple
 from app.core.config import settings
 
+logger = logging.getLogger(__name__)
+
+
+class LangfuseExporter:
+    """Bounded, batched, background export of tracing events to Langfuse.
+
+    Callers only enqueue events, so a slow or unreachable Langfuse never
+    adds latency to a request. When the queue is full, new events are
+    dropped and counted. Traces are head-sampled by trace id, so every
+    event of a sampled turn is kept together. Error events are always kept.
+    """
 
-class LangfuseService:
     def __init__(self):
-        if settings.LANGFUSE_PUBLIC_KEY and settings.LANGFUSE_SECRET_KEY:
-            self.langfuse = Langfuse(
+        self._queue: "queue.Queue[Tuple[str, Dict[str, Any]]]" = queue.Queue(
+            maxsize=settings.LANGFUSE_QUEUE_SIZE
+        )
+        self._langfuse: Optional[Langfuse] = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self.stats = {"enqueued": 0, "exported": 0, "dropped": 0, "sampled_out": 0, "errors": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return bool(settings.LANGFUSE_PUBLIC_KEY and settings.LANGFUSE_SECRET_KEY)
+
+    def is_sampled(self, trace_id: str) -> bool:
+        rate = settings.LANGFUSE_SAMPLE_RATE
+        if rate >= 1.0:
+            return True
+        if rate <= 0.0:
+            return False
+        bucket = int(hashlib.sha1(trace_id.encode()).hexdigest()[:8], 16)
+        return bucket / 0xFFFFFFFF < rate
+
+    def enqueue(self, kind: str, trace_id: str, always: bool = False, **fields) -> None:
+        """Queue a ``trace``, ``span`` or ``generation`` event for export"""
+        if not self.enabled:
+            return
+        if not always and not self.is_sampled(trace_id):
+            self.stats["sampled_out"] += 1
+            return
+
+        if kind == "trace":
+            fields["id"] = trace_id
+        else:
+            fields["trace_id"] = trace_id
+
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((kind, fields))
+            self.stats["enqueued"] += 1
+        except queue.Full:
+            self.stats["dropped"] += 1
+
+    def _ensure_started(self) -> None:
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._langfuse = Langfuse(
                 public_key=settings.LANGFUSE_PUBLIC_KEY,
                 secret_key=settings.LANGFUSE_SECRET_KEY,
                 host=settings.LANGFUSE_HOST
             )
-        else:
-            self.langfuse = None
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="langfuse-exporter", daemon=True
+            )
+            self._thread.start()
+
+    def _run(self) -> None:
+        while not (self._stop.is_set() and self._queue.empty()):
+            try:
+                batch = [self._queue.get(timeout=settings.LANGFUSE_FLUSH_INTERVAL)]
+            except queue.Empty:
+                continue
+
+            while len(batch) < settings.LANGFUSE_BATCH_SIZE:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            for kind, fields in batch:
+                try:
+                    getattr(self._langfuse, kind)(**fields)
+                    self.stats["exported"] += 1
+                except Exception as e:
+                    self.stats["errors"] += 1
+                    logger.warning("Langfuse export error: %s", e)
+
+    def shutdown(self, timeout: float = 5.0) -> None:
+        """Drain the queue and flush the Langfuse client"""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        self._thread = None
+        try:
+            self._langfuse.flush()
+        except Exception as e:
+            logger.warning("Langfuse flush error: %s", e)
+
+
+langfuse_exporter = LangfuseExporter()
+
+
+class LangfuseService:
+    """Records one Langfuse trace per chat turn, with nested spans.
+
+    All methods only enqueue events on the shared ``langfuse_exporter``.
+    """
+
+    def __init__(self):
+        self.exporter = langfuse_exporter
 
     def trace_generation(
         self,
@@ -23,26 +133,14 @@ class LangfuseService:
         metadata: Dict[str, Any] = None
     ) -> None:
         """Trace a generation event"""
-        if not self.langfuse:
-            return
-
-        try:
-            trace = self.langfuse.trace(
-                id=trace_id,
-                name=name,
-                metadata=metadata or {}
-            )
-
-            generation = trace.generation(
-                name=name,
-                input=input_data,
-                output=output_data,
-                metadata=metadata or {}
-            )
-
-            # generation.flush()  # Removed flush call
-        except Exception as e:
-            print(f"Langfuse tracing error: {e}")
+        self.exporter.enqueue(
+            "generation",
+            trace_id,
+            name=name,
+            input=input_data,
+            output=output_data,
+            metadata=metadata or {}
+        )
 
     def trace_chat_message(
         self,
@@ -54,43 +152,42 @@ class LangfuseService:
         metadata: Dict[str, Any] = None
     ) -> None:
         """Trace a chat message exchange"""
-        if not self.langfuse:
-            return
-
-        try:
-            trace = self.langfuse.trace(
-                id=trace_id,
-                name=f"Chat Message - {chat_id}",
-                metadata={
-                    "chat_id": chat_id,
-                    "model": model_info.get("model"),
-                    "provider": model_info.get("provider"),
-                    **(metadata or {})
-                }
-            )
-
-            # Trace user input
-            trace.span(
-                name="User Input",
-                input={"message": user_message},
-                metadata={"role": "user"}
-            )
-
-            # Trace assistant response
-            trace.span(
-                name="Assistant Response",
-                input={"message": user_message},
-                output={"response": assistant_response},
-                metadata={
-                    "role": "assistant",
-                    "model": model_info.get("model"),
-                    "provider": model_info.get("provider")
-                }
-            )
-
-            # trace.flush()  # Removed flush call
-        except Exception as e:
-            print(f"Langfuse tracing error: {e}")
+        self.exporter.enqueue(
+            "trace",
+            trace_id,
+            name=f"Chat Message - {chat_id}",
+            input={"message": user_message},
+            output={"response": assistant_response},
+            metadata={
+                "chat_id": chat_id,
+                "model": model_info.get("model"),
+                "provider": model_info.get("provider"),
+                **(metadata or {})
+            }
+        )
+
+        # Trace user input
+        self.exporter.enqueue(
+            "span",
+            trace_id,
+            name="User Input",
+            input={"message": user_message},
+            metadata={"role": "user"}
+        )
+
+        # Trace assistant response
+        self.exporter.enqueue(
+            "span",
+            trace_id,
+            name="Assistant Response",
+            input={"message": user_message},
+            output={"response": assistant_response},
+            metadata={
+                "role": "assistant",
+                "model": model_info.get("model"),
+                "provider": model_info.get("provider")
+            }
+        )
 
     def trace_mcp_call(
         self,
@@ -101,34 +198,19 @@ class LangfuseService:
         output_result: Dict[str, Any],
         metadata: Dict[str, Any] = None
     ) -> None:
-        """Trace an MCP server call"""
-        if not self.langfuse:
-            return
-
-        try:
-            trace = self.langfuse.trace(
-                id=trace_id,
-                name=f"MCP Call - {server_name}",
-                metadata={
-                    "server_name": server_name,
-                    "method": method,
-                    **(metadata or {})
-                }
-            )
-
-            trace.span(
-                name=f"MCP {method}",
-                input=input_params,
-                output=output_result,
-                metadata={
-                    "server_name": server_name,
-                    "method": method
-                }
-            )
-
-            # trace.flush()  # Removed flush call
-        except Exception as e:
-            print(f"Langfuse tracing error: {e}")
+        """Trace an MCP server call as a span of the turn's trace"""
+        self.exporter.enqueue(
+            "span",
+            trace_id,
+            name=f"MCP {method}",
+            input=input_params,
+            output=output_result,
+            metadata={
+                "server_name": server_name,
+                "method": method,
+                **(metadata or {})
+            }
+        )
 
     def trace_error(
         self,
@@ -137,33 +219,24 @@ class LangfuseService:
         error_type: str,
         metadata: Dict[str, Any] = None
     ) -> None:
-        """Trace an error event"""
-        if not self.langfuse:
-            return
-
-        try:
-            trace = self.langfuse.trace(
-                id=trace_id,
-                name="Error",
-                metadata={
-                    "error_type": error_type,
-                    **(metadata or {})
-                }
-            )
-
-            trace.span(
-                name="Error",
-                level="ERROR",
-                input={"error_message": error_message},
-                metadata={
-                    "error_type": error_type
-                }
-            )
-
-            # trace.flush()  # Removed flush call
-        except Exception as e:
-            print(f"Langfuse tracing error: {e}")
+        """Trace an error event as a span of the turn's trace"""
+        self.exporter.enqueue(
+            "span",
+            trace_id,
+            always=True,
+            name="Error",
+            level="ERROR",
+            input={"error_message": error_message},
+            metadata={
+                "error_type": error_type,
+                **(metadata or {})
+            }
+        )
+
+    def get_stats(self) -> Dict[str, int]:
+        """Exporter counters: enqueued, exported, dropped, sampled_out, errors"""
+        return dict(self.exporter.stats)
 
     def is_enabled(self) -> bool:
         """Check if Langfuse is enabled"""
-        return self.langfuse is not None 
\ No newline at end of file
+        return self.exporter.enabled
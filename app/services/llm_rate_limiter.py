@@ -0,0 +1,259 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import re
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from app.core.config import settings
+from app.core.redis import redis_clients
+from app.models.llm_model import LLMModel
+
+logger = logging.getLogger(__name__)
+
+# Take one request and ``cost`` tokens from a model's per-minute buckets, or
+# report how long to wait. Nothing is taken unless both buckets have room.
+# KEYS: requests bucket, tokens bucket, paused-until.
+# ARGV: now, requests per minute, tokens per minute, cost (0 disables a bucket).
+TAKE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local paused_until = tonumber(redis.call('GET', KEYS[3]) or '0')
+if paused_until > now then
+    return tostring(paused_until - now)
+end
+
+local function level(key, capacity)
+    if capacity <= 0 then
+        return nil
+    end
+    local state = redis.call('HMGET', key, 'level', 'ts')
+    local current = tonumber(state[1]) or capacity
+    local ts = tonumber(state[2]) or now
+    return math.min(capacity, current + (now - ts) * capacity / 60)
+end
+
+local rpm, tpm = tonumber(ARGV[2]), tonumber(ARGV[3])
+local cost = math.min(tonumber(ARGV[4]), math.max(tpm, 0))
+local requests, tokens = level(KEYS[1], rpm), level(KEYS[2], tpm)
+
+local wait = 0
+if requests and requests < 1 then
+    wait = math.max(wait, (1 - requests) * 60 / rpm)
+end
+if tokens and tokens < cost then
+    wait = math.max(wait, (cost - tokens) * 60 / tpm)
+end
+if wait > 0 then
+    return tostring(wait)
+end
+
+if requests then
+    redis.call('HSET', KEYS[1], 'level', requests - 1, 'ts', now)
+    redis.call('EXPIRE', KEYS[1], 120)
+end
+if tokens then
+    redis.call('HSET', KEYS[2], 'level', tokens - cost, 'ts', now)
+    redis.call('EXPIRE', KEYS[2], 120)
+end
+return '0'
+"""
+
+# Interactive turns go ahead of background work such as summaries
+PRIORITIES = {"interactive": 0, "background": 1}
+
+# Provider rate-limit headers: (limit, remaining, reset) per kind
+RATE_LIMIT_HEADERS = {
+    "openai": {
+        "requests": ("x-ratelimit-limit-requests", "x-ratelimit-remaining-requests", "x-ratelimit-reset-requests"),
+        "tokens": ("x-ratelimit-limit-tokens", "x-ratelimit-remaining-tokens", "x-ratelimit-reset-tokens"),
+    },
+    "anthropic": {
+        "requests": ("anthropic-ratelimit-requests-limit", "anthropic-ratelimit-requests-remaining", "anthropic-ratelimit-requests-reset"),
+        "tokens": ("anthropic-ratelimit-tokens-limit", "anthropic-ratelimit-tokens-remaining", "anthropic-ratelimit-tokens-reset"),
+    },
+}
+
+_DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+class LLMRateLimitExceeded(Exception):
+    """Raised when a call would wait longer than ``LLM_RATE_LIMIT_MAX_WAIT``"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def parse_reset(value: Optional[str]) -> Optional[float]:
+    """Seconds until a reset given as ``1m30s``, plain seconds or an RFC 3339 time"""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    matches = _DURATION_RE.findall(value)
+    if matches:
+        return sum(float(amount) * _DURATION_UNITS[unit] for amount, unit in matches)
+    try:
+        reset_at = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        return max(reset_at.timestamp() - time.time(), 0.0)
+    except ValueError:
+        return None
+
+
+class LLMRateLimiter:
+    """Keeps outbound LLM calls under each model's provider quotas.
+
+    Models opt in through ``configuration["rate_limit"]`` with
+    ``requests_per_minute``, ``tokens_per_minute`` and ``max_concurrency``.
+    The per-minute buckets live in Redis, so every worker draws from the
+    same quota. Callers queue per model in priority order, and only the
+    head of the queue polls the buckets. Provider rate-limit headers lower
+    the limits to what the provider reports, and an exhausted quota or a
+    429 pauses the model for every worker until its reset. Redis errors
+    fail open.
+    """
+
+    def __init__(self):
+        self._take_script = None
+        self._queues: Dict[int, List[list]] = {}
+        self._conditions: Dict[int, asyncio.Condition] = {}
+        self._semaphores: Dict[int, asyncio.Semaphore] = {}
+        self._observed: Dict[int, Dict[str, int]] = {}
+        self._sequence = itertools.count()
+
+    @property
+    def redis_client(self):
+        client = redis_clients.async_client
+        if self._take_script is None:
+            self._take_script = client.register_script(TAKE_SCRIPT)
+        return client
+
+    @staticmethod
+    def _paused_key(model_id: int) -> str:
+        return f"llm_rate:{model_id}:paused_until"
+
+    def limits(self, model: LLMModel) -> Optional[Dict[str, int]]:
+        """Effective limits of a model, or None if it is not rate limited"""
+        if not settings.LLM_RATE_LIMIT_ENABLED:
+            return None
+        configured = (model.configuration or {}).get("rate_limit")
+        if not configured:
+            return None
+
+        observed = self._observed.get(model.id, {})
+        limits = {}
+        for kind, field in (("requests", "requests_per_minute"), ("tokens", "tokens_per_minute")):
+            values = [value for value in (configured.get(field), observed.get(kind)) if value]
+            limits[kind] = min(values) if values else 0
+        limits["max_concurrency"] = configured.get("max_concurrency") or 0
+        return limits
+
+    @asynccontextmanager
+    async def slot(self, model: LLMModel, tokens: int, priority: str = "interactive"):
+        """Hold a place under the model's limits for the duration of one call"""
+        limits = self.limits(model)
+        if limits is None:
+            yield
+            return
+
+        await self._wait_turn(model, limits, tokens, PRIORITIES.get(priority, 0))
+        if not limits["max_concurrency"]:
+            yield
+            return
+
+        semaphore = self._semaphores.get(model.id)
+        if semaphore is None:
+            semaphore = self._semaphores[model.id] = asyncio.Semaphore(limits["max_concurrency"])
+        async with semaphore:
+            yield
+
+    async def _wait_turn(self, model: LLMModel, limits: Dict[str, int], tokens: int, priority: int) -> None:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + settings.LLM_RATE_LIMIT_MAX_WAIT
+        queue = self._queues.setdefault(model.id, [])
+        condition = self._conditions.setdefault(model.id, asyncio.Condition())
+        entry = [priority, next(self._sequence)]
+        heapq.heappush(queue, entry)
+        try:
+            try:
+                async with condition:
+                    await asyncio.wait_for(
+                        condition.wait_for(lambda: queue[0] is entry),
+                        max(deadline - loop.time(), 0)
+                    )
+            except asyncio.TimeoutError:
+                raise LLMRateLimitExceeded(
+                    f"Rate limit queue for model {model.name} is full, please try again shortly",
+                    retry_after=settings.LLM_RATE_LIMIT_MAX_WAIT
+                )
+
+            while True:
+                wait = await self._take(model.id, limits, tokens)
+                if wait <= 0:
+                    return
+                if loop.time() + wait > deadline:
+                    raise LLMRateLimitExceeded(
+                        f"Rate limit reached for model {model.name}, please try again shortly",
+                        retry_after=wait
+                    )
+                await asyncio.sleep(wait)
+        finally:
+            queue.remove(entry)
+            heapq.heapify(queue)
+            async with condition:
+                condition.notify_all()
+
+    async def _take(self, model_id: int, limits: Dict[str, int], tokens: int) -> float:
+        try:
+            client = self.redis_client
+            wait = await self._take_script(
+                keys=[f"llm_rate:{model_id}:requests", f"llm_rate:{model_id}:tokens", self._paused_key(model_id)],
+                args=[time.time(), limits["requests"], limits["tokens"], tokens],
+                client=client
+            )
+            return float(wait)
+        except Exception as e:
+            logger.warning("LLM rate limiter error: %s", e)
+            return 0.0
+
+    async def observe(self, model: LLMModel, status_code: int, headers: Any) -> None:
+        """Adapt to the rate-limit headers of a provider response"""
+        if self.limits(model) is None:
+            return
+
+        pause = 0.0
+        observed = self._observed.setdefault(model.id, {})
+        for kind, (limit_header, remaining_header, reset_header) in RATE_LIMIT_HEADERS.get(model.provider, {}).items():
+            try:
+                if headers.get(limit_header):
+                    observed[kind] = int(headers[limit_header])
+                remaining = headers.get(remaining_header)
+                if remaining is not None and int(remaining) <= 0:
+                    pause = max(pause, parse_reset(headers.get(reset_header)) or 1.0)
+            except ValueError:
+                continue
+
+        if status_code == 429:
+            pause = max(pause, parse_reset(headers.get("retry-after")) or 1.0)
+
+        if pause > 0:
+            await self.pause(model.id, pause)
+
+    async def pause(self, model_id: int, seconds: float) -> None:
+        """Hold back every worker's calls to a model"""
+        paused_until = time.time() + seconds
+        try:
+            key = self._paused_key(model_id)
+            current = await self.redis_client.get(key)
+            if current is None or float(current) < paused_until:
+                await self.redis_client.set(key, paused_until, ex=max(int(seconds) + 1, 1))
+        except Exception as e:
+            logger.warning("LLM rate limiter error: %s", e)
+
+
+llm_rate_limiter = LLMRateLimiter()
@@ -0,0 +1,134 @@
+import asyncio
+import random
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional
+import httpx
+from app.core.config import settings
+from app.models.llm_model import LLMModel
+
+
+# Statuses worth another attempt on the same model
+RETRYABLE_STATUS_CODES = {408, 409, 425, 429, 500, 502, 503, 504, 529}
+
+
+class LLMProviderError(Exception):
+    """Raised for a non-200 response from an LLM provider"""
+
+    def __init__(self, message: str, status_code: int, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+    @property
+    def retryable(self) -> bool:
+        return self.status_code in RETRYABLE_STATUS_CODES
+
+
+def retry_after_seconds(headers: Any) -> Optional[float]:
+    """Seconds from a numeric ``Retry-After`` header"""
+    try:
+        return max(float(headers.get("retry-after")), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def retry_policy(model: LLMModel) -> Dict[str, float]:
+    """Retry settings of a model, overridable via ``configuration["retry"]``"""
+    configured = (model.configuration or {}).get("retry") or {}
+    return {
+        "max_attempts": configured.get("max_attempts", settings.LLM_RETRY_MAX_ATTEMPTS),
+        "base_delay": configured.get("base_delay", settings.LLM_RETRY_BASE_DELAY),
+        "max_delay": configured.get("max_delay", settings.LLM_RETRY_MAX_DELAY),
+        "deadline": configured.get("deadline", settings.LLM_RETRY_DEADLINE),
+    }
+
+
+def deadline_error(model: LLMModel, policy: Dict[str, float]) -> LLMProviderError:
+    return LLMProviderError(
+        f"Model {model.name} did not respond within {policy['deadline']}s", status_code=504
+    )
+
+
+def retry_delay(error: Exception, attempt: int, policy: Dict[str, float]) -> Optional[float]:
+    """Seconds to wait before retrying after ``error``, or None to give up on the model.
+
+    Backoff is exponential with full jitter. A Retry-After longer than the
+    policy's ``max_delay`` gives up so the caller can fail over instead.
+    """
+    if attempt >= policy["max_attempts"]:
+        return None
+    if isinstance(error, LLMProviderError):
+        if not error.retryable:
+            return None
+        retry_after = error.retry_after
+    elif isinstance(error, httpx.TransportError):
+        retry_after = None
+    else:
+        return None
+
+    if retry_after is not None and retry_after > policy["max_delay"]:
+        return None
+    backoff = random.uniform(0, min(policy["max_delay"], policy["base_delay"] * 2 ** (attempt - 1)))
+    return max(backoff, retry_after or 0.0)
+
+
+class LatencyTracker:
+    """Recent successful call latencies per model, for hedging delays"""
+
+    def __init__(self):
+        self._samples: Dict[int, Deque[float]] = {}
+
+    def record(self, model_id: int, seconds: float) -> None:
+        samples = self._samples.get(model_id)
+        if samples is None:
+            samples = self._samples[model_id] = deque(maxlen=settings.LLM_LATENCY_WINDOW)
+        samples.append(seconds)
+
+    def quantile(self, model_id: int, quantile: float) -> Optional[float]:
+        samples = self._samples.get(model_id)
+        if not samples or len(samples) < settings.LLM_HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(int(quantile * len(ordered)), len(ordered) - 1)]
+
+    def hedge_delay(self, model: LLMModel) -> Optional[float]:
+        """Delay before a hedged second attempt, or None if the model does not hedge"""
+        configured = (model.configuration or {}).get("hedge")
+        if not configured:
+            return None
+        configured = configured if isinstance(configured, dict) else {}
+        delay = self.quantile(model.id, configured.get("quantile", 0.95))
+        if delay is None:
+            return None
+        return max(delay, configured.get("min_delay", settings.LLM_HEDGE_MIN_DELAY))
+
+
+async def hedged(call: Callable[[], Awaitable[Any]], delay: Optional[float]) -> Any:
+    """Run ``call``, starting a second copy if the first has not finished after ``delay``.
+
+    The first successful result wins and the other attempt is cancelled.
+    """
+    if delay is None:
+        return await call()
+
+    pending = {asyncio.create_task(call())}
+    try:
+        done, pending = await asyncio.wait(pending, timeout=delay)
+        if done:
+            return done.pop().result()
+
+        pending.add(asyncio.create_task(call()))
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+latency_tracker = LatencyTracker()
@@ -1,9 +1,29 @@
+import asyncio
 import httpx
+import itertools
 import json
-from typing import Dict, Any, Optional, List
+import time
+from typing import Dict, Any, Optional, List, AsyncIterator
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from app.models.llm_model import LLMModel
 from app.core.config import settings
+from app.core.http import http_clients
+from app.services.config_cache import config_cache, detached_copy
+from app.services.response_cache import response_cache
+from app.services.single_flight import request_key, single_flight
+from app.services.llm_rate_limiter import llm_rate_limiter
+from app.services.llm_resilience import (
+    LLMProviderError,
+    deadline_error,
+    hedged,
+    latency_tracker,
+    retry_after_seconds,
+    retry_delay,
+    retry_policy,
+)
+from app.services.token_counter import MESSAGE_OVERHEAD_TOKENS, count_tokens, model_family
 
 
 class LLMService:
@@ -15,21 +35,265 @@ class LLMService:
         self, 
         model_id: int, 
         messages: List[Dict[str, str]], 
-        db: Session,
+        db: AsyncSession,
+        cache_scope: Optional[str] = None,
+        priority: str = "interactive",
         **kwargs
     ) -> Dict[str, Any]:
-        """Get completion from LLM model"""
-        model = db.query(LLMModel).filter(LLMModel.id == model_id).first()
+        """Get completion from LLM model.
+
+        Passing a ``cache_scope`` allows the response to be served from, and
+        stored in, the response cache if the model has opted in. ``priority``
+        ("interactive" or "background") orders calls held back by the
+        model's rate limit.
+        """
+        model = await self.get_model_async(model_id, db)
+        if not model:
+            raise ValueError(f"Model with id {model_id} not found")
+        # Fallback models get the same limit the prompt was budgeted for
+        kwargs.setdefault("max_tokens", self.max_output_tokens(model))
+
+        cache_lookup = response_cache.prepare(model, messages, self._generation_params(kwargs), cache_scope)
+        if cache_lookup:
+            cached = await response_cache.get(cache_lookup)
+            if cached:
+                return cached
+
+        chain = await self._failover_chain(model, db)
+
+        async def call() -> Dict[str, Any]:
+            return await self._complete_with_failover(chain, messages, kwargs, priority)
+
+        if self._coalesce(model):
+            # Identical concurrent prompts share one provider call
+            response = await single_flight.run(
+                self._request_key(model, messages, kwargs),
+                call,
+                distributed=settings.SINGLE_FLIGHT_DISTRIBUTED
+            )
+        else:
+            response = await call()
+
+        if cache_lookup:
+            await response_cache.put(cache_lookup, response)
+            response["cache"] = {"status": "miss"}
+        return response
+
+    async def stream_completion(
+        self,
+        model_id: int,
+        messages: List[Dict[str, str]],
+        db: AsyncSession,
+        cache_scope: Optional[str] = None,
+        priority: str = "interactive",
+        **kwargs
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Stream completion from LLM model.
+
+        Yields ``{"type": "delta", "content": ...}`` events as text arrives and
+        a final ``{"type": "completion", "response": ...}`` event whose
+        response has the same shape as ``get_completion``. A cached response
+        arrives as a single delta.
+        """
+        model = await self.get_model_async(model_id, db)
         if not model:
             raise ValueError(f"Model with id {model_id} not found")
+        # Fallback models get the same limit the prompt was budgeted for
+        kwargs.setdefault("max_tokens", self.max_output_tokens(model))
+
+        cache_lookup = response_cache.prepare(model, messages, self._generation_params(kwargs), cache_scope)
+        if cache_lookup:
+            cached = await response_cache.get(cache_lookup)
+            if cached:
+                yield {"type": "delta", "content": cached["content"]}
+                yield {"type": "completion", "response": cached}
+                return
+
+        chain = await self._failover_chain(model, db)
+
+        def call() -> AsyncIterator[Dict[str, Any]]:
+            return self._stream_with_failover(chain, messages, kwargs, priority)
+
+        if self._coalesce(model):
+            # Identical concurrent prompts in this worker share one provider stream
+            stream = single_flight.stream(self._request_key(model, messages, kwargs), call)
+        else:
+            stream = call()
+
+        async for event in stream:
+            if event["type"] == "completion" and cache_lookup:
+                await response_cache.put(cache_lookup, event["response"])
+                event["response"]["cache"] = {"status": "miss"}
+            yield event
+
+    async def _failover_chain(self, model: LLMModel, db: AsyncSession) -> List[LLMModel]:
+        """The model followed by its active ``configuration["fallback_model_ids"]``"""
+        chain = [model]
+        for fallback_id in (model.configuration or {}).get("fallback_model_ids", []):
+            fallback = await self.get_model_async(fallback_id, db)
+            if fallback and fallback.is_active and all(fallback.id != m.id for m in chain):
+                chain.append(fallback)
+        return chain
 
+    async def _complete_with_failover(
+        self,
+        chain: List[LLMModel],
+        messages: List[Dict[str, str]],
+        kwargs: Dict[str, Any],
+        priority: str
+    ) -> Dict[str, Any]:
+        """Try each model of the chain in turn until one answers"""
+        error = None
+        for model in chain:
+            try:
+                response = await self._complete_with_retries(model, messages, kwargs, priority)
+            except Exception as e:
+                error = e
+                continue
+            if model is not chain[0]:
+                response["failover_from"] = chain[0].model_name
+            return response
+        raise error
+
+    async def _complete_with_retries(
+        self,
+        model: LLMModel,
+        messages: List[Dict[str, str]],
+        kwargs: Dict[str, Any],
+        priority: str
+    ) -> Dict[str, Any]:
         if model.provider == "openai":
-            return await self._get_openai_completion(model, messages, **kwargs)
+            complete = self._get_openai_completion
         elif model.provider == "anthropic":
-            return await self._get_anthropic_completion(model, messages, **kwargs)
+            complete = self._get_anthropic_completion
         else:
             raise ValueError(f"Unsupported provider: {model.provider}")
 
+        async def attempt_call(original: bool) -> Dict[str, Any]:
+            async with llm_rate_limiter.slot(model, self._estimate_tokens(model, messages, kwargs), priority):
+                started = time.monotonic()
+                try:
+                    response = await complete(model, messages, **kwargs)
+                except asyncio.CancelledError:
+                    # An original attempt that was hedged away or timed out was
+                    # at least this slow; a cancelled hedge copy only ran for
+                    # part of the call and would pull the p95 down
+                    if original:
+                        latency_tracker.record(model.id, time.monotonic() - started)
+                    raise
+            latency_tracker.record(model.id, time.monotonic() - started)
+            return response
+
+        policy = retry_policy(model)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + policy["deadline"] if policy["deadline"] else None
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                # A slow or hung model fails over once its deadline passes
+                async with asyncio.timeout_at(deadline):
+                    # Slow calls get a second, hedged attempt after the model's p95
+                    calls = itertools.count()
+                    return await hedged(
+                        lambda: attempt_call(original=next(calls) == 0),
+                        latency_tracker.hedge_delay(model)
+                    )
+            except TimeoutError:
+                raise deadline_error(model, policy)
+            except Exception as e:
+                delay = retry_delay(e, attempt, policy)
+                if delay is None or (deadline is not None and loop.time() + delay >= deadline):
+                    raise
+                await asyncio.sleep(delay)
+
+    async def _stream_with_failover(
+        self,
+        chain: List[LLMModel],
+        messages: List[Dict[str, str]],
+        kwargs: Dict[str, Any],
+        priority: str
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Stream from the first model of the chain that answers.
+
+        Retries and failover only happen before the first event; a stream
+        that breaks off midway raises.
+        """
+        error = None
+        for model in chain:
+            if model.provider == "openai":
+                open_stream = self._stream_openai_completion
+            elif model.provider == "anthropic":
+                open_stream = self._stream_anthropic_completion
+            else:
+                error = ValueError(f"Unsupported provider: {model.provider}")
+                continue
+
+            policy = retry_policy(model)
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + policy["deadline"] if policy["deadline"] else None
+            attempt = 0
+            while True:
+                attempt += 1
+                started = False
+                try:
+                    # The deadline covers the wait for the first event only
+                    async with asyncio.timeout_at(deadline) as timeout:
+                        async with llm_rate_limiter.slot(model, self._estimate_tokens(model, messages, kwargs), priority):
+                            async for event in open_stream(model, messages, **kwargs):
+                                if not started:
+                                    timeout.reschedule(None)
+                                started = True
+                                if event["type"] == "completion" and model is not chain[0]:
+                                    event["response"]["failover_from"] = chain[0].model_name
+                                yield event
+                    return
+                except TimeoutError:
+                    if started:
+                        raise
+                    error = deadline_error(model, policy)
+                    break
+                except Exception as e:
+                    if started:
+                        raise
+                    error = e
+                    delay = retry_delay(e, attempt, policy)
+                    if delay is None or (deadline is not None and loop.time() + delay >= deadline):
+                        break
+                    await asyncio.sleep(delay)
+        raise error
+
+    def _estimate_tokens(self, model: LLMModel, messages: List[Dict[str, str]], kwargs: Dict[str, Any]) -> int:
+        """Tokens a call counts against the provider's per-minute quota"""
+        family = model_family(model.provider)
+        prompt_tokens = sum(
+            count_tokens(msg["content"], family) + MESSAGE_OVERHEAD_TOKENS for msg in messages
+        )
+        return prompt_tokens + self._generation_params(kwargs)["max_tokens"]
+
+    @staticmethod
+    def max_output_tokens(model: LLMModel) -> int:
+        """Response token limit of a model, set via ``configuration["max_tokens"]``"""
+        return (model.configuration or {}).get("max_tokens", settings.MCP_MAX_TOKENS)
+
+    @staticmethod
+    def _coalesce(model: LLMModel) -> bool:
+        return (model.configuration or {}).get("coalesce_requests", True)
+
+    def _request_key(self, model: LLMModel, messages: List[Dict[str, str]], kwargs: Dict[str, Any]) -> str:
+        return request_key(
+            "llm", model_id=model.id, messages=messages, params=self._generation_params(kwargs)
+        )
+
+    @staticmethod
+    def _generation_params(kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        """Parameters sent to the provider besides the model and messages"""
+        return {
+            "max_tokens": kwargs.get("max_tokens", settings.MCP_MAX_TOKENS),
+            "temperature": kwargs.get("temperature", 0.7),
+            **kwargs
+        }
+
     async def _get_openai_completion(
         self, 
         model: LLMModel, 
@@ -40,33 +304,37 @@ class LLMService:
         if not settings.OPENAI_API_KEY:
             raise ValueError("OpenAI API key not configured")
 
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                "https://api.openai.com/v1/chat/completions",
-                headers={
-                    "Authorization": f"Bearer {settings.OPENAI_API_KEY}",
-                    "Content-Type": "application/json"
-                },
-                json={
-                    "model": model.model_name,
-                    "messages": messages,
-                    "max_tokens": kwargs.get("max_tokens", settings.MCP_MAX_TOKENS),
-                    "temperature": kwargs.get("temperature", 0.7),
-                    **kwargs
-                },
-                timeout=settings.MCP_SERVER_TIMEOUT
-            )
-            
-            if response.status_code != 200:
-                raise Exception(f"OpenAI API error: {response.text}")
-            
-            data = response.json()
-            return {
-                "content": data["choices"][0]["message"]["content"],
-                "usage": data.get("usage", {}),
+        client = http_clients.get_client("https://api.openai.com")
+        response = await client.post(
+            "https://api.openai.com/v1/chat/completions",
+            headers={
+                "Authorization": f"Bearer {settings.OPENAI_API_KEY}",
+                "Content-Type": "application/json"
+            },
+            json={
                 "model": model.model_name,
-                "provider": "openai"
+                "messages": messages,
+                "max_tokens": kwargs.get("max_tokens", settings.MCP_MAX_TOKENS),
+                "temperature": kwargs.get("temperature", 0.7),
+                **kwargs
             }
+        )
+        await llm_rate_limiter.observe(model, response.status_code, response.headers)
+        
+        if response.status_code != 200:
+            raise LLMProviderError(
+                f"OpenAI API error: {response.text}",
+                response.status_code,
+                retry_after_seconds(response.headers)
+            )
+        
+        data = response.json()
+        return {
+            "content": data["choices"][0]["message"]["content"],
+            "usage": data.get("usage", {}),
+            "model": model.model_name,
+            "provider": "openai"
+        }
 
     async def _get_anthropic_completion(
         self, 
@@ -78,47 +346,196 @@ class LLMService:
         if not settings.ANTHROPIC_API_KEY:
             raise ValueError("Anthropic API key not configured")
 
-        # Convert messages to Anthropic format
+        anthropic_messages = self._to_anthropic_messages(messages)
+
+        client = http_clients.get_client("https://api.anthropic.com")
+        response = await client.post(
+            "https://api.anthropic.com/v1/messages",
+            headers={
+                "x-api-key": settings.ANTHROPIC_API_KEY,
+                "Content-Type": "application/json",
+                "anthropic-version": "2023-06-01"
+            },
+            json={
+                "model": model.model_name,
+                "messages": anthropic_messages,
+                "max_tokens": kwargs.get("max_tokens", settings.MCP_MAX_TOKENS),
+                "temperature": kwargs.get("temperature", 0.7),
+                **kwargs
+            }
+        )
+        await llm_rate_limiter.observe(model, response.status_code, response.headers)
+        
+        if response.status_code != 200:
+            raise LLMProviderError(
+                f"Anthropic API error: {response.text}",
+                response.status_code,
+                retry_after_seconds(response.headers)
+            )
+        
+        data = response.json()
+        return {
+            "content": data["content"][0]["text"],
+            "usage": data.get("usage", {}),
+            "model": model.model_name,
+            "provider": "anthropic"
+        }
+
+    async def _stream_openai_completion(
+        self,
+        model: LLMModel,
+        messages: List[Dict[str, str]],
+        **kwargs
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Stream completion from OpenAI"""
+        if not settings.OPENAI_API_KEY:
+            raise ValueError("OpenAI API key not configured")
+
+        content_parts = []
+        usage = {}
+        client = http_clients.get_client("https://api.openai.com")
+        async with client.stream(
+            "POST",
+            "https://api.openai.com/v1/chat/completions",
+            headers={
+                "Authorization": f"Bearer {settings.OPENAI_API_KEY}",
+                "Content-Type": "application/json"
+            },
+            json={
+                "model": model.model_name,
+                "messages": messages,
+                "max_tokens": kwargs.get("max_tokens", settings.MCP_MAX_TOKENS),
+                "temperature": kwargs.get("temperature", 0.7),
+                **kwargs,
+                "stream": True,
+                "stream_options": {"include_usage": True}
+            }
+        ) as response:
+            await llm_rate_limiter.observe(model, response.status_code, response.headers)
+            if response.status_code != 200:
+                await response.aread()
+                raise LLMProviderError(
+                    f"OpenAI API error: {response.text}",
+                    response.status_code,
+                    retry_after_seconds(response.headers)
+                )
+
+            async for data in self._iter_sse_data(response):
+                if data == "[DONE]":
+                    break
+                chunk = json.loads(data)
+                if chunk.get("usage"):
+                    usage = chunk["usage"]
+                for choice in chunk.get("choices", []):
+                    delta = choice.get("delta", {}).get("content")
+                    if delta:
+                        content_parts.append(delta)
+                        yield {"type": "delta", "content": delta}
+
+        yield {
+            "type": "completion",
+            "response": {
+                "content": "".join(content_parts),
+                "usage": usage,
+                "model": model.model_name,
+                "provider": "openai"
+            }
+        }
+
+    async def _stream_anthropic_completion(
+        self,
+        model: LLMModel,
+        messages: List[Dict[str, str]],
+        **kwargs
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Stream completion from Anthropic"""
+        if not settings.ANTHROPIC_API_KEY:
+            raise ValueError("Anthropic API key not configured")
+
+        anthropic_messages = self._to_anthropic_messages(messages)
+
+        content_parts = []
+        usage = {}
+        client = http_clients.get_client("https://api.anthropic.com")
+        async with client.stream(
+            "POST",
+            "https://api.anthropic.com/v1/messages",
+            headers={
+                "x-api-key": settings.ANTHROPIC_API_KEY,
+                "Content-Type": "application/json",
+                "anthropic-version": "2023-06-01"
+            },
+            json={
+                "model": model.model_name,
+                "messages": anthropic_messages,
+                "max_tokens": kwargs.get("max_tokens", settings.MCP_MAX_TOKENS),
+                "temperature": kwargs.get("temperature", 0.7),
+                **kwargs,
+                "stream": True
+            }
+        ) as response:
+            await llm_rate_limiter.observe(model, response.status_code, response.headers)
+            if response.status_code != 200:
+                await response.aread()
+                raise LLMProviderError(
+                    f"Anthropic API error: {response.text}",
+                    response.status_code,
+                    retry_after_seconds(response.headers)
+                )
+
+            async for data in self._iter_sse_data(response):
+                event = json.loads(data)
+                event_type = event.get("type")
+                if event_type == "message_start":
+                    usage.update(event.get("message", {}).get("usage", {}))
+                elif event_type == "content_block_delta":
+                    delta = event.get("delta", {}).get("text")
+                    if delta:
+                        content_parts.append(delta)
+                        yield {"type": "delta", "content": delta}
+                elif event_type == "message_delta":
+                    usage.update(event.get("usage", {}))
+                elif event_type == "error":
+                    raise Exception(f"Anthropic API error: {event.get('error')}")
+                elif event_type == "message_stop":
+                    break
+
+        yield {
+            "type": "completion",
+            "response": {
+                "content": "".join(content_parts),
+                "usage": usage,
+                "model": model.model_name,
+                "provider": "anthropic"
+            }
+        }
+
+    @staticmethod
+    async def _iter_sse_data(response: httpx.Response) -> AsyncIterator[str]:
+        """Yield the data payloads of a server-sent event stream"""
+        async for line in response.aiter_lines():
+            if line.startswith("data:"):
+                yield line[len("data:"):].strip()
+
+    @staticmethod
+    def _to_anthropic_messages(messages: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        """Convert messages to Anthropic format"""
         anthropic_messages = []
+        system_prompts = []
         for msg in messages:
             if msg["role"] == "user":
                 anthropic_messages.append({"role": "user", "content": msg["content"]})
             elif msg["role"] == "assistant":
                 anthropic_messages.append({"role": "assistant", "content": msg["content"]})
             elif msg["role"] == "system":
-                # Anthropic doesn't support system messages in the same way
-                # We'll prepend it to the first user message
-                if anthropic_messages and anthropic_messages[0]["role"] == "user":
-                    anthropic_messages[0]["content"] = f"{msg['content']}\n\n{anthropic_messages[0]['content']}"
-
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                "https://api.anthropic.com/v1/messages",
-                headers={
-                    "x-api-key": settings.ANTHROPIC_API_KEY,
-                    "Content-Type": "application/json",
-                    "anthropic-version": "2023-06-01"
-                },
-                json={
-                    "model": model.model_name,
-                    "messages": anthropic_messages,
-                    "max_tokens": kwargs.get("max_tokens", settings.MCP_MAX_TOKENS),
-                    "temperature": kwargs.get("temperature", 0.7),
-                    **kwargs
-                },
-                timeout=settings.MCP_SERVER_TIMEOUT
-            )
-            
-            if response.status_code != 200:
-                raise Exception(f"Anthropic API error: {response.text}")
-            
-            data = response.json()
-            return {
-                "content": data["content"][0]["text"],
-                "usage": data.get("usage", {}),
-                "model": model.model_name,
-                "provider": "anthropic"
-            }
+                system_prompts.append(msg["content"])
+
+        # Anthropic doesn't support system messages in the same way
+        # We'll prepend them to the first user message
+        first_user = next((msg for msg in anthropic_messages if msg["role"] == "user"), None)
+        if system_prompts and first_user:
+            first_user["content"] = "\n\n".join(system_prompts + [first_user["content"]])
+        return anthropic_messages
 
     def list_models(self, db: Session) -> List[LLMModel]:
         """List all available LLM models"""
@@ -126,4 +543,13 @@ class LLMService:
 
     def get_model(self, model_id: int, db: Session) -> Optional[LLMModel]:
         """Get specific LLM model"""
-        return db.query(LLMModel).filter(LLMModel.id == model_id).first() 
\ No newline at end of file
+        return db.query(LLMModel).filter(LLMModel.id == model_id).first()
+
+    async def get_model_async(self, model_id: int, db: AsyncSession) -> Optional[LLMModel]:
+        """Get specific LLM model, served from the config cache when possible"""
+        async def load() -> Optional[LLMModel]:
+            result = await db.execute(select(LLMModel).where(LLMModel.id == model_id))
+            model = result.scalars().first()
+            return detached_copy(model) if model else None
+
+        return await config_cache.get("llm_model", model_id, load) 
\ No newline at end of file
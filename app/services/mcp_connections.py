@@ -0,0 +1,184 @@
+import asyncio
+import itertools
+import json
+import random
+from typing import Any, Dict, List, Optional, Tuple
+import websockets
+from app.core.config import settings
+from app.models.mcp_server import MCPServer
+
+
+class MCPWebSocketConnection:
+    """A long-lived JSON-RPC WebSocket connection to an MCP server.
+
+    Requests are multiplexed over one socket: each call gets a unique id and
+    a future that the reader task resolves when the matching response arrives.
+    """
+
+    def __init__(self, url: str):
+        self.url = url
+        self._websocket = None
+        self._reader_task: Optional[asyncio.Task] = None
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._ids = itertools.count(1)
+        self._connect_lock = asyncio.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        return self._websocket is not None and self._websocket.open
+
+    @property
+    def pending_count(self) -> int:
+        return len(self._pending)
+
+    async def ensure_connected(self) -> None:
+        """Open the socket, retrying with jittered exponential backoff"""
+        if self.is_open:
+            return
+
+        async with self._connect_lock:
+            if self.is_open:
+                return
+
+            attempt = 0
+            while True:
+                try:
+                    websocket = await websockets.connect(
+                        self.url,
+                        open_timeout=settings.MCP_SERVER_TIMEOUT
+                    )
+                    break
+                except Exception:
+                    attempt += 1
+                    if attempt >= settings.MCP_WS_MAX_RECONNECT_ATTEMPTS:
+                        raise
+                    delay = min(
+                        settings.MCP_WS_RECONNECT_BASE_DELAY * 2 ** (attempt - 1),
+                        settings.MCP_WS_RECONNECT_MAX_DELAY
+                    )
+                    await asyncio.sleep(delay * random.uniform(0.5, 1.0))
+
+            # Each socket gets its own pending map so a late-closing old
+            # socket can never fail requests sent on its replacement.
+            self._websocket = websocket
+            self._pending = {}
+            self._reader_task = asyncio.create_task(
+                self._read_loop(websocket, self._pending)
+            )
+
+    async def call(self, method: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        """Send a JSON-RPC request and wait for its response"""
+        await self.ensure_connected()
+
+        websocket = self._websocket
+        pending = self._pending
+        request_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        pending[request_id] = future
+
+        try:
+            await websocket.send(json.dumps({
+                "jsonrpc": "2.0",
+                "id": request_id,
+                "method": method,
+                "params": params
+            }))
+            response = await future
+        finally:
+            pending.pop(request_id, None)
+
+        if "error" in response:
+            raise Exception(f"MCP server error: {response['error']}")
+
+        return response.get("result", {})
+
+    async def _read_loop(self, websocket, pending: Dict[int, asyncio.Future]) -> None:
+        """Route incoming responses to the futures awaiting them"""
+        error: Exception = ConnectionError(f"MCP server connection to {self.url} closed")
+        try:
+            async for raw in websocket:
+                try:
+                    message = json.loads(raw)
+                except ValueError:
+                    continue
+
+                future = pending.get(message.get("id"))
+                if future is not None and not future.done():
+                    future.set_result(message)
+        except Exception as e:
+            error = ConnectionError(f"MCP server connection to {self.url} lost: {e}")
+        finally:
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(error)
+            if self._websocket is websocket:
+                self._websocket = None
+
+    async def close(self) -> None:
+        """Close the socket and stop the reader"""
+        websocket, self._websocket = self._websocket, None
+        if websocket is not None:
+            await websocket.close()
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+            self._reader_task = None
+
+
+class MCPConnectionManager:
+    """Per-server pools of persistent WebSocket connections"""
+
+    def __init__(self):
+        self._pools: Dict[int, Tuple[str, List[MCPWebSocketConnection]]] = {}
+
+    async def _get_pool(self, server: MCPServer) -> List[MCPWebSocketConnection]:
+        entry = self._pools.get(server.id)
+        if entry is not None and entry[0] == server.server_url:
+            return entry[1]
+
+        # New server or its URL changed: replace the pool
+        if entry is not None:
+            await self.close_server(server.id)
+
+        size = (server.configuration or {}).get("ws_pool_size", settings.MCP_WS_POOL_SIZE)
+        pool = [MCPWebSocketConnection(server.server_url) for _ in range(max(1, int(size)))]
+        self._pools[server.id] = (server.server_url, pool)
+        return pool
+
+    async def call(
+        self,
+        server: MCPServer,
+        method: str,
+        params: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        """Call an MCP method on the least busy connection for the server"""
+        pool = await self._get_pool(server)
+        connection = min(pool, key=lambda c: c.pending_count)
+        return await asyncio.wait_for(
+            connection.call(method, params),
+            timeout=settings.MCP_SERVER_TIMEOUT
+        )
+
+    async def check(self, server: MCPServer) -> bool:
+        """Make sure at least one connection to the server is open"""
+        pool = await self._get_pool(server)
+        await asyncio.wait_for(
+            pool[0].ensure_connected(),
+            timeout=settings.MCP_SERVER_TIMEOUT
+        )
+        return pool[0].is_open
+
+    async def close_server(self, server_id: int) -> None:
+        """Close all connections to a server"""
+        entry = self._pools.pop(server_id, None)
+        if entry is None:
+            return
+        for connection in entry[1]:
+            await connection.close()
+
+    async def aclose(self) -> None:
+        """Close all connections"""
+        for server_id in list(self._pools):
+            await self.close_server(server_id)
+
+
+mcp_connections = MCPConnectionManager()
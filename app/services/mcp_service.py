@@ -1,62 +1,95 @@
-import httpx
-import json
-import asyncio
+import time
 from typing import Dict, Any, Optional, List
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from app.models.mcp_server import MCPServer
 from app.core.config import settings
+from app.core.http import http_clients
+from app.services.circuit_breaker import CircuitBreaker, MCPServerUnavailable, mcp_breakers
+from app.services.mcp_connections import mcp_connections
+from app.services.config_cache import config_cache, detached_copy
+from app.services.single_flight import request_key, single_flight
 
 
 class MCPService:
     def __init__(self):
         self.clients = {}
 
-    async def connect_to_server(self, server_id: int, db: Session) -> bool:
+    async def connect_to_server(self, server_id: int, db: AsyncSession) -> bool:
         """Connect to MCP server"""
-        server = db.query(MCPServer).filter(MCPServer.id == server_id).first()
+        server = await self.get_server_async(server_id, db)
         if not server:
             return False
 
         try:
-            if server.server_type == "http":
-                # Test HTTP connection
-                async with httpx.AsyncClient() as client:
-                    response = await client.get(
-                        server.server_url,
-                        timeout=settings.MCP_SERVER_TIMEOUT
-                    )
-                    return response.status_code == 200
-            elif server.server_type == "websocket":
-                # Test WebSocket connection
-                async with httpx.AsyncClient() as client:
-                    async with client.websocket_connect(
-                        server.server_url,
-                        timeout=settings.MCP_SERVER_TIMEOUT
-                    ) as websocket:
-                        return True
-            return False
+            return await self._check(server, settings.MCP_SERVER_TIMEOUT)
         except Exception:
             return False
 
+    async def _check(self, server: MCPServer, timeout: float, strict: bool = True) -> bool:
+        if server.server_type == "http":
+            # Test HTTP connection
+            client = http_clients.get_client(server.server_url)
+            response = await client.get(server.server_url, timeout=timeout)
+            if strict:
+                return response.status_code == 200
+            # Servers that only answer POST /mcp/{method} are still up
+            return response.status_code < 500
+        elif server.server_type == "websocket":
+            # Test WebSocket connection
+            return await mcp_connections.check(server)
+        return False
+
+    def breaker(self, server: MCPServer) -> CircuitBreaker:
+        """Circuit breaker of a server, probed with a short connection check"""
+        return mcp_breakers.get(
+            server, lambda: self._check(server, settings.MCP_BREAKER_PROBE_TIMEOUT, strict=False)
+        )
+
     async def call_mcp_server(
         self, 
         server_id: int, 
         method: str, 
         params: Dict[str, Any], 
-        db: Session
+        db: AsyncSession
     ) -> Dict[str, Any]:
         """Call MCP server method"""
-        server = db.query(MCPServer).filter(MCPServer.id == server_id).first()
+        server = await self.get_server_async(server_id, db)
         if not server:
             raise ValueError(f"MCP server with id {server_id} not found")
 
         if server.server_type == "http":
-            return await self._call_http_server(server, method, params)
+            call = self._call_http_server
         elif server.server_type == "websocket":
-            return await self._call_websocket_server(server, method, params)
+            call = self._call_websocket_server
         else:
             raise ValueError(f"Unsupported server type: {server.server_type}")
 
+        breaker = self.breaker(server)
+        if not breaker.allow():
+            # Fail fast instead of waiting out the timeout on a dead server
+            raise MCPServerUnavailable(f"MCP server {server.name} is unavailable (circuit {breaker.state})")
+
+        async def tracked_call() -> Dict[str, Any]:
+            started = time.monotonic()
+            try:
+                result = await call(server, method, params)
+            except Exception as e:
+                breaker.record(False, time.monotonic() - started, str(e) or type(e).__name__)
+                raise
+            breaker.record(True, time.monotonic() - started)
+            return result
+
+        if (server.configuration or {}).get("coalesce_requests", True):
+            # Identical concurrent lookups share one round-trip
+            return await single_flight.run(
+                request_key("mcp", server_id=server.id, method=method, params=params),
+                tracked_call,
+                distributed=settings.SINGLE_FLIGHT_DISTRIBUTED
+            )
+        return await tracked_call()
+
     async def _call_http_server(
         self, 
         server: MCPServer, 
@@ -64,18 +97,18 @@ class MCPService:
         params: Dict[str, Any]
     ) -> Dict[str, Any]:
         """Call HTTP-based MCP server"""
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{server.server_url}/mcp/{method}",
-                json=params,
-                headers={"Content-Type": "application/json"},
-                timeout=settings.MCP_SERVER_TIMEOUT
-            )
-            
-            if response.status_code != 200:
-                raise Exception(f"MCP server error: {response.text}")
-            
-            return response.json()
+        client = http_clients.get_client(server.server_url)
+        response = await client.post(
+            f"{server.server_url}/mcp/{method}",
+            json=params,
+            headers={"Content-Type": "application/json"},
+            timeout=settings.MCP_SERVER_TIMEOUT
+        )
+        
+        if response.status_code != 200:
+            raise Exception(f"MCP server error: {response.text}")
+        
+        return response.json()
 
     async def _call_websocket_server(
         self, 
@@ -84,28 +117,7 @@ class MCPService:
         params: Dict[str, Any]
     ) -> Dict[str, Any]:
         """Call WebSocket-based MCP server"""
-        async with httpx.AsyncClient() as client:
-            async with client.websocket_connect(
-                server.server_url,
-                timeout=settings.MCP_SERVER_TIMEOUT
-            ) as websocket:
-                # Send request
-                request = {
-                    "jsonrpc": "2.0",
-                    "id": 1,
-                    "method": method,
-                    "params": params
-                }
-                await websocket.send_text(json.dumps(request))
-                
-                # Receive response
-                response_text = await websocket.receive_text()
-                response = json.loads(response_text)
-                
-                if "error" in response:
-                    raise Exception(f"MCP server error: {response['error']}")
-                
-                return response.get("result", {})
+        return await mcp_connections.call(server, method, params)
 
     def list_servers(self, db: Session) -> List[MCPServer]:
         """List all available MCP servers"""
@@ -115,9 +127,18 @@ class MCPService:
         """Get specific MCP server"""
         return db.query(MCPServer).filter(MCPServer.id == server_id).first()
 
-    async def test_server_connection(self, server_id: int, db: Session) -> Dict[str, Any]:
+    async def get_server_async(self, server_id: int, db: AsyncSession) -> Optional[MCPServer]:
+        """Get specific MCP server, served from the config cache when possible"""
+        async def load() -> Optional[MCPServer]:
+            result = await db.execute(select(MCPServer).where(MCPServer.id == server_id))
+            server = result.scalars().first()
+            return detached_copy(server) if server else None
+
+        return await config_cache.get("mcp_server", server_id, load)
+
+    async def test_server_connection(self, server_id: int, db: AsyncSession) -> Dict[str, Any]:
         """Test connection to MCP server"""
-        server = self.get_server(server_id, db)
+        server = await self.get_server_async(server_id, db)
         if not server:
             return {"success": False, "error": "Server not found"}
 
@@ -127,7 +148,8 @@ class MCPService:
                 "success": is_connected,
                 "server_name": server.name,
                 "server_url": server.server_url,
-                "server_type": server.server_type
+                "server_type": server.server_type,
+                "circuit": mcp_breakers.snapshot(server_id)
             }
         except Exception as e:
             return {"success": False, "error": str(e)} 
\ No newline at end of file
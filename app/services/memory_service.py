@@ -1,45 +1,137 @@
+import asyncio
 import json
-import redis
+import logging
 from typing import Dict, Any, List, Optional
+from sqlalchemy import and_, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from app.models.chat_session import ChatSession
 from app.models.chat import Chat, Message
 from app.core.config import settings
+from app.core.redis import redis_clients
+from app.core.database import AsyncSessionLocal
+
+logger = logging.getLogger(__name__)
+
+
+# Seed a chat's memory from Postgres only if no other writer got there first.
+# KEYS: meta, history. ARGV: ttl, meta json, history entries...
+SEED_MEMORY_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[1])
+if #ARGV > 2 then
+    redis.call('RPUSH', KEYS[2], unpack(ARGV, 3))
+    redis.call('EXPIRE', KEYS[2], ARGV[1])
+end
+return 1
+"""
+
+DIRTY_CHATS_KEY = "chat_memory:dirty"
 
 
 class MemoryService:
+    """Chat memory kept in Redis and written behind to ``ChatSession.memory_data``.
+
+    Each chat has a small ``meta`` key (context, summary, key points) and an
+    append-only ``history`` list. Appending a message is a single pipelined
+    RPUSH/LTRIM/EXPIRE, so concurrent writers never lose each other's
+    entries. Chats with unsaved changes are tracked in a Redis set and
+    persisted to Postgres in batches by ``run_write_behind``.
+    """
+
     def __init__(self):
-        self.redis_client = redis.from_url(settings.REDIS_URL)
+        self.redis_client = redis_clients.sync_client
+        self.async_redis_client = redis_clients.async_client
+        self._seed_script = self.redis_client.register_script(SEED_MEMORY_SCRIPT)
+        self._async_seed_script = self.async_redis_client.register_script(SEED_MEMORY_SCRIPT)
 
-    def get_chat_memory(self, chat_id: int, db: Session) -> Dict[str, Any]:
-        """Get chat memory from database and cache"""
-        # Try to get from cache first
-        cache_key = f"chat_memory:{chat_id}"
-        cached_memory = self.redis_client.get(cache_key)
-        
-        if cached_memory:
-            return json.loads(cached_memory)
+    @staticmethod
+    def _meta_key(chat_id: int) -> str:
+        return f"chat_memory:{chat_id}:meta"
+
+    @staticmethod
+    def _history_key(chat_id: int) -> str:
+        return f"chat_memory:{chat_id}:history"
+
+    @staticmethod
+    def _empty_memory() -> Dict[str, Any]:
+        return {
+            "context": "",
+            "summary": "",
+            "key_points": [],
+            "conversation_history": []
+        }
+
+    @staticmethod
+    def _split_memory(memory_data: Dict[str, Any]):
+        """Split a memory dict into its meta json and encoded history entries"""
+        meta = {k: v for k, v in memory_data.items() if k != "conversation_history"}
+        history = memory_data.get("conversation_history", [])[-settings.MAX_CHAT_HISTORY:]
+        return json.dumps(meta), [json.dumps(entry) for entry in history]
+
+    @staticmethod
+    def _join_memory(meta: Optional[bytes], history: List[bytes]) -> Dict[str, Any]:
+        memory = MemoryService._empty_memory()
+        if meta:
+            memory.update(json.loads(meta))
+        memory["conversation_history"] = [json.loads(entry) for entry in history]
+        return memory
+
+    def _seed_args(self, chat_id: int, memory_data: Dict[str, Any]):
+        meta, history = self._split_memory(memory_data)
+        keys = [self._meta_key(chat_id), self._history_key(chat_id)]
+        return keys, [settings.CHAT_MEMORY_TTL, meta, *history]
+
+    def _ensure_loaded(self, chat_id: int, db: Session) -> None:
+        """Load memory from Postgres into Redis if it is not cached"""
+        if self.redis_client.exists(self._meta_key(chat_id)):
+            return
 
-        # Get from database
         session = db.query(ChatSession).filter(ChatSession.chat_id == chat_id).first()
-        if session and session.memory_data:
-            memory_data = session.memory_data
-        else:
-            memory_data = {
-                "context": "",
-                "summary": "",
-                "key_points": [],
-                "conversation_history": []
-            }
+        memory_data = session.memory_data if session and session.memory_data else self._empty_memory()
+        keys, args = self._seed_args(chat_id, memory_data)
+        self._seed_script(keys=keys, args=args)
 
-        # Cache the memory
-        self.redis_client.setex(
-            cache_key, 
-            settings.CHAT_MEMORY_TTL, 
-            json.dumps(memory_data)
-        )
-        
-        return memory_data
+    async def _ensure_loaded_async(self, chat_id: int, db: AsyncSession) -> None:
+        """Load memory from Postgres into Redis if it is not cached"""
+        if await self.async_redis_client.exists(self._meta_key(chat_id)):
+            return
+
+        session = await self._get_session_async(chat_id, db)
+        memory_data = session.memory_data if session and session.memory_data else self._empty_memory()
+        keys, args = self._seed_args(chat_id, memory_data)
+        await self._async_seed_script(keys=keys, args=args)
+
+    def get_chat_memory(self, chat_id: int, db: Session) -> Dict[str, Any]:
+        """Get chat memory from cache, loading it from the database on a miss"""
+        self._ensure_loaded(chat_id, db)
+
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.get(self._meta_key(chat_id))
+        pipe.lrange(self._history_key(chat_id), 0, -1)
+        meta, history = pipe.execute()
+        return self._join_memory(meta, history)
+
+    async def get_chat_memory_async(self, chat_id: int, db: AsyncSession) -> Dict[str, Any]:
+        """Get chat memory from cache, loading it from the database on a miss"""
+        await self._ensure_loaded_async(chat_id, db)
+
+        async with self.async_redis_client.pipeline(transaction=False) as pipe:
+            pipe.get(self._meta_key(chat_id))
+            pipe.lrange(self._history_key(chat_id), 0, -1)
+            meta, history = await pipe.execute()
+        return self._join_memory(meta, history)
+
+    def _replace_memory(self, pipe, chat_id: int, memory_data: Dict[str, Any]) -> None:
+        meta, history = self._split_memory(memory_data)
+        pipe.set(self._meta_key(chat_id), meta, ex=settings.CHAT_MEMORY_TTL)
+        pipe.delete(self._history_key(chat_id))
+        if history:
+            pipe.rpush(self._history_key(chat_id), *history)
+            pipe.expire(self._history_key(chat_id), settings.CHAT_MEMORY_TTL)
+        pipe.sadd(DIRTY_CHATS_KEY, chat_id)
 
     def update_chat_memory(
         self, 
@@ -47,46 +139,100 @@ class MemoryService:
         memory_data: Dict[str, Any], 
         db: Session
     ) -> None:
-        """Update chat memory in database and cache"""
-        # Update database
-        session = db.query(ChatSession).filter(ChatSession.chat_id == chat_id).first()
-        if not session:
-            session = ChatSession(
-                session_id=f"session_{chat_id}",
-                chat_id=chat_id,
-                memory_data=memory_data
-            )
-            db.add(session)
-        else:
-            session.memory_data = memory_data
-        
-        db.commit()
-
-        # Update cache
-        cache_key = f"chat_memory:{chat_id}"
-        self.redis_client.setex(
-            cache_key, 
-            settings.CHAT_MEMORY_TTL, 
-            json.dumps(memory_data)
-        )
+        """Replace chat memory; the database copy is written behind"""
+        pipe = self.redis_client.pipeline(transaction=True)
+        self._replace_memory(pipe, chat_id, memory_data)
+        pipe.execute()
+
+    async def update_chat_memory_async(
+        self, 
+        chat_id: int, 
+        memory_data: Dict[str, Any], 
+        db: AsyncSession
+    ) -> None:
+        """Replace chat memory; the database copy is written behind"""
+        async with self.async_redis_client.pipeline(transaction=True) as pipe:
+            self._replace_memory(pipe, chat_id, memory_data)
+            await pipe.execute()
 
     def get_conversation_history(
         self, 
         chat_id: int, 
         limit: int = None, 
-        db: Session = None
+        db: Session = None,
+        before_id: int = None
     ) -> List[Dict[str, Any]]:
-        """Get conversation history for a chat"""
+        """Get conversation history for a chat.
+
+        With ``limit`` only the newest ``limit`` messages are read, returned
+        in chronological order. ``before_id`` is a keyset cursor: only
+        messages older than that message are returned.
+        """
         if not db:
             return []
 
-        query = db.query(Message).filter(Message.chat_id == chat_id).order_by(Message.created_at)
-        
+        messages = db.execute(self._history_query(chat_id, limit, before_id)).scalars().all()
+        return self._format_history(messages, limit)
+
+    async def get_conversation_history_async(
+        self, 
+        chat_id: int, 
+        limit: int = None, 
+        db: AsyncSession = None,
+        before_id: int = None
+    ) -> List[Dict[str, Any]]:
+        """Get conversation history for a chat without blocking the event loop"""
+        if not db:
+            return []
+
+        result = await db.execute(self._history_query(chat_id, limit, before_id))
+        return self._format_history(result.scalars().all(), limit)
+
+    async def get_history_range_async(
+        self,
+        chat_id: int,
+        after_id: int,
+        before_id: int,
+        limit: int,
+        db: AsyncSession
+    ) -> List[Dict[str, Any]]:
+        """The oldest ``limit`` messages with ``after_id < id < before_id``, in order"""
+        result = await db.execute(
+            select(Message)
+            .where(Message.chat_id == chat_id, Message.id > after_id, Message.id < before_id)
+            .order_by(Message.id)
+            .limit(limit)
+        )
+        return self._format_history(result.scalars().all(), None)
+
+    @staticmethod
+    def _history_query(chat_id: int, limit: Optional[int], before_id: Optional[int]):
+        query = select(Message).where(Message.chat_id == chat_id)
+
+        if before_id:
+            cursor_created_at = (
+                select(Message.created_at)
+                .where(Message.id == before_id, Message.chat_id == chat_id)
+                .scalar_subquery()
+            )
+            query = query.where(
+                or_(
+                    Message.created_at < cursor_created_at,
+                    and_(Message.created_at == cursor_created_at, Message.id < before_id)
+                )
+            )
+
         if limit:
-            query = query.limit(limit)
-        
-        messages = query.all()
-        
+            # Read the tail of the chat newest-first so only `limit` rows are loaded
+            return query.order_by(Message.created_at.desc(), Message.id.desc()).limit(limit)
+
+        return query.order_by(Message.created_at, Message.id)
+
+    @staticmethod
+    def _format_history(messages: List[Message], limit: Optional[int]) -> List[Dict[str, Any]]:
+        if limit:
+            messages = list(reversed(messages))
+
         return [
             {
                 "id": msg.id,
@@ -98,6 +244,14 @@ class MemoryService:
             for msg in messages
         ]
 
+    def _append_entries(self, pipe, chat_id: int, entries: List[Dict[str, Any]]) -> None:
+        history_key = self._history_key(chat_id)
+        pipe.rpush(history_key, *[json.dumps(entry) for entry in entries])
+        pipe.ltrim(history_key, -settings.MAX_CHAT_HISTORY, -1)
+        pipe.expire(history_key, settings.CHAT_MEMORY_TTL)
+        pipe.expire(self._meta_key(chat_id), settings.CHAT_MEMORY_TTL)
+        pipe.sadd(DIRTY_CHATS_KEY, chat_id)
+
     def add_message_to_memory(
         self, 
         chat_id: int, 
@@ -110,62 +264,196 @@ class MemoryService:
         if not db:
             return
 
-        # Get current memory
-        memory = self.get_chat_memory(chat_id, db)
-        
-        # Add message to history
-        message_entry = {
+        self._ensure_loaded(chat_id, db)
+
+        pipe = self.redis_client.pipeline(transaction=True)
+        self._append_entries(pipe, chat_id, [{
             "role": role,
             "content": content,
             "metadata": metadata or {}
-        }
-        
-        memory["conversation_history"].append(message_entry)
-        
-        # Keep only recent history
-        if len(memory["conversation_history"]) > settings.MAX_CHAT_HISTORY:
-            memory["conversation_history"] = memory["conversation_history"][-settings.MAX_CHAT_HISTORY:]
-        
-        # Update memory
-        self.update_chat_memory(chat_id, memory, db)
+        }])
+        pipe.execute()
+
+    async def add_message_to_memory_async(
+        self, 
+        chat_id: int, 
+        role: str, 
+        content: str, 
+        metadata: Dict[str, Any] = None,
+        db: AsyncSession = None
+    ) -> None:
+        """Add a message to chat memory"""
+        await self.add_messages_to_memory_async(
+            chat_id,
+            [{"role": role, "content": content, "metadata": metadata or {}}],
+            db=db
+        )
+
+    async def add_messages_to_memory_async(
+        self,
+        chat_id: int,
+        entries: List[Dict[str, Any]],
+        db: AsyncSession = None,
+        turn_id: Optional[int] = None
+    ) -> None:
+        """Append several ``{"role", "content", "metadata"}`` entries in one round-trip.
+
+        Entries appended with a ``turn_id`` are skipped if that turn is
+        already in memory, so a replayed job does not add them twice.
+        """
+        if not db or not entries:
+            return
+
+        await self._ensure_loaded_async(chat_id, db)
+
+        if turn_id is not None:
+            history = await self.async_redis_client.lrange(self._history_key(chat_id), 0, -1)
+            if any(json.loads(entry).get("turn_id") == turn_id for entry in history):
+                return
+            entries = [{**entry, "turn_id": turn_id} for entry in entries]
+
+        async with self.async_redis_client.pipeline(transaction=True) as pipe:
+            self._append_entries(pipe, chat_id, entries)
+            await pipe.execute()
+
+    async def get_memory_meta_async(self, chat_id: int, db: AsyncSession) -> Dict[str, Any]:
+        """Get the memory fields other than the conversation history"""
+        await self._ensure_loaded_async(chat_id, db)
+
+        meta = await self.async_redis_client.get(self._meta_key(chat_id))
+        memory = self._empty_memory()
+        del memory["conversation_history"]
+        if meta:
+            memory.update(json.loads(meta))
+        return memory
+
+    async def update_memory_meta_async(
+        self,
+        chat_id: int,
+        fields: Dict[str, Any],
+        db: AsyncSession
+    ) -> None:
+        """Update memory fields such as the summary, leaving the history alone"""
+        meta = await self.get_memory_meta_async(chat_id, db)
+        meta.update(fields)
+
+        async with self.async_redis_client.pipeline(transaction=True) as pipe:
+            pipe.set(self._meta_key(chat_id), json.dumps(meta), ex=settings.CHAT_MEMORY_TTL)
+            # Keep the history alive as long as the meta, or _ensure_loaded
+            # would see the meta and never reload the expired history
+            pipe.expire(self._history_key(chat_id), settings.CHAT_MEMORY_TTL)
+            pipe.sadd(DIRTY_CHATS_KEY, chat_id)
+            await pipe.execute()
 
     def generate_context_summary(
         self, 
         chat_id: int, 
         db: Session
     ) -> str:
-        """Generate a summary of the conversation context"""
+        """Get the rolling summary of turns that fell out of the prompt window"""
         memory = self.get_chat_memory(chat_id, db)
-        history = memory.get("conversation_history", [])
-        
-        if not history:
-            return ""
-        
-        # Create a simple summary from recent messages
-        recent_messages = history[-10:]  # Last 10 messages
-        summary_parts = []
-        
-        for msg in recent_messages:
-            if msg["role"] == "user":
-                summary_parts.append(f"User: {msg['content'][:100]}...")
-            elif msg["role"] == "assistant":
-                summary_parts.append(f"Assistant: {msg['content'][:100]}...")
-        
-        return "\n".join(summary_parts)
+        return memory.get("summary", "")
 
     def clear_chat_memory(self, chat_id: int, db: Session) -> None:
         """Clear chat memory"""
         # Clear from database
         session = db.query(ChatSession).filter(ChatSession.chat_id == chat_id).first()
         if session:
-            session.memory_data = {
-                "context": "",
-                "summary": "",
-                "key_points": [],
-                "conversation_history": []
-            }
+            session.memory_data = self._empty_memory()
             db.commit()
         
         # Clear from cache
-        cache_key = f"chat_memory:{chat_id}"
-        self.redis_client.delete(cache_key) 
\ No newline at end of file
+        pipe = self.redis_client.pipeline(transaction=True)
+        pipe.delete(self._meta_key(chat_id), self._history_key(chat_id))
+        pipe.srem(DIRTY_CHATS_KEY, chat_id)
+        pipe.execute()
+
+    async def flush_dirty_memory(self, batch_size: int = None) -> int:
+        """Persist a batch of changed chat memories to Postgres in one commit.
+
+        Returns the number of dirty chats taken from the set.
+        """
+        raw_ids = await self.async_redis_client.spop(
+            DIRTY_CHATS_KEY, batch_size or settings.MEMORY_FLUSH_BATCH_SIZE
+        )
+        if not raw_ids:
+            return 0
+
+        chat_ids = [int(raw_id) for raw_id in raw_ids]
+        try:
+            async with self.async_redis_client.pipeline(transaction=False) as pipe:
+                for chat_id in chat_ids:
+                    pipe.get(self._meta_key(chat_id))
+                    pipe.lrange(self._history_key(chat_id), 0, -1)
+                results = await pipe.execute()
+
+            memories = {}
+            for index, chat_id in enumerate(chat_ids):
+                meta, history = results[2 * index], results[2 * index + 1]
+                if meta is None:
+                    # Cleared or expired since it was marked dirty
+                    continue
+                memories[chat_id] = self._join_memory(meta, history)
+
+            if not memories:
+                return len(chat_ids)
+
+            async with AsyncSessionLocal() as db:
+                result = await db.execute(select(Chat.id).where(Chat.id.in_(list(memories))))
+                existing = set(result.scalars())
+                deleted = [chat_id for chat_id in memories if chat_id not in existing]
+                if deleted:
+                    # A job re-seeded memory for a chat deleted since; drop it
+                    # rather than fail the whole batch on the foreign key
+                    await self.async_redis_client.delete(
+                        *[key for chat_id in deleted for key in (self._meta_key(chat_id), self._history_key(chat_id))]
+                    )
+                    for chat_id in deleted:
+                        del memories[chat_id]
+
+                result = await db.execute(
+                    select(ChatSession).where(ChatSession.chat_id.in_(list(memories)))
+                )
+                sessions = {session.chat_id: session for session in result.scalars()}
+                for chat_id, memory_data in memories.items():
+                    session = sessions.get(chat_id)
+                    if session:
+                        session.memory_data = memory_data
+                    else:
+                        db.add(ChatSession(
+                            session_id=f"session_{chat_id}",
+                            chat_id=chat_id,
+                            memory_data=memory_data
+                        ))
+                await db.commit()
+            return len(chat_ids)
+        except Exception:
+            # Put the batch back so the next flush retries it
+            await self.async_redis_client.sadd(DIRTY_CHATS_KEY, *chat_ids)
+            raise
+
+    async def flush_all_dirty_memory(self) -> None:
+        """Flush batches until no dirty chats are left"""
+        while await self.flush_dirty_memory() >= settings.MEMORY_FLUSH_BATCH_SIZE:
+            pass
+
+    async def run_write_behind(self) -> None:
+        """Periodically flush dirty chat memories until cancelled"""
+        while True:
+            try:
+                await asyncio.sleep(settings.MEMORY_FLUSH_INTERVAL)
+                await self.flush_all_dirty_memory()
+            except asyncio.CancelledError:
+                # Persist whatever is left before shutting down
+                try:
+                    await self.flush_all_dirty_memory()
+                except Exception as e:
+                    logger.warning("Memory write-behind error: %s", e)
+                raise
+            except Exception as e:
+                logger.warning("Memory write-behind error: %s", e)
+
+    @staticmethod
+    async def _get_session_async(chat_id: int, db: AsyncSession) -> Optional[ChatSession]:
+        result = await db.execute(select(ChatSession).where(ChatSession.chat_id == chat_id))
+        return result.scalars().first()
@@ -0,0 +1,180 @@
+import asyncio
+import json
+import logging
+import random
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Set
+from sqlalchemy.exc import IntegrityError
+from app.core.config import settings
+from app.core.redis import redis_clients
+
+logger = logging.getLogger(__name__)
+
+JobHandler = Callable[[Dict[str, Any]], Awaitable[None]]
+
+PENDING_JOBS_KEY = "post_response:pending"
+DEAD_JOBS_KEY = "post_response:dead"
+
+# Failures that will not go away on retry, e.g. the chat was deleted meanwhile
+NON_RETRYABLE_ERRORS = (IntegrityError,)
+
+
+class PostResponsePipeline:
+    """Runs post-response work (persistence, memory, tracing) off the request path.
+
+    Jobs for the same chat run one at a time in submission order, while
+    different chats proceed concurrently. Failed jobs are retried with
+    jittered backoff. Jobs that cannot run in-process (queue full, retries
+    exhausted, shutdown) are pushed to a Redis list and replayed later; a
+    job still failing after ``POST_RESPONSE_MAX_REPLAYS`` replays, or failing
+    with a non-retryable error, is moved to a dead-letter list instead.
+    """
+
+    def __init__(self):
+        self._handlers: Dict[str, JobHandler] = {}
+        self._queues: Dict[int, Deque[Dict[str, Any]]] = {}
+        self._workers: Dict[int, asyncio.Task] = {}
+        self._spills: Set[asyncio.Task] = set()
+        self._queued = 0
+
+    @property
+    def redis_client(self):
+        return redis_clients.async_client
+
+    def register(self, job_type: str, handler: JobHandler) -> None:
+        """Register the coroutine that runs jobs of ``job_type``"""
+        self._handlers[job_type] = handler
+
+    def submit(self, chat_id: int, job_type: str, payload: Dict[str, Any]) -> None:
+        """Queue a job without waiting for it; payload must be JSON-serializable"""
+        self._enqueue({"type": job_type, "chat_id": chat_id, "payload": payload, "attempts": 0, "replays": 0})
+
+    def _enqueue(self, job: Dict[str, Any]) -> None:
+        chat_id = job["chat_id"]
+        if self._queued >= settings.POST_RESPONSE_MAX_QUEUE:
+            # Hold a reference so the spill is not garbage-collected mid-flight
+            spill = asyncio.create_task(self._spill(job))
+            self._spills.add(spill)
+            spill.add_done_callback(self._spills.discard)
+            return
+
+        self._queues.setdefault(chat_id, deque()).append(job)
+        self._queued += 1
+        if chat_id not in self._workers:
+            self._workers[chat_id] = asyncio.create_task(self._run_chat(chat_id))
+
+    async def wait_for_chat(self, chat_id: int, timeout: float = None) -> None:
+        """Wait until queued jobs for a chat have run, e.g. before reading its history"""
+        worker = self._workers.get(chat_id)
+        if worker is not None:
+            await asyncio.wait(
+                {worker},
+                timeout=timeout if timeout is not None else settings.POST_RESPONSE_WAIT_TIMEOUT
+            )
+
+    async def _run_chat(self, chat_id: int) -> None:
+        queue = self._queues[chat_id]
+        try:
+            while queue:
+                job = queue[0]
+                await self._run_job(job)
+                queue.popleft()
+                self._queued -= 1
+        finally:
+            self._workers.pop(chat_id, None)
+            if not queue:
+                self._queues.pop(chat_id, None)
+
+    async def _run_job(self, job: Dict[str, Any]) -> None:
+        handler = self._handlers.get(job["type"])
+        if handler is None:
+            await self._spill(job)
+            return
+
+        # Attempts accumulate across replays; each run gets a fresh retry budget
+        tries = 0
+        while True:
+            try:
+                await handler(job["payload"])
+                return
+            except NON_RETRYABLE_ERRORS as e:
+                job["attempts"] += 1
+                await self._dead_letter(job, e)
+                return
+            except Exception as e:
+                job["attempts"] += 1
+                tries += 1
+                if tries >= settings.POST_RESPONSE_MAX_RETRIES:
+                    logger.warning("Post-response job %s failed, deferring to Redis: %s", job["type"], e)
+                    await self._spill(job)
+                    return
+                delay = settings.POST_RESPONSE_RETRY_BASE_DELAY * 2 ** (tries - 1)
+                await asyncio.sleep(delay * random.uniform(0.5, 1.0))
+
+    async def _spill(self, job: Dict[str, Any]) -> None:
+        try:
+            await self.redis_client.rpush(PENDING_JOBS_KEY, json.dumps(job))
+        except Exception as e:
+            logger.error("Post-response job %s for chat %s lost: %s", job["type"], job["chat_id"], e)
+
+    async def _dead_letter(self, job: Dict[str, Any], error: Any) -> None:
+        logger.error(
+            "Post-response job %s for chat %s dead-lettered after %s attempts and %s replays: %s",
+            job["type"], job["chat_id"], job["attempts"], job["replays"], error
+        )
+        try:
+            await self.redis_client.rpush(DEAD_JOBS_KEY, json.dumps(job))
+        except Exception as e:
+            logger.error("Post-response job %s for chat %s lost: %s", job["type"], job["chat_id"], e)
+
+    async def replay_pending(self, batch_size: int = 100) -> int:
+        """Move jobs deferred to Redis back onto the in-process queues"""
+        raw_jobs = await self.redis_client.lpop(PENDING_JOBS_KEY, batch_size)
+        if not raw_jobs:
+            return 0
+
+        for raw_job in raw_jobs:
+            job = json.loads(raw_job)
+            if job["type"] not in self._handlers:
+                await self.redis_client.rpush(PENDING_JOBS_KEY, raw_job)
+                continue
+            job.setdefault("attempts", 0)
+            job["replays"] = job.get("replays", 0) + 1
+            if job["replays"] > settings.POST_RESPONSE_MAX_REPLAYS:
+                await self._dead_letter(job, "replay limit reached")
+                continue
+            self._enqueue(job)
+        return len(raw_jobs)
+
+    async def run_replay(self) -> None:
+        """Periodically replay deferred jobs until cancelled"""
+        while True:
+            await asyncio.sleep(settings.POST_RESPONSE_REPLAY_INTERVAL)
+            try:
+                await self.replay_pending()
+            except Exception as e:
+                logger.warning("Post-response replay error: %s", e)
+
+    async def shutdown(self, timeout: float = None) -> None:
+        """Drain queued jobs, deferring anything unfinished to Redis"""
+        workers = list(self._workers.values())
+        if workers:
+            await asyncio.wait(
+                workers,
+                timeout=timeout if timeout is not None else settings.POST_RESPONSE_SHUTDOWN_TIMEOUT
+            )
+
+        for worker in list(self._workers.values()):
+            worker.cancel()
+        # The head of a queue may have run partly before it was cancelled;
+        # the persistence and memory handlers are idempotent, so replaying is safe
+        for queue in self._queues.values():
+            for job in queue:
+                await self._spill(job)
+        if self._spills:
+            await asyncio.wait(list(self._spills))
+        self._queues.clear()
+        self._queued = 0
+
+
+post_response_pipeline = PostResponsePipeline()
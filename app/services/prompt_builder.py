@@ -0,0 +1,208 @@
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional, Set, Tuple
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal
+from app.models.chat import Chat
+from app.services.llm_service import LLMService
+from app.services.memory_service import MemoryService
+from app.services.token_counter import (
+    MESSAGE_OVERHEAD_TOKENS,
+    count_tokens,
+    message_tokens,
+    model_family,
+)
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_INSTRUCTIONS = (
+    "You maintain a running summary of a conversation. Update the current "
+    "summary with the new messages. Keep facts, decisions, names and open "
+    "questions; drop small talk. Reply with the updated summary only."
+)
+
+
+class PromptBuilder:
+    """Packs a chat's history into the model's context window.
+
+    The newest messages that fit the token budget go into the prompt
+    verbatim. Older ones are covered by a rolling summary kept in chat
+    memory (``summary`` / ``summary_through_id``), which is extended in the
+    background as messages fall out of the window.
+    """
+
+    def __init__(self, llm_service: LLMService, memory_service: MemoryService):
+        self.llm_service = llm_service
+        self.memory_service = memory_service
+        self._summarizing: Set[int] = set()
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def build(
+        self,
+        chat: Chat,
+        message_content: str,
+        db: AsyncSession,
+        exclude_message_id: Optional[int] = None
+    ) -> Tuple[List[Dict[str, Any]], List[Dict[str, str]]]:
+        """Build the prompt for a new user message.
+
+        Returns the history entries that made it into the window and the
+        messages to send to the LLM.
+        """
+        family, budget, model_id = await self._budget(chat, db)
+
+        history = await self.memory_service.get_conversation_history_async(
+            chat.id, limit=settings.CHAT_CONTEXT_MESSAGES, db=db
+        )
+        if exclude_message_id is not None:
+            history = [msg for msg in history if msg["id"] != exclude_message_id]
+
+        meta = await self.memory_service.get_memory_meta_async(chat.id, db)
+        summary = meta.get("summary") or ""
+        summary_through_id = meta.get("summary_through_id") or 0
+
+        budget -= count_tokens(message_content, family) + MESSAGE_OVERHEAD_TOKENS
+        if summary:
+            budget -= count_tokens(summary, family) + MESSAGE_OVERHEAD_TOKENS
+
+        # Take the newest messages that fit, walking back from the end
+        start = len(history)
+        while start > 0:
+            tokens = message_tokens(history[start - 1], family)
+            if tokens > budget:
+                break
+            budget -= tokens
+            start -= 1
+
+        window = history[start:]
+        # Already summarized messages stay out of the prompt too
+        window = [msg for msg in window if msg["id"] > summary_through_id] if summary else window
+
+        # Summarize what fell out of the window, including messages past the
+        # CHAT_CONTEXT_MESSAGES cap that were never read here
+        overflow = any(msg["id"] > summary_through_id for msg in history[:start])
+        capped = len(history) >= settings.CHAT_CONTEXT_MESSAGES and history[0]["id"] > summary_through_id
+        if overflow or capped:
+            window_start_id = history[start]["id"] if start < len(history) else history[-1]["id"] + 1
+            self._schedule_summary(chat.id, model_id, window_start_id)
+
+        messages = []
+        if summary:
+            messages.append({
+                "role": "system",
+                "content": f"Summary of the earlier conversation:\n{summary}"
+            })
+        for msg in window:
+            messages.append({
+                "role": msg["role"],
+                "content": msg["content"]
+            })
+
+        # Add current user message
+        messages.append({
+            "role": "user",
+            "content": message_content
+        })
+
+        return window, messages
+
+    async def _budget(self, chat: Chat, db: AsyncSession) -> Tuple[str, int, Optional[int]]:
+        """Tokenizer family, prompt token budget and model id for a chat"""
+        model = None
+        if chat.llm_model_id:
+            model = await self.llm_service.get_model_async(chat.llm_model_id, db)
+
+        configuration = (model.configuration if model else None) or {}
+        context_window = configuration.get("context_window", settings.CHAT_CONTEXT_WINDOW_TOKENS)
+        # Leave room for the response the model is actually asked for
+        reserve = LLMService.max_output_tokens(model) if model else settings.MCP_MAX_TOKENS
+        family = model_family(model.provider if model else None)
+        return family, max(context_window - reserve, 0), model.id if model else None
+
+    def _schedule_summary(self, chat_id: int, model_id: Optional[int], before_id: int):
+        """Fold unsummarized messages older than ``before_id`` into the summary off the request path"""
+        if chat_id in self._summarizing:
+            return
+        self._summarizing.add(chat_id)
+
+        task = asyncio.create_task(self._fold_into_summary(chat_id, model_id, before_id))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _fold_into_summary(
+        self,
+        chat_id: int,
+        model_id: Optional[int],
+        before_id: int
+    ) -> None:
+        try:
+            async with AsyncSessionLocal() as db:
+                meta = await self.memory_service.get_memory_meta_async(chat_id, db)
+                # Oldest first, so summary_through_id never skips a message;
+                # a longer backlog is worked off over the next turns
+                messages = await self.memory_service.get_history_range_async(
+                    chat_id,
+                    meta.get("summary_through_id") or 0,
+                    before_id,
+                    settings.CHAT_CONTEXT_MESSAGES,
+                    db
+                )
+                if not messages:
+                    return
+
+                summary = await self._summarize(meta.get("summary") or "", messages, model_id, db)
+                await self.memory_service.update_memory_meta_async(chat_id, {
+                    "summary": summary,
+                    "summary_through_id": messages[-1]["id"]
+                }, db)
+        except Exception as e:
+            # The messages stay unsummarized and are retried next turn
+            logger.warning("Summary update error for chat %s: %s", chat_id, e)
+        finally:
+            self._summarizing.discard(chat_id)
+
+    async def _summarize(
+        self,
+        summary: str,
+        messages: List[Dict[str, Any]],
+        model_id: Optional[int],
+        db: AsyncSession
+    ) -> str:
+        transcript = "\n".join(f"{msg['role'].capitalize()}: {msg['content']}" for msg in messages)
+
+        if model_id and settings.CHAT_SUMMARY_USE_LLM:
+            try:
+                response = await self.llm_service.get_completion(
+                    model_id,
+                    [
+                        {"role": "system", "content": SUMMARY_INSTRUCTIONS},
+                        {
+                            "role": "user",
+                            "content": f"Current summary:\n{summary or '(none)'}\n\nNew messages:\n{transcript}"
+                        }
+                    ],
+                    db,
+                    priority="background",
+                    max_tokens=settings.CHAT_SUMMARY_MAX_TOKENS
+                )
+                return response["content"].strip()
+            except Exception as e:
+                logger.warning("LLM summary error, keeping excerpts instead: %s", e)
+
+        # Excerpt fallback: append short snippets, keeping the newest ones
+        excerpts = [
+            f"{msg['role'].capitalize()}: {msg['content'][:100]}"
+            for msg in messages
+        ]
+        lines = (summary.split("\n") if summary else []) + excerpts
+        while len(lines) > 1 and count_tokens("\n".join(lines)) > settings.CHAT_SUMMARY_MAX_TOKENS:
+            lines.pop(0)
+        return "\n".join(lines)
+
+    async def close(self) -> None:
+        """Cancel summaries still in progress"""
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,220 @@
+import hashlib
+import json
+import logging
+import math
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+from app.core.config import settings
+from app.core.redis import redis_clients
+from app.models.llm_model import LLMModel
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_DIMENSIONS = 1024
+_WORD_RE = re.compile(r"\w+")
+
+
+def normalize_prompt(messages: List[Dict[str, str]]) -> str:
+    """Canonical text of a prompt window: roles kept, whitespace and case folded"""
+    return "\n".join(
+        f"{msg['role']}: {' '.join(msg['content'].split()).lower()}"
+        for msg in messages
+    )
+
+
+def embed(text: str) -> Dict[int, float]:
+    """Local bag-of-words embedding: hashed unigrams and bigrams, L2-normalized"""
+    words = _WORD_RE.findall(text.lower())
+    vector: Dict[int, float] = {}
+    for term in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+        index = int.from_bytes(hashlib.md5(term.encode()).digest()[:4], "big") % EMBEDDING_DIMENSIONS
+        vector[index] = vector.get(index, 0.0) + 1.0
+
+    norm = math.sqrt(sum(value * value for value in vector.values()))
+    return {index: value / norm for index, value in vector.items()} if norm else {}
+
+
+def cosine_similarity(a: Dict[int, float], b: Dict[int, float]) -> float:
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(value * b.get(index, 0.0) for index, value in a.items())
+
+
+class ResponseCache:
+    """Opt-in cache of LLM completions.
+
+    Models opt in through ``configuration["response_cache"]`` (``true`` or a
+    dict with ``ttl``, ``max_entries`` and ``similarity_threshold``).
+    Responses are stored in Redis under a hash of the model, generation
+    parameters, caller scope and normalized prompt, with a per-model TTL and
+    LRU index. With a similarity threshold set, a local embedding index also
+    matches a near-identical final user message on the same model,
+    parameters, scope and preceding conversation.
+    """
+
+    def __init__(self):
+        self._local: Dict[str, OrderedDict] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def redis_client(self):
+        return redis_clients.async_client
+
+    @staticmethod
+    def _entry_key(model_id: int, digest: str) -> str:
+        return f"response_cache:{model_id}:{digest}"
+
+    @staticmethod
+    def _lru_key(model_id: int) -> str:
+        return f"response_cache:{model_id}:lru"
+
+    @staticmethod
+    def _stats_key(model_id: int) -> str:
+        return f"response_cache:{model_id}:stats"
+
+    @staticmethod
+    def options(model: LLMModel) -> Optional[Dict[str, Any]]:
+        """Cache options of a model, or None if it has not opted in"""
+        if not settings.RESPONSE_CACHE_ENABLED:
+            return None
+        configured = (model.configuration or {}).get("response_cache")
+        if not configured:
+            return None
+        configured = configured if isinstance(configured, dict) else {}
+        return {
+            "ttl": configured.get("ttl", settings.RESPONSE_CACHE_TTL),
+            "max_entries": configured.get("max_entries", settings.RESPONSE_CACHE_MAX_ENTRIES),
+            "similarity_threshold": configured.get("similarity_threshold"),
+        }
+
+    def prepare(
+        self,
+        model: LLMModel,
+        messages: List[Dict[str, str]],
+        params: Dict[str, Any],
+        scope: Optional[str]
+    ) -> Optional[Dict[str, Any]]:
+        """Build the lookup for a request, or None if it must not be cached"""
+        if scope is None:
+            return None
+        options = self.options(model)
+        if options is None:
+            return None
+
+        prompt = normalize_prompt(messages)
+        # Only the final user message is compared by similarity; the shared
+        # history would otherwise dominate the embedding
+        last_user = max((i for i, msg in enumerate(messages) if msg["role"] == "user"), default=None)
+        if last_user is None:
+            return None
+        question = normalize_prompt([messages[last_user]])
+        context = normalize_prompt(messages[:last_user] + messages[last_user + 1:])
+
+        # Everything but the final user message must match exactly, for both tiers
+        partition = json.dumps(
+            {
+                "model": model.model_name,
+                "provider": model.provider,
+                "params": params,
+                "scope": scope,
+                "context": hashlib.sha256(context.encode()).hexdigest(),
+            },
+            sort_keys=True,
+            default=str
+        )
+        return {
+            "model_id": model.id,
+            "options": options,
+            "partition": partition,
+            "question": question,
+            "digest": hashlib.sha256(f"{partition}\n{prompt}".encode()).hexdigest(),
+        }
+
+    async def get(self, lookup: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Cached response for a lookup, tagged with how it was found"""
+        model_id = lookup["model_id"]
+        try:
+            raw = await self.redis_client.get(self._entry_key(model_id, lookup["digest"]))
+            status, similarity, digest = "hit", 1.0, lookup["digest"]
+
+            if raw is None and lookup["options"]["similarity_threshold"]:
+                match = self._find_similar(lookup)
+                if match:
+                    digest, similarity = match
+                    raw = await self.redis_client.get(self._entry_key(model_id, digest))
+                    status = "similar_hit"
+
+            async with self.redis_client.pipeline(transaction=False) as pipe:
+                pipe.hincrby(self._stats_key(model_id), "hits" if raw else "misses", 1)
+                if raw:
+                    pipe.zadd(self._lru_key(model_id), {digest: time.time()})
+                await pipe.execute()
+        except Exception as e:
+            logger.warning("Response cache read error: %s", e)
+            return None
+
+        if raw is None:
+            return None
+
+        response = json.loads(raw)
+        response["cache"] = {"status": status, "similarity": round(similarity, 4)}
+        return response
+
+    async def put(self, lookup: Dict[str, Any], response: Dict[str, Any]) -> None:
+        """Store a response, evicting the model's least recently used entries"""
+        model_id = lookup["model_id"]
+        options = lookup["options"]
+        entry = {key: value for key, value in response.items() if key != "cache"}
+        try:
+            lru_key = self._lru_key(model_id)
+            async with self.redis_client.pipeline(transaction=False) as pipe:
+                pipe.set(self._entry_key(model_id, lookup["digest"]), json.dumps(entry), ex=options["ttl"])
+                pipe.zadd(lru_key, {lookup["digest"]: time.time()})
+                pipe.expire(lru_key, options["ttl"])
+                pipe.zcard(lru_key)
+                size = (await pipe.execute())[-1]
+
+            if size > options["max_entries"]:
+                evicted = await self.redis_client.zpopmin(lru_key, size - options["max_entries"])
+                if evicted:
+                    await self.redis_client.delete(
+                        *[self._entry_key(model_id, digest.decode()) for digest, _ in evicted]
+                    )
+        except Exception as e:
+            logger.warning("Response cache write error: %s", e)
+            return
+
+        if options["similarity_threshold"]:
+            self._remember(lookup)
+
+    def _remember(self, lookup: Dict[str, Any]) -> None:
+        with self._lock:
+            index = self._local.setdefault(lookup["partition"], OrderedDict())
+            index[lookup["digest"]] = embed(lookup["question"])
+            index.move_to_end(lookup["digest"])
+            while len(index) > settings.RESPONSE_CACHE_LOCAL_ENTRIES:
+                index.popitem(last=False)
+
+    def _find_similar(self, lookup: Dict[str, Any]):
+        """Closest stored question above the model's threshold, as (digest, similarity)"""
+        with self._lock:
+            candidates = list(self._local.get(lookup["partition"], {}).items())
+        if not candidates:
+            return None
+
+        vector = embed(lookup["question"])
+        best = max(
+            ((digest, cosine_similarity(vector, candidate)) for digest, candidate in candidates),
+            key=lambda match: match[1]
+        )
+        return best if best[1] >= lookup["options"]["similarity_threshold"] else None
+
+    async def get_stats(self, model_id: int) -> Dict[str, int]:
+        stats = await self.redis_client.hgetall(self._stats_key(model_id))
+        return {key.decode(): int(value) for key, value in stats.items()}
+
+
+response_cache = ResponseCache()
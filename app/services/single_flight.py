@@ -0,0 +1,198 @@
+import asyncio
+import copy
+import hashlib
+import json
+import logging
+import uuid
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Set
+from app.core.config import settings
+from app.core.redis import redis_clients
+
+logger = logging.getLogger(__name__)
+
+# Delete the lock only if it still belongs to the caller. KEYS: lock. ARGV: token.
+RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+def request_key(kind: str, **parts: Any) -> str:
+    """Canonical hash identifying a request"""
+    canonical = json.dumps({"kind": kind, **parts}, sort_keys=True, default=str)
+    return f"{kind}:{hashlib.sha256(canonical.encode()).hexdigest()}"
+
+
+class _SharedStream:
+    """Events of one upstream stream, replayed to every subscriber"""
+
+    def __init__(self):
+        self.events: List[Dict[str, Any]] = []
+        self.error: Optional[BaseException] = None
+        self.done = False
+        self.changed = asyncio.Condition()
+
+
+class SingleFlight:
+    """Coalesces identical concurrent requests into one upstream call.
+
+    Callers with the same key share the first caller's in-flight call and
+    each get their own copy of its result. A caller waits at most
+    ``SINGLE_FLIGHT_WAIT_TIMEOUT`` for the shared call before making its
+    own. With ``distributed=True`` a Redis lock extends this across workers:
+    the lock holder publishes its result under the lock's token, and other
+    workers poll for it until the wait runs out.
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, asyncio.Task] = {}
+        self._streams: Dict[str, _SharedStream] = {}
+        self._pumps: Set[asyncio.Task] = set()
+        self._release_script = None
+
+    @property
+    def redis_client(self):
+        client = redis_clients.async_client
+        if self._release_script is None:
+            self._release_script = client.register_script(RELEASE_LOCK_SCRIPT)
+        return client
+
+    async def run(
+        self,
+        key: str,
+        call: Callable[[], Awaitable[Any]],
+        distributed: bool = False
+    ) -> Any:
+        """Run ``call`` once for all concurrent callers with the same key"""
+        if not settings.SINGLE_FLIGHT_ENABLED:
+            return await call()
+
+        task = self._calls.get(key)
+        if task is None:
+            upstream = (lambda: self._run_distributed(key, call)) if distributed else call
+            task = asyncio.create_task(upstream())
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+            # The first caller owns the call and is not subject to the wait
+            return copy.deepcopy(await asyncio.shield(task))
+
+        try:
+            result = await asyncio.wait_for(asyncio.shield(task), settings.SINGLE_FLIGHT_WAIT_TIMEOUT)
+        except asyncio.TimeoutError:
+            return await call()
+        return copy.deepcopy(result)
+
+    async def stream(
+        self,
+        key: str,
+        open_stream: Callable[[], AsyncIterator[Dict[str, Any]]]
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Share one upstream stream between concurrent callers in this worker.
+
+        Late joiners first get the events already received, then follow along.
+        """
+        if not settings.SINGLE_FLIGHT_ENABLED:
+            async for event in open_stream():
+                yield event
+            return
+
+        shared = self._streams.get(key)
+        if shared is None:
+            shared = _SharedStream()
+            self._streams[key] = shared
+            # Owned by no caller, so one leaving does not end the stream for the rest
+            pump = asyncio.create_task(self._pump(key, shared, open_stream))
+            self._pumps.add(pump)
+            pump.add_done_callback(self._pumps.discard)
+
+        index = 0
+        while True:
+            async with shared.changed:
+                await shared.changed.wait_for(lambda: index < len(shared.events) or shared.done)
+                events = shared.events[index:]
+                done, error = shared.done, shared.error
+            for event in events:
+                yield copy.deepcopy(event)
+            index += len(events)
+            if done and index >= len(shared.events):
+                if error is not None:
+                    raise error
+                return
+
+    async def _pump(self, key: str, shared: _SharedStream, open_stream) -> None:
+        try:
+            async for event in open_stream():
+                async with shared.changed:
+                    shared.events.append(event)
+                    shared.changed.notify_all()
+        except Exception as e:
+            shared.error = e
+        finally:
+            if self._streams.get(key) is shared:
+                del self._streams[key]
+            async with shared.changed:
+                shared.done = True
+                shared.changed.notify_all()
+
+    def _forget(self, key: str, task: asyncio.Task) -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+
+    async def _run_distributed(self, key: str, call: Callable[[], Awaitable[Any]]) -> Any:
+        lock_key = f"single_flight:lock:{key}"
+        token = uuid.uuid4().hex
+        try:
+            acquired = await self.redis_client.set(
+                lock_key, token, nx=True, px=int(settings.SINGLE_FLIGHT_LOCK_TTL * 1000)
+            )
+        except Exception as e:
+            logger.warning("Single-flight lock error: %s", e)
+            return await call()
+
+        if acquired:
+            try:
+                result = await call()
+                try:
+                    await self.redis_client.set(
+                        f"single_flight:result:{key}:{token}",
+                        json.dumps(result),
+                        ex=settings.SINGLE_FLIGHT_RESULT_TTL
+                    )
+                except Exception as e:
+                    logger.warning("Single-flight publish error: %s", e)
+                return result
+            finally:
+                try:
+                    await self._release_script(keys=[lock_key], args=[token])
+                except Exception as e:
+                    logger.warning("Single-flight unlock error: %s", e)
+
+        return await self._wait_for_remote(lock_key, key, call)
+
+    async def _wait_for_remote(self, lock_key: str, key: str, call: Callable[[], Awaitable[Any]]) -> Any:
+        """Poll for the lock holder's result, then fall back to calling ourselves"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + settings.SINGLE_FLIGHT_WAIT_TIMEOUT
+        delay = 0.05
+        try:
+            holder = await self.redis_client.get(lock_key)
+            while holder is not None and loop.time() < deadline:
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 0.5)
+                result_key = f"single_flight:result:{key}:{holder.decode()}"
+                raw = await self.redis_client.get(result_key)
+                if raw is None and await self.redis_client.get(lock_key) != holder:
+                    # The lock is gone; the result is there now or never will be
+                    raw = await self.redis_client.get(result_key)
+                    if raw is None:
+                        break
+                if raw is not None:
+                    return json.loads(raw)
+        except Exception as e:
+            logger.warning("Single-flight wait error: %s", e)
+        return await call()
+
+
+single_flight = SingleFlight()
@@ -0,0 +1,114 @@
+from functools import lru_cache
+from typing import Any, Dict, Optional
+from sqlalchemy import select, update
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal
+from app.models.chat import Message
+
+try:
+    import tiktoken
+except ImportError:  # Optional; the approximate counter is used instead
+    tiktoken = None
+
+
+# Token counts are cached per message in message_metadata[TOKEN_COUNTS_KEY],
+# keyed by model family, so history is not re-tokenized on every turn.
+TOKEN_COUNTS_KEY = "token_counts"
+
+# Families counts are stored for, with the average characters per token used
+# when no local tokenizer is available
+TOKENIZER_FAMILIES = {
+    "openai": 4.0,
+    "anthropic": 3.5,
+    "approx": 4.0,
+}
+
+# Role and separator tokens each chat message adds on top of its content
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# Usage fields holding the response's own token count, per provider
+OUTPUT_USAGE_FIELDS = {
+    "openai": "completion_tokens",
+    "anthropic": "output_tokens",
+}
+
+
+def model_family(provider: Optional[str]) -> str:
+    """Family whose tokenizer counts apply to models of ``provider``"""
+    return provider if provider in TOKENIZER_FAMILIES else "approx"
+
+
+def estimate_tokens(text: str, chars_per_token: float = 4.0) -> int:
+    """Approximate token count from the text length"""
+    if not text:
+        return 0
+    return int(len(text) / chars_per_token) + 1
+
+
+@lru_cache(maxsize=1)
+def _openai_encoding():
+    return tiktoken.get_encoding(settings.TIKTOKEN_ENCODING)
+
+
+def count_tokens(text: str, family: str = "approx") -> int:
+    """Count the tokens of ``text`` for a model family"""
+    if family == "openai" and tiktoken is not None and settings.TIKTOKEN_ENCODING:
+        try:
+            return len(_openai_encoding().encode(text or "", disallowed_special=()))
+        except Exception:
+            pass
+    return estimate_tokens(text, TOKENIZER_FAMILIES.get(family, 4.0))
+
+
+def token_counts(text: str, usage: Optional[Dict[str, Any]] = None, provider: Optional[str] = None) -> Dict[str, int]:
+    """Counts to store with a message, for every tokenizer family.
+
+    For an assistant message, ``usage`` from its provider gives the exact
+    count for that provider's family.
+    """
+    counts = {family: count_tokens(text, family) for family in TOKENIZER_FAMILIES}
+    output_tokens = (usage or {}).get(OUTPUT_USAGE_FIELDS.get(provider, ""))
+    if isinstance(output_tokens, int):
+        counts[model_family(provider)] = output_tokens
+    return counts
+
+
+def message_tokens(message: Dict[str, Any], family: str) -> int:
+    """Tokens a history entry takes in the prompt, using its cached count when present"""
+    counts = (message.get("metadata") or {}).get(TOKEN_COUNTS_KEY) or {}
+    tokens = counts.get(family)
+    if tokens is None:
+        tokens = count_tokens(message["content"], family)
+    return tokens + MESSAGE_OVERHEAD_TOKENS
+
+
+async def backfill_token_counts(batch_size: int = 500) -> int:
+    """Store token counts on messages written before they were recorded.
+
+    Walks the table by id in batches, one commit per batch, and returns the
+    number of messages updated. Safe to rerun; counted rows are skipped.
+    """
+    updated = 0
+    last_id = 0
+    while True:
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                select(Message.id, Message.content, Message.message_metadata)
+                .where(Message.id > last_id, Message.message_metadata[TOKEN_COUNTS_KEY].is_(None))
+                .order_by(Message.id)
+                .limit(batch_size)
+            )
+            rows = result.all()
+            if not rows:
+                return updated
+
+            values = []
+            for row in rows:
+                metadata = row.message_metadata or {}
+                counts = token_counts(row.content, metadata.get("usage"), metadata.get("provider"))
+                values.append({"id": row.id, "message_metadata": {**metadata, TOKEN_COUNTS_KEY: counts}})
+            await db.execute(update(Message), values)
+            await db.commit()
+
+        updated += len(rows)
+        last_id = rows[-1].id
@@ -0,0 +1,116 @@
+import asyncio
+from types import SimpleNamespace
+import pytest
+from app.core.config import settings
+from app.services.circuit_breaker import CircuitBreaker, CircuitBreakerRegistry
+
+
+@pytest.fixture(autouse=True)
+def breaker_settings(monkeypatch):
+    monkeypatch.setattr(settings, "MCP_BREAKER_WINDOW", 60)
+    monkeypatch.setattr(settings, "MCP_BREAKER_MIN_CALLS", 4)
+    monkeypatch.setattr(settings, "MCP_BREAKER_ERROR_RATE", 0.5)
+    monkeypatch.setattr(settings, "MCP_BREAKER_SLOW_CALL", 1.0)
+    monkeypatch.setattr(settings, "MCP_BREAKER_OPEN_DURATION", 0.05)
+    monkeypatch.setattr(settings, "MCP_BREAKER_PROBE_TIMEOUT", 0.1)
+
+
+def breaker(healthy: bool = False) -> CircuitBreaker:
+    async def probe():
+        return healthy
+
+    return CircuitBreaker("http://mcp.test", probe)
+
+
+@pytest.mark.asyncio
+async def test_stays_closed_below_min_calls():
+    circuit = breaker()
+    for _ in range(3):
+        circuit.record(False, 0.1, "boom")
+    assert circuit.allow()
+    await circuit.aclose()
+
+
+@pytest.mark.asyncio
+async def test_opens_at_error_rate():
+    circuit = breaker()
+    circuit.record(True, 0.1)
+    circuit.record(True, 0.1)
+    circuit.record(False, 0.1)
+    assert circuit.allow()
+
+    circuit.record(False, 0.1, "boom")
+    assert not circuit.allow()
+    snapshot = circuit.snapshot()
+    assert snapshot["state"] == "open"
+    assert snapshot["last_error"] == "boom"
+    await circuit.aclose()
+
+
+@pytest.mark.asyncio
+async def test_slow_calls_count_as_failures():
+    circuit = breaker()
+    circuit.record(True, 0.1)
+    circuit.record(True, 0.1)
+    circuit.record(True, 2.0)
+    circuit.record(True, 2.0)
+    assert circuit.state == "open"
+    await circuit.aclose()
+
+
+@pytest.mark.asyncio
+async def test_half_open_admits_one_trial_that_closes_the_circuit():
+    circuit = breaker()
+    for _ in range(4):
+        circuit.record(False, 0.1)
+    await asyncio.sleep(0.06)
+
+    assert circuit.allow()
+    assert circuit.state == "half_open"
+    assert not circuit.allow()
+
+    circuit.record(True, 0.1)
+    assert circuit.state == "closed"
+    assert circuit.snapshot()["calls"] == 0
+    await circuit.aclose()
+
+
+@pytest.mark.asyncio
+async def test_failed_trial_reopens():
+    circuit = breaker()
+    for _ in range(4):
+        circuit.record(False, 0.1)
+    await asyncio.sleep(0.06)
+
+    assert circuit.allow()
+    circuit.record(False, 0.1)
+    assert circuit.state == "open"
+    assert not circuit.allow()
+    await circuit.aclose()
+
+
+@pytest.mark.asyncio
+async def test_successful_probe_closes():
+    circuit = breaker(healthy=True)
+    for _ in range(4):
+        circuit.record(False, 0.1)
+    await asyncio.sleep(0.1)
+    assert circuit.state == "closed"
+    await circuit.aclose()
+
+
+@pytest.mark.asyncio
+async def test_registry_replaces_breaker_when_url_changes():
+    registry = CircuitBreakerRegistry()
+
+    async def probe():
+        return True
+
+    server = SimpleNamespace(id=1, server_url="http://a.test")
+    first = registry.get(server, probe)
+    assert registry.get(server, probe) is first
+
+    server.server_url = "http://b.test"
+    assert registry.get(server, probe) is not first
+    assert registry.snapshot(2) == {"state": "closed", "calls": 0}
+    await registry.aclose()
@@ -0,0 +1,52 @@
+from datetime import datetime, timedelta, timezone
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+from app.models.chat import Message
+from app.services.memory_service import MemoryService
+
+START = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://")
+    Message.__table__.create(engine)
+    with Session(engine) as session:
+        # Messages 3 and 4 share a timestamp, so order falls back to id
+        offsets = {1: 0, 2: 1, 3: 2, 4: 2, 5: 3, 6: 4}
+        for message_id, offset in offsets.items():
+            session.add(Message(
+                id=message_id,
+                chat_id=1,
+                role="user" if message_id % 2 else "assistant",
+                content=f"message {message_id}",
+                created_at=START + timedelta(seconds=offset)
+            ))
+        session.add(Message(id=7, chat_id=2, role="user", content="other chat", created_at=START))
+        session.commit()
+        yield session
+
+
+def ids(history):
+    return [message["id"] for message in history]
+
+
+def test_full_history_is_chronological(db):
+    assert ids(MemoryService().get_conversation_history(1, db=db)) == [1, 2, 3, 4, 5, 6]
+
+
+def test_limit_reads_the_tail_in_order(db):
+    assert ids(MemoryService().get_conversation_history(1, limit=3, db=db)) == [4, 5, 6]
+
+
+def test_keyset_page_before_cursor(db):
+    service = MemoryService()
+    assert ids(service.get_conversation_history(1, limit=2, db=db, before_id=5)) == [3, 4]
+    # Ties on created_at are broken by id
+    assert ids(service.get_conversation_history(1, limit=2, db=db, before_id=4)) == [2, 3]
+    assert ids(service.get_conversation_history(1, limit=2, db=db, before_id=1)) == []
+
+
+def test_cursor_from_another_chat_matches_nothing(db):
+    assert MemoryService().get_conversation_history(1, limit=2, db=db, before_id=7) == []
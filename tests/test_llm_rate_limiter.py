@@ -0,0 +1,196 @@
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+import pytest
+from app.core.config import settings
+from app.services.llm_rate_limiter import LLMRateLimiter, LLMRateLimitExceeded, parse_reset
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("20", 20.0),
+    ("0.5", 0.5),
+    ("-3", 0.0),
+    ("1m30s", 90.0),
+    ("6ms", 0.006),
+    ("1h2m", 3720.0),
+])
+def test_parse_reset_durations(value, expected):
+    assert parse_reset(value) == pytest.approx(expected)
+
+
+def test_parse_reset_timestamp():
+    reset_at = datetime.now(timezone.utc) + timedelta(seconds=30)
+    seconds = parse_reset(reset_at.isoformat().replace("+00:00", "Z"))
+    assert 28 <= seconds <= 30
+
+
+def test_parse_reset_past_timestamp_is_zero():
+    assert parse_reset(datetime.fromtimestamp(time.time() - 60, timezone.utc).isoformat()) == 0.0
+
+
+@pytest.mark.parametrize("value", [None, "", "soon"])
+def test_parse_reset_unparseable(value):
+    assert parse_reset(value) is None
+
+
+class FakeClock:
+    """Wall clock that only moves when the limiter sleeps"""
+
+    def __init__(self):
+        self.now = 1_000_000.0
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    async def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+        await self._real_sleep(0)
+
+
+class FakeRedis:
+    """The pause key plus a Python version of the limiter's request bucket"""
+
+    def __init__(self):
+        self.values = {}
+        self.buckets = {}
+
+    async def get(self, key):
+        return self.values.get(key)
+
+    async def set(self, key, value, ex=None):
+        self.values[key] = str(value)
+
+    async def take(self, keys, args, client=None):
+        now, rpm = float(args[0]), int(args[1])
+        paused_until = float(self.values.get(keys[2], 0))
+        if paused_until > now:
+            return str(paused_until - now)
+        level, ts = self.buckets.get(keys[0], (rpm, now))
+        level = min(rpm, level + (now - ts) * rpm / 60)
+        if level < 1:
+            return str((1 - level) * 60 / rpm)
+        self.buckets[keys[0]] = (level - 1, now)
+        return "0"
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    fake._real_sleep = asyncio.sleep
+    monkeypatch.setattr(time, "time", fake.time)
+    monkeypatch.setattr(asyncio, "sleep", fake.sleep)
+    return fake
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    fake = FakeRedis()
+    monkeypatch.setattr(LLMRateLimiter, "redis_client", property(lambda self: fake))
+    return fake
+
+
+@pytest.fixture
+def limiter(redis, monkeypatch):
+    monkeypatch.setattr(settings, "LLM_RATE_LIMIT_ENABLED", True)
+    monkeypatch.setattr(settings, "LLM_RATE_LIMIT_MAX_WAIT", 30.0)
+    rate_limiter = LLMRateLimiter()
+    rate_limiter._take_script = redis.take
+    return rate_limiter
+
+
+def model(requests_per_minute=60, provider="openai"):
+    return SimpleNamespace(
+        id=1, name="test-model", provider=provider,
+        configuration={"rate_limit": {"requests_per_minute": requests_per_minute}}
+    )
+
+
+@pytest.mark.asyncio
+async def test_empty_bucket_waits_for_refill(clock, limiter):
+    llm = model(requests_per_minute=4)
+    for _ in range(4):
+        async with limiter.slot(llm, 0):
+            pass
+    assert clock.sleeps == []
+
+    async with limiter.slot(llm, 0):
+        pass
+    assert clock.sleeps == [pytest.approx(15.0)]
+
+
+@pytest.mark.asyncio
+async def test_wait_past_max_wait_fails(clock, limiter, monkeypatch):
+    monkeypatch.setattr(settings, "LLM_RATE_LIMIT_MAX_WAIT", 10.0)
+    llm = model(requests_per_minute=1)
+    async with limiter.slot(llm, 0):
+        pass
+
+    with pytest.raises(LLMRateLimitExceeded) as excinfo:
+        async with limiter.slot(llm, 0):
+            pass
+    assert excinfo.value.retry_after == pytest.approx(60.0)
+    assert clock.sleeps == []
+
+
+@pytest.mark.asyncio
+async def test_interactive_calls_go_before_background(limiter):
+    llm = model()
+    release = asyncio.Event()
+    takes = []
+    order = []
+
+    async def take(keys, args, client=None):
+        takes.append(args)
+        if len(takes) == 1:
+            # The head of the queue is still polling the bucket
+            await release.wait()
+        return "0"
+
+    limiter._take_script = take
+
+    async def call(name, priority):
+        async with limiter.slot(llm, 0, priority=priority):
+            order.append(name)
+
+    head = asyncio.create_task(call("head", "interactive"))
+    await asyncio.sleep(0)
+    waiters = [
+        asyncio.create_task(call("background", "background")),
+        asyncio.create_task(call("interactive", "interactive")),
+    ]
+    await asyncio.sleep(0)
+    release.set()
+    await asyncio.gather(head, *waiters)
+    assert order == ["head", "interactive", "background"]
+
+
+@pytest.mark.asyncio
+async def test_observe_lowers_limits_and_pauses_when_exhausted(clock, limiter, redis):
+    llm = model(requests_per_minute=100)
+    await limiter.observe(llm, 200, {
+        "x-ratelimit-limit-requests": "50",
+        "x-ratelimit-remaining-requests": "0",
+        "x-ratelimit-reset-requests": "12s",
+    })
+    assert limiter.limits(llm)["requests"] == 50
+    assert float(redis.values["llm_rate:1:paused_until"]) == pytest.approx(clock.now + 12)
+
+
+@pytest.mark.asyncio
+async def test_observe_pauses_on_429_retry_after(clock, limiter, redis):
+    await limiter.observe(model(), 429, {"retry-after": "7"})
+    assert float(redis.values["llm_rate:1:paused_until"]) == pytest.approx(clock.now + 7)
+
+
+@pytest.mark.asyncio
+async def test_pause_holds_calls_back_and_never_shortens(clock, limiter, redis):
+    await limiter.pause(1, 20)
+    await limiter.pause(1, 5)
+    assert float(redis.values["llm_rate:1:paused_until"]) == pytest.approx(clock.now + 20)
+
+    async with limiter.slot(model(), 0):
+        pass
+    assert clock.sleeps == [pytest.approx(20.0)]
@@ -0,0 +1,126 @@
+import asyncio
+from types import SimpleNamespace
+import httpx
+import pytest
+from app.core.config import settings
+from app.services.llm_resilience import (
+    LatencyTracker,
+    LLMProviderError,
+    hedged,
+    retry_after_seconds,
+    retry_delay,
+)
+
+POLICY = {"max_attempts": 3, "base_delay": 0.5, "max_delay": 10.0, "deadline": 30.0}
+
+
+def test_retry_delay_backs_off_within_the_policy_cap():
+    error = LLMProviderError("overloaded", status_code=503)
+    for attempt in (1, 2):
+        delay = retry_delay(error, attempt, POLICY)
+        assert 0 <= delay <= min(POLICY["max_delay"], POLICY["base_delay"] * 2 ** (attempt - 1))
+
+
+def test_retry_delay_gives_up_after_max_attempts():
+    assert retry_delay(LLMProviderError("overloaded", status_code=503), 3, POLICY) is None
+
+
+def test_retry_delay_does_not_retry_client_errors():
+    assert retry_delay(LLMProviderError("bad request", status_code=400), 1, POLICY) is None
+    assert retry_delay(ValueError("unsupported"), 1, POLICY) is None
+
+
+def test_retry_delay_retries_transport_errors():
+    assert retry_delay(httpx.ConnectError("refused"), 1, POLICY) is not None
+
+
+def test_retry_delay_honours_retry_after():
+    error = LLMProviderError("rate limited", status_code=429, retry_after=4.0)
+    assert retry_delay(error, 1, POLICY) >= 4.0
+
+
+def test_retry_delay_fails_over_on_long_retry_after():
+    error = LLMProviderError("rate limited", status_code=429, retry_after=60.0)
+    assert retry_delay(error, 1, POLICY) is None
+
+
+def test_retry_after_seconds():
+    assert retry_after_seconds({"retry-after": "2.5"}) == 2.5
+    assert retry_after_seconds({"retry-after": "-1"}) == 0.0
+    assert retry_after_seconds({"retry-after": "Wed, 21 Oct 2026 07:28:00 GMT"}) is None
+    assert retry_after_seconds({}) is None
+
+
+@pytest.mark.asyncio
+async def test_hedged_without_delay_makes_one_call():
+    calls = []
+
+    async def call():
+        calls.append(1)
+        return "ok"
+
+    assert await hedged(call, None) == "ok"
+    assert len(calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_hedged_fast_call_is_not_hedged():
+    calls = []
+
+    async def call():
+        calls.append(1)
+        return "ok"
+
+    assert await hedged(call, 0.05) == "ok"
+    assert len(calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_hedged_second_attempt_wins_and_first_is_cancelled():
+    cancelled = asyncio.Event()
+    attempts = []
+
+    async def call():
+        attempts.append(1)
+        if len(attempts) == 1:
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+        return f"attempt {len(attempts)}"
+
+    assert await hedged(call, 0.01) == "attempt 2"
+    await asyncio.wait_for(cancelled.wait(), 1)
+
+
+@pytest.mark.asyncio
+async def test_hedged_raises_when_both_attempts_fail():
+    async def call():
+        await asyncio.sleep(0.02)
+        raise LLMProviderError("overloaded", status_code=503)
+
+    with pytest.raises(LLMProviderError):
+        await hedged(call, 0.01)
+
+
+def test_latency_tracker_needs_enough_samples(monkeypatch):
+    monkeypatch.setattr(settings, "LLM_HEDGE_MIN_SAMPLES", 5)
+    tracker = LatencyTracker()
+    for seconds in (1.0, 2.0, 3.0, 4.0):
+        tracker.record(1, seconds)
+    assert tracker.quantile(1, 0.5) is None
+
+    tracker.record(1, 5.0)
+    assert tracker.quantile(1, 0.5) == 3.0
+    assert tracker.quantile(1, 0.99) == 5.0
+
+
+def test_hedge_delay_is_opt_in_and_floored(monkeypatch):
+    monkeypatch.setattr(settings, "LLM_HEDGE_MIN_SAMPLES", 1)
+    tracker = LatencyTracker()
+    tracker.record(1, 0.2)
+
+    assert tracker.hedge_delay(SimpleNamespace(id=1, configuration={})) is None
+    model = SimpleNamespace(id=1, configuration={"hedge": {"min_delay": 1.5}})
+    assert tracker.hedge_delay(model) == 1.5
@@ -0,0 +1,89 @@
+import json
+import pytest
+from sqlalchemy.exc import IntegrityError
+from app.core.config import settings
+from app.services import post_response
+from app.services.post_response import DEAD_JOBS_KEY, PENDING_JOBS_KEY, PostResponsePipeline
+
+
+class FakeRedis:
+    def __init__(self):
+        self.lists = {}
+
+    async def rpush(self, key, value):
+        self.lists.setdefault(key, []).append(value)
+
+    async def lpop(self, key, count):
+        items = self.lists.get(key, [])
+        popped, self.lists[key] = items[:count], items[count:]
+        return popped
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    fake = FakeRedis()
+    monkeypatch.setattr(PostResponsePipeline, "redis_client", property(lambda self: fake))
+    monkeypatch.setattr(settings, "POST_RESPONSE_RETRY_BASE_DELAY", 0.0)
+    return fake
+
+
+@pytest.mark.asyncio
+async def test_failing_job_is_spilled_with_its_attempts(redis, monkeypatch):
+    monkeypatch.setattr(settings, "POST_RESPONSE_MAX_RETRIES", 2)
+    pipeline = PostResponsePipeline()
+
+    async def handler(payload):
+        raise RuntimeError("database down")
+
+    pipeline.register("persist", handler)
+    pipeline.submit(1, "persist", {"id": 7})
+    await pipeline.wait_for_chat(1)
+
+    [raw_job] = redis.lists[PENDING_JOBS_KEY]
+    assert json.loads(raw_job)["attempts"] == 2
+
+
+@pytest.mark.asyncio
+async def test_replays_are_counted_and_capped(redis, monkeypatch):
+    monkeypatch.setattr(settings, "POST_RESPONSE_MAX_RETRIES", 1)
+    monkeypatch.setattr(settings, "POST_RESPONSE_MAX_REPLAYS", 2)
+    pipeline = PostResponsePipeline()
+
+    async def handler(payload):
+        raise RuntimeError("database down")
+
+    pipeline.register("persist", handler)
+    pipeline.submit(1, "persist", {"id": 7})
+    await pipeline.wait_for_chat(1)
+
+    for _ in range(2):
+        assert await pipeline.replay_pending() == 1
+        await pipeline.wait_for_chat(1)
+    assert await pipeline.replay_pending() == 1
+
+    assert not redis.lists[PENDING_JOBS_KEY]
+    [raw_job] = redis.lists[DEAD_JOBS_KEY]
+    job = json.loads(raw_job)
+    assert job["attempts"] == 3
+    assert job["replays"] == 3
+
+
+@pytest.mark.asyncio
+async def test_integrity_errors_are_not_retried(redis, monkeypatch):
+    errors = []
+    monkeypatch.setattr(post_response.logger, "error", lambda *args: errors.append(args))
+    pipeline = PostResponsePipeline()
+    calls = []
+
+    async def handler(payload):
+        calls.append(payload)
+        raise IntegrityError("INSERT INTO messages", {}, Exception("foreign key violation"))
+
+    pipeline.register("persist", handler)
+    pipeline.submit(1, "persist", {"id": 7})
+    await pipeline.wait_for_chat(1)
+
+    assert len(calls) == 1
+    assert PENDING_JOBS_KEY not in redis.lists
+    assert len(redis.lists[DEAD_JOBS_KEY]) == 1
+    assert errors
@@ -0,0 +1,101 @@
+"""EXPLAIN checks that the chat hot paths are served by their indexes.
+
+Needs a scratch PostgreSQL database in ``TEST_DATABASE_URL``; the tables
+are created in a throwaway schema that is dropped afterwards.
+"""
+import json
+import os
+import uuid
+import pytest
+from sqlalchemy import create_engine, select, text
+from sqlalchemy.dialects import postgresql
+from app.core.database import Base
+from app.models import Chat, ChatSession
+from app.services.memory_service import MemoryService
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+
+pytestmark = pytest.mark.skipif(not TEST_DATABASE_URL, reason="TEST_DATABASE_URL is not set")
+
+
+@pytest.fixture(scope="module")
+def connection():
+    schema = f"plan_check_{uuid.uuid4().hex[:8]}"
+    admin_engine = create_engine(TEST_DATABASE_URL)
+    with admin_engine.begin() as conn:
+        conn.execute(text(f"CREATE SCHEMA {schema}"))
+
+    engine = create_engine(TEST_DATABASE_URL, connect_args={"options": f"-csearch_path={schema}"})
+    try:
+        Base.metadata.create_all(engine)
+        with engine.begin() as conn:
+            conn.execute(text(
+                "INSERT INTO users (id, username, email, hashed_password) "
+                "SELECT g, 'user' || g, 'user' || g || '@example.com', 'x' FROM generate_series(1, 50) g"
+            ))
+            conn.execute(text(
+                "INSERT INTO chats (id, title, user_id, updated_at) "
+                "SELECT g, 'chat ' || g, 1 + g % 50, now() - g * interval '1 minute' "
+                "FROM generate_series(1, 500) g"
+            ))
+            conn.execute(text(
+                "INSERT INTO messages (chat_id, role, content, created_at) "
+                "SELECT 1 + g % 500, 'user', 'message ' || g, now() - g * interval '1 second' "
+                "FROM generate_series(1, 20000) g"
+            ))
+            conn.execute(text(
+                "INSERT INTO chat_sessions (session_id, chat_id) "
+                "SELECT 'session_' || g, g FROM generate_series(1, 500) g"
+            ))
+            conn.execute(text("ANALYZE"))
+
+        with engine.connect() as conn:
+            # The tables are small; ask whether an index can serve the query
+            conn.execute(text("SET enable_seqscan = off"))
+            yield conn
+    finally:
+        engine.dispose()
+        with admin_engine.begin() as conn:
+            conn.execute(text(f"DROP SCHEMA {schema} CASCADE"))
+        admin_engine.dispose()
+
+
+def plan_nodes(conn, statement):
+    sql = str(statement.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}))
+    plan = conn.execute(text(f"EXPLAIN (FORMAT JSON) {sql}")).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+
+    nodes, stack = [], [plan[0]["Plan"]]
+    while stack:
+        node = stack.pop()
+        nodes.append(node)
+        stack.extend(node.get("Plans", []))
+    return nodes
+
+
+def assert_uses_index(conn, statement, table, index):
+    nodes = plan_nodes(conn, statement)
+    assert not [node for node in nodes if node["Node Type"] == "Seq Scan" and node.get("Relation Name") == table]
+    assert index in {node.get("Index Name") for node in nodes}
+
+
+def test_history_tail_uses_chat_created_at_index(connection):
+    statement = MemoryService._history_query(1, 50, None)
+    assert_uses_index(connection, statement, "messages", "ix_messages_chat_id_created_at_id")
+
+
+def test_history_page_uses_chat_created_at_index(connection):
+    before_id = connection.execute(text("SELECT max(id) FROM messages WHERE chat_id = 1")).scalar()
+    statement = MemoryService._history_query(1, 50, before_id)
+    assert_uses_index(connection, statement, "messages", "ix_messages_chat_id_created_at_id")
+
+
+def test_chat_list_uses_user_updated_at_index(connection):
+    statement = select(Chat).where(Chat.user_id == 1).order_by(Chat.updated_at.desc())
+    assert_uses_index(connection, statement, "chats", "ix_chats_user_id_updated_at")
+
+
+def test_session_lookup_uses_chat_id_index(connection):
+    statement = select(ChatSession).where(ChatSession.chat_id == 1)
+    assert_uses_index(connection, statement, "chat_sessions", "ix_chat_sessions_chat_id")
@@ -0,0 +1,125 @@
+import asyncio
+import pytest
+from app.core.config import settings
+from app.services.single_flight import SingleFlight, request_key
+
+
+def test_request_key_ignores_argument_order():
+    assert request_key("llm", a=1, b={"x": 1, "y": 2}) == request_key("llm", b={"y": 2, "x": 1}, a=1)
+    assert request_key("llm", a=1) != request_key("mcp", a=1)
+
+
+@pytest.mark.asyncio
+async def test_concurrent_callers_share_one_call():
+    flight = SingleFlight()
+    calls = []
+
+    async def call():
+        calls.append(1)
+        await asyncio.sleep(0.02)
+        return {"content": "answer"}
+
+    results = await asyncio.gather(*(flight.run("key", call) for _ in range(5)))
+    assert len(calls) == 1
+    assert results == [{"content": "answer"}] * 5
+
+    # Every caller gets its own copy
+    results[0]["content"] = "changed"
+    assert results[1]["content"] == "answer"
+
+
+@pytest.mark.asyncio
+async def test_sequential_callers_do_not_share():
+    flight = SingleFlight()
+    calls = []
+
+    async def call():
+        calls.append(1)
+        return len(calls)
+
+    assert await flight.run("key", call) == 1
+    assert await flight.run("key", call) == 2
+
+
+@pytest.mark.asyncio
+async def test_waiter_falls_back_to_its_own_call(monkeypatch):
+    monkeypatch.setattr(settings, "SINGLE_FLIGHT_WAIT_TIMEOUT", 0.01)
+    flight = SingleFlight()
+
+    async def slow():
+        await asyncio.sleep(0.2)
+        return "shared"
+
+    async def own():
+        return "own"
+
+    owner = asyncio.create_task(flight.run("key", slow))
+    await asyncio.sleep(0)
+    assert await flight.run("key", own) == "own"
+    assert await owner == "shared"
+
+
+@pytest.mark.asyncio
+async def test_errors_reach_every_caller():
+    flight = SingleFlight()
+
+    async def call():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("upstream failed")
+
+    results = await asyncio.gather(*(flight.run("key", call) for _ in range(3)), return_exceptions=True)
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+
+@pytest.mark.asyncio
+async def test_disabled_runs_every_call(monkeypatch):
+    monkeypatch.setattr(settings, "SINGLE_FLIGHT_ENABLED", False)
+    flight = SingleFlight()
+    calls = []
+
+    async def call():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+
+    await asyncio.gather(flight.run("key", call), flight.run("key", call))
+    assert len(calls) == 2
+
+
+@pytest.mark.asyncio
+async def test_stream_is_shared_and_replayed_to_late_joiners():
+    flight = SingleFlight()
+    opened = []
+    first_event_sent = asyncio.Event()
+
+    async def open_stream():
+        opened.append(1)
+        for index in range(3):
+            yield {"type": "delta", "content": str(index)}
+            first_event_sent.set()
+            await asyncio.sleep(0.01)
+
+    async def consume():
+        return [event["content"] async for event in flight.stream("key", open_stream)]
+
+    first = asyncio.create_task(consume())
+    await first_event_sent.wait()
+    late = asyncio.create_task(consume())
+
+    assert await first == ["0", "1", "2"]
+    assert await late == ["0", "1", "2"]
+    assert len(opened) == 1
+
+
+@pytest.mark.asyncio
+async def test_stream_error_reaches_subscribers():
+    flight = SingleFlight()
+
+    async def open_stream():
+        yield {"type": "delta", "content": "partial"}
+        raise RuntimeError("stream broke")
+
+    events = []
+    with pytest.raises(RuntimeError):
+        async for event in flight.stream("key", open_stream):
+            events.append(event)
+    assert events == [{"type": "delta", "content": "partial"}]